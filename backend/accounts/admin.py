@@ -1,17 +1,22 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
+from paymall.admin import LargeTableAdmin
 from .models import User, PaymentMethod
 
 class CustomUserAdmin(UserAdmin):
+    paginator = LargeTableAdmin.paginator
+    show_full_result_count = False
     list_display = ('username', 'email', 'first_name', 'last_name', 'is_staff', 'has_credit_card', 'has_upi')
     fieldsets = UserAdmin.fieldsets + (
         ('Payment Information', {'fields': ('phone_number', 'profile_image', 'has_credit_card', 'has_upi')}),
     )
 
-class PaymentMethodAdmin(admin.ModelAdmin):
+class PaymentMethodAdmin(LargeTableAdmin):
     list_display = ('user', 'payment_type', 'is_default', 'created_at')
     list_filter = ('payment_type', 'is_default')
+    list_select_related = ('user',)
     search_fields = ('user__email', 'user__username')
+    autocomplete_fields = ('user',)
 
 admin.site.register(User, CustomUserAdmin)
 admin.site.register(PaymentMethod, PaymentMethodAdmin)
@@ -0,0 +1,100 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+
+def _version_key(user_id):
+    return f"auth:user-version:{user_id}"
+
+
+def _user_key(user_id, version):
+    return f"auth:user:{user_id}:{version}"
+
+
+def invalidate_cached_user(user_id):
+    """Bump the user's version stamp so every cached copy becomes unreachable"""
+    try:
+        cache.incr(_version_key(user_id))
+    except ValueError:
+        cache.set(_version_key(user_id), 1, None)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that resolves the user through the cache.
+
+    Users are cached under their id plus a version stamp which is bumped
+    whenever a save of the user row commits, so a stale copy is never
+    served after a profile update or deactivation. Only workers sharing the
+    cache see the bump; with per-process memory the others serve their copy
+    for up to AUTH_USER_CACHE_TIMEOUT seconds.
+    """
+
+    def _user_id(self, validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(
+                _("Token contained no recognizable user identification")
+            ) from e
+
+    def _check_user(self, user, validated_token):
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(
+                api_settings.REVOKE_TOKEN_CLAIM
+            ) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(
+                    _("The user's password has been changed."), code="password_changed"
+                )
+        return user
+
+    def _user_not_found(self):
+        return AuthenticationFailed(_("User not found"), code="user_not_found")
+
+    def get_user(self, validated_token):
+        user_id = self._user_id(validated_token)
+        key = _user_key(user_id, cache.get(_version_key(user_id), 0))
+        user = cache.get(key)
+
+        if user is None:
+            try:
+                user = self.user_model.objects.get(**{api_settings.USER_ID_FIELD: user_id})
+            except self.user_model.DoesNotExist as e:
+                raise self._user_not_found() from e
+            cache.set(key, user, settings.AUTH_USER_CACHE_TIMEOUT)
+
+        return self._check_user(user, validated_token)
+
+    async def aget_user(self, validated_token):
+        user_id = self._user_id(validated_token)
+        key = _user_key(user_id, await cache.aget(_version_key(user_id), 0))
+        user = await cache.aget(key)
+
+        if user is None:
+            try:
+                user = await self.user_model.objects.aget(**{api_settings.USER_ID_FIELD: user_id})
+            except self.user_model.DoesNotExist as e:
+                raise self._user_not_found() from e
+            await cache.aset(key, user, settings.AUTH_USER_CACHE_TIMEOUT)
+
+        return self._check_user(user, validated_token)
+
+    async def aauthenticate(self, request):
+        """Async counterpart of authenticate() for plain Django async views"""
+        header = self.get_header(request)
+        if header is None:
+            return None
+
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
@@ -0,0 +1,35 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+from .hashing import amake_password, averify_password
+
+User = get_user_model()
+
+
+class PooledModelBackend(ModelBackend):
+    """
+    ModelBackend whose async path (``aauthenticate()``, used by the async
+    login view) hashes in the password hashing process pool rather than on
+    the event loop. The sync path is ModelBackend's.
+    """
+
+    async def aauthenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = await User._default_manager.aget_by_natural_key(username)
+        except User.DoesNotExist:
+            # Hash anyway so unknown emails take as long as wrong passwords
+            await amake_password(password)
+            return None
+
+        # Checked before is_active, so inactive accounts take as long too
+        correct, must_update = await averify_password(password, user.password)
+        if not correct or not self.user_can_authenticate(user):
+            return None
+        if must_update:
+            user.password = await amake_password(password)
+            await user.asave(update_fields=['password'])
+        return user
@@ -0,0 +1,48 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password, verify_password
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _init_worker(settings_module):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+
+    import django
+    django.setup()
+
+
+def get_pool():
+    """Process pool used for password hashing, created on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(
+                    max_workers=settings.PASSWORD_HASHING_WORKERS,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(os.environ['DJANGO_SETTINGS_MODULE'],),
+                )
+    return _pool
+
+
+async def amake_password(password):
+    """Hash a password in the process pool without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_pool(), make_password, password)
+
+
+async def averify_password(password, encoded):
+    """
+    Check a password in the process pool without blocking the event loop;
+    returns (correct, whether the hash must be upgraded)
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_pool(), verify_password, password, encoded)
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from accounts.revocation import revocation_store
+
+
+class Command(BaseCommand):
+    help = "Delete revoked refresh tokens that have already expired"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        deleted = revocation_store.purge_expired(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Purged {deleted} expired revoked tokens"))
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-19 16:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_revokedtoken'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='paymentmethod',
+            index=models.Index(fields=['user', 'payment_type', 'is_default'], name='paymethod_user_type_def_idx'),
+        ),
+    ]
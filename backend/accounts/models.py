@@ -44,5 +44,21 @@ class PaymentMethod(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        indexes = [
+            # Clearing the previous default of a payment type
+            models.Index(fields=['user', 'payment_type', 'is_default'], name='paymethod_user_type_def_idx'),
+        ]
+    
     def __str__(self):
         return f"{self.get_payment_type_display()} - {self.user.email}"
+
+class RevokedToken(models.Model):
+    """Refresh tokens revoked before expiry; rows are purged once they expire"""
+    jti = models.CharField(max_length=255, unique=True)
+    expires_at = models.DateTimeField(db_index=True)
+    # RevocationStore's sync cursor
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    
+    def __str__(self):
+        return self.jti
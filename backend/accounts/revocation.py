@@ -0,0 +1,114 @@
+import hashlib
+import math
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import RevokedToken
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings (no false negatives)"""
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, value):
+        for pos in self._positions(value):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, value):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(value))
+
+
+class RevocationStore:
+    """
+    Revoked refresh-token JTIs with a process-local Bloom filter in front.
+
+    Lookups for JTIs the filter has never seen return without touching the
+    database. The filter picks up revocations made by other processes every
+    TOKEN_REVOCATION_SYNC_INTERVAL seconds and is rebuilt from scratch every
+    TOKEN_REVOCATION_REBUILD_INTERVAL seconds so purged JTIs drop out of it.
+
+    Syncs read the rows created since the previous one, less
+    TOKEN_REVOCATION_SYNC_OVERLAP seconds. Ids are no cursor: a transaction
+    holding a lower id can commit after a higher one was read.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bloom = None
+        self._cursor = None
+        self._synced_at = 0
+        self._built_at = 0
+
+    def _rebuild(self, now):
+        bloom = BloomFilter(settings.TOKEN_REVOCATION_BLOOM_CAPACITY)
+        cursor = timezone.now()
+        for jti in RevokedToken.objects.filter(expires_at__gt=cursor).values_list('jti', flat=True).iterator():
+            bloom.add(jti)
+        self._bloom, self._cursor = bloom, cursor
+        self._built_at = self._synced_at = now
+
+    def _sync(self):
+        now = time.monotonic()
+        if self._bloom is not None and now - self._synced_at < settings.TOKEN_REVOCATION_SYNC_INTERVAL:
+            return
+
+        with self._lock:
+            if self._bloom is None or now - self._built_at >= settings.TOKEN_REVOCATION_REBUILD_INTERVAL:
+                self._rebuild(now)
+            elif now - self._synced_at >= settings.TOKEN_REVOCATION_SYNC_INTERVAL:
+                cursor = timezone.now()
+                since = self._cursor - timedelta(seconds=settings.TOKEN_REVOCATION_SYNC_OVERLAP)
+                # Adding a JTI twice is harmless
+                for jti in RevokedToken.objects.filter(created_at__gte=since).values_list('jti', flat=True):
+                    self._bloom.add(jti)
+                self._cursor, self._synced_at = cursor, now
+
+    def load(self):
+        """Build the filter now rather than on the first lookup"""
+        self._sync()
+
+    def revoke(self, token):
+        """Revoke a validated refresh token until it expires"""
+        jti = token[api_settings.JTI_CLAIM]
+        expires_at = datetime.fromtimestamp(token['exp'], tz=dt_timezone.utc)
+        RevokedToken.objects.get_or_create(jti=jti, defaults={'expires_at': expires_at})
+
+        self._sync()
+        self._bloom.add(jti)
+
+    def is_revoked(self, jti):
+        self._sync()
+        if jti not in self._bloom:
+            return False
+        return RevokedToken.objects.filter(jti=jti, expires_at__gt=timezone.now()).exists()
+
+    def purge_expired(self, batch_size=1000):
+        """Delete expired rows in batches; returns the number deleted"""
+        deleted = 0
+        now = timezone.now()
+        while True:
+            ids = list(
+                RevokedToken.objects.filter(expires_at__lte=now)
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                return deleted
+            deleted += RevokedToken.objects.filter(id__in=ids).delete()[0]
+
+
+revocation_store = RevocationStore()
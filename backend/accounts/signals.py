@@ -0,0 +1,27 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from paymall.sharding import replicate, unreplicate
+from .authentication import invalidate_cached_user
+from .models import User
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_cache(sender, instance, using, **kwargs):
+    """Drop the cached copy used by CachedJWTAuthentication once the change commits"""
+    # Any sooner, a request could cache the row as it was before the commit
+    transaction.on_commit(partial(invalidate_cached_user, instance.pk), using=using)
+
+
+@receiver(post_save, sender=User)
+def copy_to_shards(sender, instance, using, raw=False, **kwargs):
+    replicate(instance, using, raw)
+
+
+@receiver(post_delete, sender=User)
+def delete_from_shards(sender, instance, using, **kwargs):
+    unreplicate(instance, using)
@@ -1,3 +1,330 @@
-from django.test import TestCase
+import importlib
+import json
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.contrib.auth.signals import user_login_failed
+from django.core.cache import cache
+from django.test import AsyncRequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from orders.models import Cart, CartItem
+from paymall.testing import QueryBudgetTestCase, QueryPlanTestCase
+from paymall.throttling import SlidingWindowCounters, SlidingWindowThrottle
+from products.models import Mall, Category
+from products.tests import make_products
+from . import backends, urls
+from .hashing import averify_password
+from .models import User, PaymentMethod, RevokedToken
+from .revocation import BloomFilter, RevocationStore
+from .views import AsyncLoginView, AsyncUserRegistrationView, LoginView, UserRegistrationView
+
+
+class AccountQueryBudgetTests(QueryBudgetTestCase):
+    QUERY_BUDGETS = {
+        'user_profile': 1,
+        'payment_method_list': 2,
+        'bootstrap': 5,
+    }
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="shopper", email="shopper@example.com", password="pw")
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.user).access_token}")
+        self.add_payment_methods(1)
+
+    def add_payment_methods(self, count):
+        for _ in range(count):
+            PaymentMethod.objects.create(user=self.user, payment_type='UPI', upi_id='shopper@upi')
+
+    def test_user_profile(self):
+        self.assertQueryBudget('user_profile', lambda: self.client.get(reverse('user_profile')), lambda: None)
+
+    def test_payment_method_list(self):
+        self.assertQueryBudget(
+            'payment_method_list',
+            lambda: self.client.get(reverse('payment_method_list')),
+            lambda: self.add_payment_methods(20),
+        )
+
+    def test_bootstrap(self):
+        mall = Mall.objects.create(name="Mall", location="Here", latitude=12.97, longitude=77.59)
+        cart = Cart.objects.create(user=self.user)
+
+        def fill(count, start):
+            for product in make_products(mall, count, start=start):
+                CartItem.objects.create(cart=cart, product=product, quantity=1)
+
+        fill(1, 0)
+
+        def grow():
+            fill(20, 100)
+            self.add_payment_methods(20)
+            for i in range(20):
+                Category.objects.create(name=f"Extra {i}")
+
+        self.assertQueryBudget('bootstrap', lambda: self.client.get(reverse('bootstrap')), grow)
+
+
+class BootstrapViewTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username="shopper", email="shopper@example.com", password="pw")
+        self.client.defaults['HTTP_AUTHORIZATION'] = f"Bearer {RefreshToken.for_user(user).access_token}"
+        self.etag = self.client.get(reverse('bootstrap'))['ETag']
+
+    def get(self, if_none_match):
+        return self.client.get(reverse('bootstrap'), HTTP_IF_NONE_MATCH=if_none_match)
+
+    def test_not_modified(self):
+        for header in (self.etag, f'"other", {self.etag}', f"W/{self.etag}", '*'):
+            with self.subTest(header):
+                response = self.get(header)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response['ETag'], self.etag)
+
+    def test_modified(self):
+        # A header merely containing the ETag isn't a match
+        for header in ('"other"', f'"x{self.etag.strip(chr(34))}"', self.etag.strip('"')):
+            with self.subTest(header):
+                response = self.get(header)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response['ETag'], self.etag)
+                self.assertEqual(set(response.json()['etags']), {'profile', 'payment_methods', 'cart', 'categories'})
+
+
+class AsyncAuthViewTests(TestCase):
+    """The async login and registration views must answer as their DRF twins do"""
+
+    def setUp(self):
+        self.factory = AsyncRequestFactory()
+        self.user = User.objects.create_user(username="shopper", email="shopper@example.com", password="pw")
+        self.failures = []
+        user_login_failed.connect(self.login_failed)
+        self.addCleanup(user_login_failed.disconnect, self.login_failed)
+
+    def login_failed(self, credentials, **kwargs):
+        self.failures.append(credentials)
+
+    async def post(self, name, view, body, sync_body=None):
+        """(response of the DRF view, response of the async view) to posting ``body`` to URL ``name``"""
+        expected = await self.async_client.post(reverse(name), sync_body or body, content_type='application/json')
+        response = await view.as_view()(self.factory.post(reverse(name), body, content_type='application/json'))
+        return expected, response
+
+    def assertSameError(self, expected, response, status):
+        self.assertEqual(expected.status_code, status)
+        self.assertEqual(response.status_code, status)
+        self.assertJSONEqual(response.content, expected.content.decode())
+
+    def assertSameTokens(self, expected, response, status):
+        self.assertEqual(expected.status_code, status)
+        self.assertEqual(response.status_code, status)
+        body, expected_body = json.loads(response.content), expected.json()
+        self.assertEqual(body.keys(), expected_body.keys())
+        cookie, expected_cookie = response.cookies['refresh_token'], expected.cookies['refresh_token']
+        for attribute in ('httponly', 'secure', 'samesite', 'max-age'):
+            self.assertEqual(cookie[attribute], expected_cookie[attribute], attribute)
+        self.assertEqual(RefreshToken(cookie.value)['user_id'], str(body['user']['id']))
+        return body, expected_body
+
+    async def test_login(self):
+        body, expected_body = self.assertSameTokens(*await self.post(
+            'token_obtain_pair', AsyncLoginView, {'email': "shopper@example.com", 'password': "pw"},
+        ), 200)
+        self.assertEqual(body['user'], expected_body['user'])
+
+    async def test_wrong_credentials(self):
+        for credentials in ({'email': "shopper@example.com", 'password': "wrong"},
+                            {'email': "nobody@example.com", 'password': "pw"}):
+            with self.subTest(credentials['email']):
+                self.failures.clear()
+                self.assertSameError(*await self.post('token_obtain_pair', AsyncLoginView, credentials), 401)
+                # Both go through authenticate(), which reports the failure
+                self.assertEqual(len(self.failures), 2)
+                self.assertEqual(self.failures[0], self.failures[1])
+
+    async def test_inactive_user(self):
+        await User.objects.filter(pk=self.user.pk).aupdate(is_active=False)
+        with mock.patch.object(backends, 'averify_password', wraps=averify_password) as verify:
+            self.assertSameError(*await self.post(
+                'token_obtain_pair', AsyncLoginView, {'email': "shopper@example.com", 'password': "pw"},
+            ), 401)
+        # Hashed all the same, so inactive accounts don't answer faster
+        verify.assert_called_once()
+
+    async def test_missing_fields(self):
+        self.assertSameError(*await self.post('token_obtain_pair', AsyncLoginView, {}), 400)
+
+    async def test_outdated_hashes_are_upgraded(self):
+        hasher = PBKDF2PasswordHasher()
+        outdated = hasher.encode("pw", hasher.salt(), iterations=1000)
+        await User.objects.filter(pk=self.user.pk).aupdate(password=outdated)
+        self.assertEqual(await averify_password("pw", outdated), (True, True))
+
+        response = await AsyncLoginView.as_view()(self.factory.post(
+            reverse('token_obtain_pair'), {'email': "shopper@example.com", 'password': "pw"},
+            content_type='application/json',
+        ))
+        self.assertEqual(response.status_code, 200)
+        upgraded = (await User.objects.aget(pk=self.user.pk)).password
+        self.assertTrue(upgraded.startswith(f"{hasher.algorithm}${hasher.iterations}$"))
+        self.assertEqual(await averify_password("pw", upgraded), (True, False))
+
+    async def test_register(self):
+        def registration(name):
+            return {'username': name, 'email': f"{name}@Example.COM", 'password': "s3cret-pass", 'password2': "s3cret-pass"}
+
+        body, expected_body = self.assertSameTokens(*await self.post(
+            'register', AsyncUserRegistrationView, registration("async"), sync_body=registration("sync"),
+        ), 201)
+        ignored = ('id', 'username', 'email')
+        self.assertEqual(
+            {k: v for k, v in body['user'].items() if k not in ignored},
+            {k: v for k, v in expected_body['user'].items() if k not in ignored},
+        )
+        self.assertEqual((body['user']['username'], body['user']['email']), ("async", "async@example.com"))
+        user = await User.objects.aget(email="async@example.com")
+        self.assertTrue(await sync_to_async(user.check_password)("s3cret-pass"))
+
+    async def test_register_validation_errors(self):
+        for body in (
+            {},
+            {'username': "new", 'email': "new@example.com", 'password': "s3cret-pass", 'password2': "other"},
+            {'username': "new", 'email': "shopper@example.com", 'password': "s3cret-pass", 'password2': "s3cret-pass"},
+        ):
+            with self.subTest(body):
+                self.assertSameError(*await self.post('register', AsyncUserRegistrationView, body), 400)
+
+    async def register_statuses(self, send):
+        """Statuses of 11 registration attempts made by ``send()``, counted afresh"""
+        with mock.patch.object(SlidingWindowThrottle, 'counters', SlidingWindowCounters()):
+            return [(await send()).status_code for _ in range(11)]
+
+    async def test_register_throttle(self):
+        url = reverse('register')
+        expected = await self.register_statuses(
+            lambda: self.async_client.post(url, {}, content_type='application/json')
+        )
+        statuses = await self.register_statuses(
+            lambda: AsyncUserRegistrationView.as_view()(self.factory.post(url, {}, content_type='application/json'))
+        )
+        self.assertEqual(expected, [400] * 10 + [429])
+        self.assertEqual(statuses, expected)
+
+    def test_async_auth_views_setting(self):
+        def views():
+            return {pattern.name: pattern.callback.view_class for pattern in urls.urlpatterns}
+
+        self.assertEqual((views()['token_obtain_pair'], views()['register']), (LoginView, UserRegistrationView))
+        try:
+            with override_settings(ASYNC_AUTH_VIEWS=True):
+                importlib.reload(urls)
+                self.assertEqual(
+                    (views()['token_obtain_pair'], views()['register']), (AsyncLoginView, AsyncUserRegistrationView),
+                )
+        finally:
+            importlib.reload(urls)
+
+
+class AccountQueryPlanTests(QueryPlanTestCase):
+    def test_default_payment_method_reset(self):
+        self.assertUsesIndex(
+            PaymentMethod.objects.filter(user=1, payment_type='UPI', is_default=True),
+            'paymethod_user_type_def_idx',
+        )
+
+
+class BloomFilterTests(SimpleTestCase):
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(1000)
+        values = [f"jti-{i}" for i in range(1000)]
+        for value in values:
+            bloom.add(value)
+        self.assertTrue(all(value in bloom for value in values))
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add(f"jti-{i}")
+        false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+
+@override_settings(TOKEN_REVOCATION_SYNC_INTERVAL=0, TOKEN_REVOCATION_SYNC_OVERLAP=60)
+class RevocationStoreTests(TestCase):
+    def setUp(self):
+        self.store = RevocationStore()
+        self.user = User.objects.create_user(username="shopper", email="shopper@example.com", password="pw")
+
+    def revoke_elsewhere(self, jti, **fields):
+        """A revocation made by another process"""
+        return RevokedToken.objects.create(**{'jti': jti, 'expires_at': timezone.now() + timedelta(days=1), **fields})
+
+    def test_revoke(self):
+        token = RefreshToken.for_user(self.user)
+        self.assertFalse(self.store.is_revoked(token['jti']))
+        self.store.revoke(token)
+        self.assertTrue(self.store.is_revoked(token['jti']))
+
+    def test_unknown_jtis_skip_the_database(self):
+        self.store.load()
+        # The sync itself is the only query
+        with self.assertNumQueries(1):
+            self.assertFalse(self.store.is_revoked('never-revoked'))
+
+    def test_sync_catches_late_commits(self):
+        self.revoke_elsewhere('first', id=10)
+        self.store.load()
+        # Committed after the last sync, with a lower id and an earlier timestamp
+        late = self.revoke_elsewhere('late', id=5)
+        RevokedToken.objects.filter(pk=late.pk).update(created_at=timezone.now() - timedelta(seconds=30))
+        self.assertTrue(self.store.is_revoked('late'))
+
+    def test_expired_revocations(self):
+        self.revoke_elsewhere('expired', expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertFalse(self.store.is_revoked('expired'))
+        self.assertEqual(self.store.purge_expired(), 1)
+        self.assertFalse(RevokedToken.objects.exists())
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="shopper", email="shopper@example.com", password="pw")
+        self.auth = f"Bearer {RefreshToken.for_user(self.user).access_token}"
+
+    def profile(self):
+        return self.client.get(reverse('user_profile'), HTTP_AUTHORIZATION=self.auth)
+
+    def test_cached_user_skips_the_database(self):
+        self.assertEqual(self.profile().status_code, 200)
+        # The profile is the authenticated user itself
+        with self.assertNumQueries(0):
+            self.assertEqual(self.profile().status_code, 200)
+
+    def test_saves_invalidate_on_commit(self):
+        self.profile()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.first_name = "Renamed"
+            self.user.save()
+            # Not committed yet: requests keep the copy from before
+            with self.assertNumQueries(0):
+                self.profile()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.profile().json()['first_name'], "Renamed")
+
+    def test_deactivated_users_are_refused(self):
+        self.profile()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.profile().status_code, 401)
+
+    def test_deleted_users_are_refused(self):
+        self.profile()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.assertEqual(self.profile().status_code, 401)
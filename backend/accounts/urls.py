@@ -1,5 +1,8 @@
+from django.conf import settings
 from django.urls import path
 from .views import (
+    AsyncLoginView,
+    AsyncUserRegistrationView,
     LoginView,
     RefreshFromCookie,
     UserRegistrationView,
@@ -9,12 +12,17 @@ from .views import (
     LogoutView
 )
 
+if settings.ASYNC_AUTH_VIEWS:
+    login_view, register_view = AsyncLoginView, AsyncUserRegistrationView
+else:
+    login_view, register_view = LoginView, UserRegistrationView
+
 urlpatterns = [
     # Authentication endpoints
-    path('token/', LoginView.as_view(), name='token_obtain_pair'),
+    path('token/', login_view.as_view(), name='token_obtain_pair'),
     path('token/refresh/', RefreshFromCookie.as_view(), name='token_refresh'),
-    path('register/', UserRegistrationView.as_view(), name='register'),
-    path('logout/', LogoutView.as_view()),
+    path('register/', register_view.as_view(), name='register'),
+    path('logout/', LogoutView.as_view(), name='logout'),
     
     # User profile
     path('profile/', UserProfileView.as_view(), name='user_profile'),
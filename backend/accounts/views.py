@@ -1,9 +1,21 @@
 from rest_framework import status, generics, permissions
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.views import TokenObtainPairView
-from django.contrib.auth import get_user_model
+from asgiref.sync import sync_to_async
+from django.contrib.auth import aauthenticate, get_user_model
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+import json
+
+from paymall.throttling import IPSlidingWindowThrottle
+from .hashing import amake_password
+from .revocation import revocation_store
 
 from .models import PaymentMethod
 from .serializers import (
@@ -48,6 +60,8 @@ class UserRegistrationView(APIView):
     - Sets refresh token in HttpOnly cookie
     """
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [IPSlidingWindowThrottle]
+    throttle_scope = "register"
 
     def post(self, request):
         serializer = UserRegistrationSerializer(data=request.data)
@@ -79,6 +93,7 @@ class RefreshFromCookie(APIView):
     """
     REFRESH TOKEN
     - Uses HttpOnly cookie
+    - Rejects revoked tokens
     - Returns new access token
     """
     permission_classes = [permissions.AllowAny]
@@ -90,15 +105,19 @@ class RefreshFromCookie(APIView):
 
         try:
             token = RefreshToken(refresh)
-            return Response({"access": str(token.access_token)})
         except Exception:
             return Response({"detail": "Invalid refresh token"}, status=401)
 
+        if revocation_store.is_revoked(token[jwt_settings.JTI_CLAIM]):
+            return Response({"detail": "Invalid refresh token"}, status=401)
+
+        return Response({"access": str(token.access_token)})
+
 
 class LogoutView(APIView):
     """
     LOGOUT
-    - Blacklists refresh token
+    - Revokes refresh token
     - Deletes refresh cookie
     """
     permission_classes = [permissions.IsAuthenticated]
@@ -108,15 +127,119 @@ class LogoutView(APIView):
 
         if refresh:
             try:
-                RefreshToken(refresh).blacklist()
-            except Exception:
-                pass
+                revocation_store.revoke(RefreshToken(refresh))
+            except TokenError:
+                pass  # expired or malformed, nothing to revoke
 
         response = Response({"message": "Logged out successfully"})
         response.delete_cookie("refresh_token")
         return response
 
 
+def _request_data(request):
+    if request.content_type == "application/json":
+        try:
+            return json.loads(request.body or b"{}")
+        except ValueError:
+            return None
+    return request.POST
+
+
+def _refresh_cookie_response(data, refresh, status=200):
+    response = JsonResponse(data, status=status)
+    response.set_cookie(
+        key="refresh_token",
+        value=str(refresh),
+        httponly=True,
+        secure=True,
+        samesite="Strict",
+        max_age=60 * 60 * 24
+    )
+    return response
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncLoginView(View):
+    """
+    LOGIN (async)
+    - Same contract as LoginView
+    - Authenticates through AUTHENTICATION_BACKENDS; PooledModelBackend
+      checks the password in the hashing process pool
+    """
+
+    async def post(self, request):
+        data = _request_data(request)
+        if data is None:
+            return JsonResponse({"detail": "Malformed request body"}, status=400)
+
+        errors = {
+            field: ["This field is required."]
+            for field in ("email", "password") if not data.get(field)
+        }
+        if errors:
+            return JsonResponse(errors, status=400)
+
+        user = await aauthenticate(
+            request, **{User.USERNAME_FIELD: data["email"], "password": data["password"]}
+        )
+        if user is None or not user.is_active:
+            return JsonResponse(
+                {"detail": "No active account found with the given credentials"},
+                status=401
+            )
+
+        refresh = RefreshToken.for_user(user)
+        return _refresh_cookie_response(
+            {
+                "access": str(refresh.access_token),
+                "user": UserSerializer(user).data
+            },
+            refresh
+        )
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncUserRegistrationView(View):
+    """
+    REGISTER (async)
+    - Same contract as UserRegistrationView
+    - Password is hashed in the hashing process pool
+    """
+    throttle_scope = "register"
+
+    async def post(self, request):
+        throttle = IPSlidingWindowThrottle()
+        if not throttle.allow_request(request, self):
+            return JsonResponse({"detail": "Request was throttled."}, status=429)
+
+        data = _request_data(request)
+        if data is None:
+            return JsonResponse({"detail": "Malformed request body"}, status=400)
+
+        serializer = UserRegistrationSerializer(data=data)
+        if not await sync_to_async(serializer.is_valid)():
+            return JsonResponse(serializer.errors, status=400)
+
+        # What UserRegistrationSerializer.create() passes to create_user()
+        fields = {**serializer.validated_data}
+        del fields["password2"]
+        password = fields.pop("password")
+        fields["username"] = User.normalize_username(fields["username"])
+        fields["email"] = User.objects.normalize_email(fields["email"])
+        user = User(**fields, password=await amake_password(password))
+        await user.asave()
+
+        refresh = RefreshToken.for_user(user)
+        return _refresh_cookie_response(
+            {
+                "access": str(refresh.access_token),
+                "user": UserSerializer(user).data
+            },
+            refresh,
+            status=201
+        )
+
+
 class UserProfileView(APIView):
     """
     USER PROFILE
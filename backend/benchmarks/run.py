@@ -0,0 +1,297 @@
+"""
+Load-test scenarios against a running PayMall server.
+
+Seed a scratch database and start the server first, e.g.::
+
+    python manage.py migrate
+    python manage.py seed_benchmark_data --users 200
+    THROTTLE_RATE_SCAN=100000/min THROTTLE_RATE_CATALOG=100000/min \\
+        gunicorn paymall.wsgi -w 4
+
+(or, to compare the async read views, ``ASYNC_READ_VIEWS=True uvicorn
+paymall.asgi:application --workers 4`` with the same throttle overrides)
+
+then run::
+
+    python benchmarks/run.py --concurrency 20 --duration 15
+    python benchmarks/run.py --save-baseline        # record benchmarks/baseline.json
+    python benchmarks/run.py --compare              # exit 1 on regression
+
+Each scenario reports p50/p95/p99 latency, throughput and, when the
+server's /metrics route is reachable, DB queries per request.
+"""
+import argparse
+import http.client
+import json
+import random
+import re
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlsplit
+
+BASELINE_PATH = Path(__file__).with_name('baseline.json')
+BENCH_PASSWORD = 'bench-pass-123'
+
+
+class Client:
+    """One virtual shopper with a keep-alive connection and its own login"""
+
+    def __init__(self, base_url, user_index, device_id):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        self.user_index = user_index
+        self.email = f"bench-user-{user_index}@paymall.test"
+        self.device_id = device_id
+        self.token = None
+        self.order_ids = []
+
+    def request(self, method, path, body=None, auth=True):
+        headers = {'Accept': 'application/json', 'X-Device-ID': self.device_id}
+        if body is not None:
+            headers['Content-Type'] = 'application/json'
+            body = json.dumps(body)
+        if auth and self.token:
+            headers['Authorization'] = f"Bearer {self.token}"
+        try:
+            self.conn.request(method, path, body=body, headers=headers)
+            response = self.conn.getresponse()
+        except (http.client.HTTPException, OSError):
+            # Server closed the keep-alive connection; retry once on a new one
+            self.conn.close()
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            self.conn.request(method, path, body=body, headers=headers)
+            response = self.conn.getresponse()
+        return response.status, response.read()
+
+    def login(self):
+        status, body = self.request(
+            'POST', '/api/users/token/', {'email': self.email, 'password': BENCH_PASSWORD}, auth=False
+        )
+        if status != 200:
+            raise RuntimeError(f"Login failed for {self.email}: {status} {body[:200]!r}")
+        self.token = json.loads(body)['access']
+
+    def timed(self, method, path, body=None):
+        start = time.perf_counter()
+        status, payload = self.request(method, path, body)
+        if status == 401:
+            # Access tokens only live a few minutes
+            self.login()
+            start = time.perf_counter()
+            status, payload = self.request(method, path, body)
+        return time.perf_counter() - start, status, payload
+
+
+class Catalog:
+    """Product ids and barcodes discovered from the API before the run"""
+
+    def __init__(self, client):
+        status, body = client.request('GET', '/api/products/products/')
+        products = json.loads(body) if status == 200 else []
+        if not products:
+            raise RuntimeError("No products found; run 'manage.py seed_benchmark_data' first")
+        self.product_ids = [p['id'] for p in products]
+        self.barcodes = [p['barcode'] for p in products]
+        by_mall = {}
+        for p in products:
+            by_mall.setdefault(p['mall'], []).append(p['id'])
+        self.malls = [by_mall[mall] for mall in sorted(by_mall)]
+
+    def home_products(self, client):
+        """Product ids of the client's home mall; a cart holds one mall's products at checkout"""
+        return self.malls[client.user_index % len(self.malls)]
+
+
+# Each scenario is (URL name reported by /metrics, function(client, catalog, rng) -> timed result)
+
+def scan(client, catalog, rng):
+    return client.timed('GET', f"/api/products/products/barcode/{rng.choice(catalog.barcodes)}/")
+
+
+def cart_add(client, catalog, rng):
+    return client.timed('POST', '/api/orders/cart/add/', {'product_id': rng.choice(catalog.home_products(client))})
+
+
+def cart_view(client, catalog, rng):
+    return client.timed('GET', '/api/orders/cart/')
+
+
+def checkout(client, catalog, rng):
+    products = catalog.home_products(client)
+    for product_id in rng.sample(products, min(3, len(products))):
+        client.request('POST', '/api/orders/cart/add/', {'product_id': product_id})
+    return client.timed('POST', '/api/orders/orders/create/', {'payment_method': 'UPI'})
+
+
+def order_list(client, catalog, rng):
+    return client.timed('GET', '/api/orders/orders/')
+
+
+def invoice(client, catalog, rng):
+    if not client.order_ids:
+        _, _, body = order_list(client, catalog, rng)
+        client.order_ids = [o['id'] for o in json.loads(body)] or [0]
+    return client.timed('GET', f"/api/orders/orders/{rng.choice(client.order_ids)}/invoice/")
+
+
+SCENARIOS = {
+    'scan': ('product_barcode', scan),
+    'cart_add': ('cart_add_item', cart_add),
+    'cart_view': ('cart', cart_view),
+    'checkout': ('order_create', checkout),
+    'order_list': ('order_list', order_list),
+    'invoice': ('order_invoice', invoice),
+}
+
+
+def scrape_metrics(base_url):
+    """{view: (requests, queries)} from /metrics, or None if unreachable"""
+    parts = urlsplit(base_url)
+    try:
+        conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=10)
+        conn.request('GET', '/metrics')
+        response = conn.getresponse()
+        if response.status != 200:
+            return None
+        text = response.read().decode()
+    except OSError:
+        return None
+
+    totals = {}
+    for name, view, value in re.findall(
+        r'^(paymall_http_requests_total|paymall_http_db_queries_total)\{view="([^"]+)"[^}]*\} (\S+)$',
+        text, re.MULTILINE,
+    ):
+        requests, queries = totals.get(view, (0, 0))
+        if name == 'paymall_http_requests_total':
+            requests += float(value)
+        else:
+            queries += float(value)
+        totals[view] = (requests, queries)
+    return totals
+
+
+def run_scenario(name, clients, catalog, duration, seed):
+    view, func = SCENARIOS[name]
+    latencies, errors = [], 0
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker(index, client):
+        nonlocal errors
+        rng = random.Random(seed + index)
+        local, failed = [], 0
+        while time.monotonic() < deadline:
+            elapsed, status, _ = func(client, catalog, rng)
+            local.append(elapsed)
+            failed += status >= 400
+        with lock:
+            latencies.extend(local)
+            errors += failed
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(len(clients)) as pool:
+        list(pool.map(worker, range(len(clients)), clients))
+    wall = time.monotonic() - started
+
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput': round(len(latencies) / wall, 2),
+        **percentiles(latencies),
+    }, view
+
+
+def percentiles(latencies):
+    """p50/p95/p99 of ``latencies`` in ms; None with no samples"""
+    if not latencies:
+        return {'p50_ms': None, 'p95_ms': None, 'p99_ms': None}
+    cuts = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    return {
+        'p50_ms': round(cuts[49] * 1000, 2),
+        'p95_ms': round(cuts[94] * 1000, 2),
+        'p99_ms': round(cuts[98] * 1000, 2),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of regression messages"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if result['p95_ms'] is not None and base.get('p95_ms') is not None \
+                and result['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {result['p95_ms']}ms vs baseline {base['p95_ms']}ms")
+        if result['throughput'] < base['throughput'] * (1 - tolerance):
+            regressions.append(f"{name}: {result['throughput']} req/s vs baseline {base['throughput']} req/s")
+        if result.get('queries_per_request') and base.get('queries_per_request') \
+                and result['queries_per_request'] > base['queries_per_request']:
+            regressions.append(
+                f"{name}: {result['queries_per_request']} queries/request vs baseline {base['queries_per_request']}"
+            )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help="Comma-separated subset to run")
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--duration', type=float, default=10, help="Seconds per scenario")
+    parser.add_argument('--users', type=int, default=None, help="Seeded users to log in (default: concurrency)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--baseline', type=Path, default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--compare', action='store_true', help="Exit 1 if results regress against the baseline")
+    parser.add_argument('--tolerance', type=float, default=0.15)
+    args = parser.parse_args(argv)
+
+    users = args.users or args.concurrency
+    clients = [Client(args.base_url, i % users, f"bench-device-{i}") for i in range(args.concurrency)]
+    for client in clients:
+        client.login()
+    catalog = Catalog(clients[0])
+    for client in clients:
+        # Seeded carts may hold another mall's products
+        client.request('DELETE', '/api/orders/cart/')
+
+    results = {}
+    for name in args.scenarios.split(','):
+        before = scrape_metrics(args.base_url)
+        result, view = run_scenario(name, clients, catalog, args.duration, args.seed)
+        after = scrape_metrics(args.base_url)
+        if before is not None and after is not None and view in after:
+            requests = after[view][0] - before.get(view, (0, 0))[0]
+            queries = after[view][1] - before.get(view, (0, 0))[1]
+            result['queries_per_request'] = round(queries / requests, 2) if requests else None
+        results[name] = result
+        print(
+            f"{name:<11} {result['requests']:>7} req  {result['throughput']:>8} req/s  "
+            f"p50 {result['p50_ms']!s:>8}ms  p95 {result['p95_ms']!s:>8}ms  p99 {result['p99_ms']!s:>8}ms  "
+            f"queries/req {result.get('queries_per_request', '-')}  errors {result['errors']}"
+        )
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2, sort_keys=True) + '\n')
+        print(f"Baseline written to {args.baseline}")
+
+    if args.compare:
+        if not args.baseline.exists():
+            print(f"No baseline at {args.baseline}; run with --save-baseline first")
+            return 1
+        regressions = compare(results, json.loads(args.baseline.read_text()), args.tolerance)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
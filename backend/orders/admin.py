@@ -1,26 +1,64 @@
 from django.contrib import admin
+from django.db.models import Count, DecimalField, F, Sum
+from paymall.admin import LargeTableAdmin
 from .models import Cart, CartItem, Order, OrderItem
 
 class CartItemInline(admin.TabularInline):
     model = CartItem
     extra = 0
     readonly_fields = ('total_price',)
+    autocomplete_fields = ('product',)
 
-class CartAdmin(admin.ModelAdmin):
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('product')
+
+class CartAdmin(LargeTableAdmin):
     list_display = ('user', 'total_items', 'subtotal', 'tax_amount', 'total_amount', 'updated_at')
+    list_select_related = ('user',)
+    search_fields = ('user__email', 'user__username')
+    autocomplete_fields = ('user',)
     inlines = [CartItemInline]
     readonly_fields = ('subtotal', 'tax_amount', 'total_amount')
 
+    def get_queryset(self, request):
+        # Totals for every row in the changelist query instead of per-cart item queries
+        return super().get_queryset(request).annotate(
+            item_count=Count('items'),
+            item_subtotal=Sum(
+                F('items__quantity') * F('items__product__price'),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            ),
+        )
+
+    @admin.display(description='Total items', ordering='item_count')
+    def total_items(self, cart):
+        return cart.item_count
+
+    @admin.display(description='Subtotal', ordering='item_subtotal')
+    def subtotal(self, cart):
+        return cart.item_subtotal or 0
+
+    @admin.display(description='Tax amount')
+    def tax_amount(self, cart):
+        return Cart.tax_for(self.subtotal(cart))
+
+    @admin.display(description='Total amount', ordering='item_subtotal')
+    def total_amount(self, cart):
+        return Cart.total_for(self.subtotal(cart))
+
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
     extra = 0
     readonly_fields = ('product_name', 'product_price', 'product_barcode', 'total_price')
+    autocomplete_fields = ('product',)
 
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(LargeTableAdmin):
     list_display = ('order_number', 'user', 'mall', 'status', 'payment_status', 
                     'payment_method', 'total', 'created_at')
     list_filter = ('status', 'payment_status', 'payment_method', 'mall')
+    list_select_related = ('user', 'mall')
     search_fields = ('order_number', 'user__email', 'user__username')
+    autocomplete_fields = ('user', 'mall')
     readonly_fields = ('subtotal', 'tax', 'total')
     inlines = [OrderItemInline]
 
@@ -0,0 +1,40 @@
+def invoice_filename(order):
+    return f"invoice_{order.order_number}.pdf"
+
+
+def invoice_path(order):
+    """Storage path of the invoice rendered by orders.tasks.render_invoice"""
+    return f"invoices/{invoice_filename(order)}"
+
+
+def write_invoice(order, stream):
+    """Draw the PDF invoice for ``order`` into a writable ``stream``"""
+    # reportlab is slow to import and only needed here
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import A4
+
+    pdf = canvas.Canvas(stream, pagesize=A4)
+    width, height = A4
+
+    pdf.setFont("Helvetica-Bold", 14)
+    pdf.drawString(40, height - 40, "PayMall Invoice")
+
+    pdf.setFont("Helvetica", 10)
+    pdf.drawString(40, height - 80, f"Order Number: {order.order_number}")
+    pdf.drawString(40, height - 100, f"Date: {order.created_at.strftime('%d %b %Y')}")
+    pdf.drawString(40, height - 120, f"Payment Method: {order.payment_method}")
+
+    y = height - 160
+    pdf.drawString(40, y, "Items:")
+    y -= 20
+
+    for item in order.items.all():
+        pdf.drawString(40, y, f"{item.quantity} x {item.product_name}")
+        pdf.drawRightString(width - 40, y, f"₹{item.total_price}")
+        y -= 15
+
+    y -= 20
+    pdf.drawString(40, y, f"Total: ₹{order.total}")
+
+    pdf.showPage()
+    pdf.save()
@@ -0,0 +1,9 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Print the exit receipt signing key, for provisioning gate devices (see orders/receipts.py)"
+
+    def handle(self, *args, **options):
+        self.stdout.write(settings.RECEIPT_SIGNING_KEY)
@@ -0,0 +1,161 @@
+import random
+import uuid
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from products.models import Mall, Category, Product
+from orders.models import Cart, CartItem, Order, OrderItem
+
+User = get_user_model()
+
+BENCH_PASSWORD = 'bench-pass-123'
+TAX_RATE = Decimal('0.18')
+
+
+def bench_email(i):
+    return f"bench-user-{i}@paymall.test"
+
+
+def bench_barcode(mall_index, i):
+    return f"BENCH{mall_index:04d}{i:07d}"
+
+
+def clear_bench_data():
+    """Delete everything an earlier run seeded; returns the number of rows deleted"""
+    users = User.objects.filter(username__startswith='bench-user-')
+    querysets = [
+        OrderItem.objects.filter(order__user__in=users),
+        Order.objects.filter(user__in=users),
+        CartItem.objects.filter(cart__user__in=users),
+        Cart.objects.filter(user__in=users),
+        Product.objects.filter(barcode__startswith='BENCH'),
+        Mall.objects.filter(name__startswith='Bench Mall '),
+        Category.objects.filter(name__startswith='Bench Category '),
+        users,
+    ]
+    return sum(queryset.delete()[0] for queryset in querysets)
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk-generate malls, products, users, carts and orders for benchmarking, "
+        "replacing the data of any earlier run"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--malls', type=int, default=5)
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--products', type=int, default=2000, help="Products per mall")
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--cart-items', type=int, default=10, help="Items in each user's cart")
+        parser.add_argument('--orders', type=int, default=20, help="Orders per user")
+        parser.add_argument('--order-items', type=int, default=8, help="Items per order")
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        batch = options['batch_size']
+        cleared = clear_bench_data()
+        if cleared:
+            self.stdout.write(f"Deleted {cleared} rows of earlier benchmark data")
+
+        malls = Mall.objects.bulk_create([
+            Mall(
+                name=f"Bench Mall {i}",
+                location=f"Bench City {i}",
+                latitude=12.9 + rng.uniform(-0.02, 0.02),
+                longitude=77.6 + rng.uniform(-0.02, 0.02),
+            )
+            for i in range(options['malls'])
+        ])
+        categories = Category.objects.bulk_create([
+            Category(name=f"Bench Category {i}") for i in range(options['categories'])
+        ])
+
+        products = []
+        for mall_index, mall in enumerate(malls):
+            for i in range(options['products']):
+                marked = Decimal(rng.randint(20, 5000))
+                price = (marked * Decimal(rng.choice(['1', '1', '0.95', '0.9', '0.75']))).quantize(Decimal('0.01'))
+                products.append(Product(
+                    name=f"Bench Product {mall_index}-{i}",
+                    barcode=bench_barcode(mall_index, i),
+                    price=price,
+                    marked_price=marked,
+                    # bulk_create skips save(), so compute it here
+                    discount_percentage=round((marked - price) / marked * 100, 2),
+                    category=rng.choice(categories) if categories else None,
+                    mall=mall,
+                    stock_quantity=rng.randint(1000, 100000),
+                ))
+        products = Product.objects.bulk_create(products, batch_size=batch)
+
+        # Hash once: PBKDF2 per user would dominate seeding time
+        password = make_password(BENCH_PASSWORD)
+        users = User.objects.bulk_create([
+            User(username=f"bench-user-{i}", email=bench_email(i), password=password)
+            for i in range(options['users'])
+        ], batch_size=batch)
+
+        def products_of(mall_index):
+            return products[mall_index * options['products']:(mall_index + 1) * options['products']]
+
+        carts = Cart.objects.bulk_create([Cart(user=user) for user in users], batch_size=batch)
+        cart_items = []
+        for cart in carts:
+            # A cart holds one mall's products, as checkout requires
+            mall_products = products_of(rng.randrange(len(malls))) if malls else []
+            for product in rng.sample(mall_products, min(options['cart_items'], len(mall_products))):
+                cart_items.append(CartItem(cart=cart, product=product, quantity=rng.randint(1, 3)))
+        CartItem.objects.bulk_create(cart_items, batch_size=batch)
+
+        orders, order_lines = [], []
+        for user in users:
+            for _ in range(options['orders']):
+                mall_index = rng.randrange(len(malls))
+                mall_products = products_of(mall_index)
+                lines = [
+                    (product, rng.randint(1, 3))
+                    for product in rng.sample(mall_products, min(options['order_items'], len(mall_products)))
+                ]
+                subtotal = sum((product.price * qty for product, qty in lines), Decimal('0'))
+                tax = round(subtotal * TAX_RATE, 2)
+                orders.append(Order(
+                    user=user,
+                    mall=malls[mall_index],
+                    order_number=f"BEN-{uuid.UUID(int=rng.getrandbits(128)).hex[:12].upper()}",
+                    status='COMPLETED',
+                    payment_status='PAID',
+                    payment_method=rng.choice(['CREDIT', 'UPI', 'CASH']),
+                    subtotal=subtotal,
+                    tax=tax,
+                    total=subtotal + tax - subtotal / 10,
+                ))
+                order_lines.append(lines)
+        orders = Order.objects.bulk_create(orders, batch_size=batch)
+
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product=product,
+                product_name=product.name,
+                product_price=product.price,
+                product_barcode=product.barcode,
+                quantity=qty,
+                total_price=product.price * qty,
+            )
+            for order, lines in zip(orders, order_lines)
+            for product, qty in lines
+        ], batch_size=batch)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {len(malls)} malls, {len(categories)} categories, {len(products)} products, "
+            f"{len(users)} users ({bench_email(0)} .. password '{BENCH_PASSWORD}'), "
+            f"{len(cart_items)} cart items, {len(orders)} orders"
+        ))
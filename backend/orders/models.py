@@ -3,12 +3,26 @@ from django.conf import settings
 from decimal import Decimal
 from products.models import Product, Mall
 
+class CartQuerySet(models.QuerySet):
+    def with_items(self):
+        """Prefetch items and their products so totals and serialization don't query per item"""
+        return self.prefetch_related(
+            models.Prefetch(
+                'items',
+                queryset=CartItem.objects.select_related(
+                    'product__category', 'product__mall'
+                ).order_by('id')
+            )
+        )
+
 class Cart(models.Model):
     """Model to store user's shopping cart"""
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='cart')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = CartQuerySet.as_manager()
+    
     def __str__(self):
         return f"Cart - {self.user.email}"
     
@@ -22,13 +36,22 @@ class Cart(models.Model):
     
     @property
     def tax_amount(self):
-        # Assuming a fixed tax rate of 18% (can be made configurable)
-        return round(self.subtotal * Decimal('0.18'), 2)
+        return self.tax_for(self.subtotal)
     
     @property
     def total_amount(self):
-        if self.subtotal:
-            return self.subtotal + self.tax_amount - (self.subtotal * 1/10) # Discount 10%
+        return self.total_for(self.subtotal)
+    
+    # Also used by the admin on subtotals computed in the database
+    @staticmethod
+    def tax_for(subtotal):
+        # Assuming a fixed tax rate of 18% (can be made configurable)
+        return round(subtotal * Decimal('0.18'), 2)
+    
+    @classmethod
+    def total_for(cls, subtotal):
+        if subtotal:
+            return subtotal + cls.tax_for(subtotal) - (subtotal * 1/10) # Discount 10%
         else:
             return 0
 
@@ -87,6 +110,14 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        indexes = [
+            # Order history, newest first
+            models.Index(fields=['user', '-created_at'], name='order_user_created_idx'),
+            # Order queues by status (pending orders, reporting)
+            models.Index(fields=['status', 'created_at'], name='order_status_created_idx'),
+        ]
+    
     def __str__(self):
         return f"Order #{self.order_number} - {self.user.email}"
 
@@ -0,0 +1,148 @@
+"""
+Signed exit receipts.
+
+Every order that isn't cancelled carries an exit receipt (``exit_receipt``
+in the order detail and checkout responses), shown as a QR code at the
+exit gate. It is a compact HMAC-SHA256 signed payload of the order number,
+mall, item count, total and checkout time, so a gate checks it without
+asking the API about the order: ``verify_receipt()`` needs only the
+signing key and the revocation list, so ``ReceiptVerifyView`` serves it
+without a database query per request.
+
+Receipts are valid for ``RECEIPT_MAX_AGE`` seconds after checkout, and
+open a gate once: the first successful verification marks the order number
+used in the cache, so a copied QR code is turned away. Gates served by
+several workers need the shared cache (``REDIS_URL``) for that, and gates
+verifying offline keep their own list of used receipts. A
+cancelled order's receipt is revoked; ``ReceiptRevocations`` keeps the
+order numbers cancelled within that window in memory, reloading them every
+``RECEIPT_REVOCATION_SYNC_INTERVAL`` seconds, and gate devices verifying
+offline fetch them in batches from ``RevokedReceiptListView``. Both views
+serve gates only, which present ``GATE_TOKEN``: a receipt verified once is
+used up, and the revocation list names customers' orders.
+
+``RECEIPT_SIGNING_KEY`` signs receipts and is what gate devices hold
+(``manage.py receipt_signing_key``). It is never ``SECRET_KEY``; unset, it
+is derived from it, so the secret itself never leaves the server.
+``RECEIPT_SIGNING_KEY_FALLBACKS`` still verifies receipts signed before a
+key rotation.
+"""
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.utils import timezone
+
+from paymall.sharding import fan_out
+from .models import Order
+
+_SALT = 'paymall.receipts'
+
+
+class InvalidReceipt(Exception):
+    pass
+
+
+def _signer():
+    return signing.Signer(
+        key=settings.RECEIPT_SIGNING_KEY,
+        salt=_SALT,
+        algorithm='sha256',
+        fallback_keys=settings.RECEIPT_SIGNING_KEY_FALLBACKS,
+    )
+
+
+def sign_receipt(order, item_count):
+    """The exit receipt of ``order``, holding ``item_count`` items in all"""
+    payload = [order.order_number, order.mall_id, item_count, str(order.total), int(order.created_at.timestamp())]
+    return _signer().sign_object(payload, compress=True)
+
+
+def verify_receipt(receipt, mall, now=None):
+    """
+    The contents of a valid, unused receipt for the gate's ``mall``, which
+    is then used; raises InvalidReceipt otherwise. Makes no database queries.
+    """
+    try:
+        order_number, mall_id, item_count, total, issued_at = _signer().unsign_object(receipt)
+    except (signing.BadSignature, TypeError, ValueError):
+        raise InvalidReceipt("Invalid signature")
+
+    now = time.time() if now is None else now
+    if now - issued_at > settings.RECEIPT_MAX_AGE:
+        raise InvalidReceipt("Receipt expired")
+    if str(mall) != str(mall_id):
+        raise InvalidReceipt("Receipt is for another mall")
+    if receipt_revocations.is_revoked(order_number):
+        raise InvalidReceipt("Order cancelled")
+    if not cache.add(f"receipt-used:{order_number}", True, settings.RECEIPT_MAX_AGE):
+        raise InvalidReceipt("Receipt already used")
+    return {
+        'order_number': order_number,
+        'mall': mall_id,
+        'item_count': item_count,
+        'total': Decimal(total),
+        'issued_at': datetime.fromtimestamp(issued_at, tz=dt_timezone.utc),
+    }
+
+
+class ReceiptRevocations:
+    """
+    Order numbers whose receipts are revoked: {order number: cancelled at}
+    of the orders cancelled within RECEIPT_MAX_AGE of checkout, reloaded
+    from every shard at most every RECEIPT_REVOCATION_SYNC_INTERVAL seconds.
+    Receipts older than that are expired anyway.
+
+    ``loaded_at`` is when the list was last read: every cancellation up to
+    then is in it, so it is the cursor gates pass back to ``since()``.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._revoked = None
+        self._synced_at = 0
+        self.loaded_at = None
+
+    def _sync(self):
+        now = time.monotonic()
+        if self._revoked is not None and now - self._synced_at < settings.RECEIPT_REVOCATION_SYNC_INTERVAL:
+            return
+
+        with self._lock:
+            if self._revoked is not None and now - self._synced_at < settings.RECEIPT_REVOCATION_SYNC_INTERVAL:
+                return
+            loaded_at = timezone.now()
+            cutoff = loaded_at - timedelta(seconds=settings.RECEIPT_MAX_AGE)
+            # Served by order_status_created_idx
+            rows = fan_out(
+                Order.objects.filter(status='CANCELLED', created_at__gt=cutoff).values_list(
+                    'order_number', 'updated_at',
+                )
+            )
+            self._revoked, self._synced_at, self.loaded_at = dict(rows), now, loaded_at
+
+    def load(self):
+        """Load the list now rather than on the first lookup"""
+        self._sync()
+
+    def revoke(self, order):
+        """Revoke the receipt of ``order``, just cancelled, in this process right away"""
+        self._sync()
+        self._revoked[order.order_number] = order.updated_at
+
+    def is_revoked(self, order_number):
+        self._sync()
+        return order_number in self._revoked
+
+    def since(self, when=None):
+        """(order number, cancelled at) of the receipts revoked at or after ``when``, oldest first"""
+        self._sync()
+        revoked = sorted(self._revoked.items(), key=lambda entry: (entry[1], entry[0]))
+        return [entry for entry in revoked if when is None or entry[1] >= when]
+
+
+receipt_revocations = ReceiptRevocations()
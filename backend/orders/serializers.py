@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from .models import Cart, CartItem, Order, OrderItem
+from .receipts import sign_receipt
 from products.serializers import MallSerializer, ProductSerializer
 
 class CartItemSerializer(serializers.ModelSerializer):
@@ -46,6 +47,13 @@ class OrderDetailSerializer(serializers.ModelSerializer):
         fields = ('id', 'order_number', 'user', 'mall', 'status', 
                  'payment_status', 'payment_method', 'subtotal', 
                  'tax', 'total', 'items', 'created_at')
+    
+    def to_representation(self, order):
+        data = super().to_representation(order)
+        # Counted from the items already serialized, which may not be prefetched
+        item_count = sum(item['quantity'] for item in data['items'])
+        data['exit_receipt'] = None if order.status == 'CANCELLED' else sign_receipt(order, item_count)
+        return data
 
 class OrderCreateSerializer(serializers.Serializer):
     """Serializer for creating an order"""
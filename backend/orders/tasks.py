@@ -0,0 +1,36 @@
+import io
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import Max
+from django.utils import timezone
+
+from paymall.sharding import for_shards, locate
+from tasks.queue import task
+from .invoices import invoice_path, write_invoice
+from .models import Cart, CartItem, Order
+
+
+@task(dedupe=True)
+def render_invoice(order_id):
+    """Store the order's PDF invoice so OrderInvoiceView can serve it as a file"""
+    order = locate(Order.objects.prefetch_related('items'), pk=order_id)
+    if order is None:
+        return
+    buffer = io.BytesIO()
+    write_invoice(order, buffer)
+
+    path = invoice_path(order)
+    # save() would pick a new name rather than replace an existing file
+    default_storage.delete(path)
+    default_storage.save(path, ContentFile(buffer.getvalue()))
+
+
+@task(every=timedelta(hours=1))
+def purge_abandoned_carts():
+    """Empty carts whose items haven't changed in CART_ABANDON_DAYS"""
+    cutoff = timezone.now() - timedelta(days=settings.CART_ABANDON_DAYS)
+    for abandoned in for_shards(Cart.objects.annotate(last_change=Max('items__updated_at')).filter(last_change__lt=cutoff)):
+        CartItem.objects.using(abandoned.db).filter(cart__in=abandoned.values('pk')).delete()
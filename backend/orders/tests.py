@@ -1,3 +1,541 @@
-from django.test import TestCase
+import importlib.util
+import io
+import tempfile
+import time
+import unittest
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from paymall.admin import EstimatedCountPaginator
+from paymall.sharding import SHARD_ID_SPAN, shard_map
+from paymall.testing import QueryBudgetTestCase, QueryPlanTestCase, ShardedTestCase
+from products.models import Mall, Product, Recommendation
+from products.tests import make_products
+from tasks.models import Task
+from tasks.worker import Worker, execute
+from .models import Cart, CartItem, Order, OrderItem
+from .views import AsyncCartView, AsyncOrderListView
+from .receipts import InvalidReceipt, receipt_revocations, sign_receipt, verify_receipt
+
+User = get_user_model()
+
+
+class OrderQueryBudgetTests(QueryBudgetTestCase):
+    QUERY_BUDGETS = {
+        'cart': 3,
+        'cart_add_item': 9,
+        'cart_update_item': 4,
+        'order_list': 2,
+        # ETag validator, order, items
+        'order_detail': 4,
+        'order_create': 11,
+        'order_invoice': 3,
+    }
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="shopper", email="shopper@example.com", password="pw")
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.user).access_token}")
+        self.mall = Mall.objects.create(name="Mall", location="Here", latitude=12.97, longitude=77.59)
+        self.cart = Cart.objects.create(user=self.user)
+        self.fill_cart(1)
+
+    def fill_cart(self, count):
+        for product in make_products(self.mall, count, start=CartItem.objects.count() + Order.objects.count() * 100):
+            CartItem.objects.create(cart=self.cart, product=product, quantity=2)
+
+    def make_order(self, items):
+        order = Order.objects.create(
+            user=self.user, mall=self.mall, order_number=f"ORD-{Order.objects.count()}",
+            payment_method='UPI', subtotal=100, tax=18, total=108,
+        )
+        for product in make_products(self.mall, items, start=1000 + Order.objects.count() * 100):
+            OrderItem.objects.create(
+                order=order, product=product, product_name=product.name, product_price=product.price,
+                product_barcode=product.barcode, quantity=1, total_price=product.price,
+            )
+        return order
+
+    def test_cart(self):
+        self.assertQueryBudget('cart', lambda: self.client.get(reverse('cart')), lambda: self.fill_cart(20))
+
+    def test_cart_add_item(self):
+        # A new product each time so both requests take the same (insert) path
+        products = iter(make_products(self.mall, 2, start=500))
+        self.assertQueryBudget(
+            'cart_add_item',
+            lambda: self.client.post(reverse('cart_add_item'), {'product_id': next(products).pk}, format='json'),
+            lambda: self.fill_cart(20),
+        )
+
+    def test_cart_update_item(self):
+        item = CartItem.objects.get()
+        self.assertQueryBudget(
+            'cart_update_item',
+            lambda: self.client.put(reverse('cart_update_item', args=[item.pk]), {'quantity': 3}, format='json'),
+            lambda: self.fill_cart(20),
+        )
+
+    def test_order_list(self):
+        self.make_order(1)
+        self.assertQueryBudget(
+            'order_list',
+            lambda: self.client.get(reverse('order_list')),
+            lambda: [self.make_order(1) for _ in range(20)],
+        )
+
+    def test_order_detail(self):
+        order = self.make_order(1)
+        self.assertQueryBudget(
+            'order_detail',
+            lambda: self.client.get(reverse('order_detail', args=[order.pk])),
+            lambda: self.make_order(0) and [
+                OrderItem.objects.create(
+                    order=order, product=None, product_name="Extra", product_price=1,
+                    product_barcode="X", quantity=1, total_price=1,
+                )
+                for _ in range(20)
+            ],
+        )
+
+    def test_order_detail_not_modified(self):
+        order = self.make_order(1)
+        url = reverse('order_detail', args=[order.pk])
+        etag = self.client.get(url)['ETag']
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.client.post(reverse('order_cancel', args=[order.pk]))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'CANCELLED')
+
+    def test_order_create(self):
+        self.assertQueryBudget(
+            'order_create',
+            lambda: self.client.post(reverse('order_create'), {'payment_method': 'UPI'}, format='json'),
+            lambda: self.fill_cart(20),
+        )
+
+    def test_order_invoice(self):
+        order = self.make_order(1)
+        self.assertQueryBudget(
+            'order_invoice',
+            lambda: self.client.get(reverse('order_invoice', args=[order.pk])),
+            lambda: [
+                OrderItem.objects.create(
+                    order=order, product=None, product_name="Extra", product_price=1,
+                    product_barcode="X", quantity=1, total_price=1,
+                )
+                for _ in range(20)
+            ],
+        )
+
+    def test_invoice_rendered_in_background(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=directory.name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('order_create'), {'payment_method': 'UPI'}, format='json')
+        task = Task.objects.get(name='orders.tasks.render_invoice')
+        self.assertEqual(task.args, [response.data['id']])
+
+        for pk in Worker().claim(1):
+            execute(pk)
+        response = self.client.get(reverse('order_invoice', args=[task.args[0]]))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+
+
+class AsyncOrderViewTests(TestCase):
+    """The async read views must return exactly what their DRF twins do"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="shopper", email="shopper@example.com", password="pw")
+        self.mall = Mall.objects.create(name="Mall", location="Here", latitude=12.97, longitude=77.59)
+        self.cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=self.cart, product=make_products(self.mall, 1)[0], quantity=2)
+
+    async def assertSameResponse(self, view, url):
+        headers = {'authorization': f"Bearer {RefreshToken.for_user(self.user).access_token}"}
+        expected = await self.async_client.get(url, headers=headers)
+        response = await view.as_view()(AsyncRequestFactory().get(url, headers=headers))
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertJSONEqual(response.content, expected.content.decode())
+
+        anonymous = await view.as_view()(AsyncRequestFactory().get(url))
+        self.assertEqual(anonymous.status_code, 401)
+
+    async def test_cart(self):
+        await self.assertSameResponse(AsyncCartView, reverse('cart'))
+
+    async def test_new_cart(self):
+        await self.cart.adelete()
+        await self.assertSameResponse(AsyncCartView, reverse('cart'))
+
+    async def test_order_list(self):
+        order = await Order.objects.acreate(
+            user=self.user, mall=self.mall, order_number="ORD-1",
+            payment_method='UPI', subtotal=100, tax=18, total=108,
+        )
+        await OrderItem.objects.acreate(
+            order=order, product_name="Product", product_price=90, product_barcode="BC", quantity=1, total_price=90,
+        )
+        await self.assertSameResponse(AsyncOrderListView, reverse('order_list'))
+
+
+class OrderQueryPlanTests(QueryPlanTestCase):
+    def test_order_history(self):
+        self.assertUsesIndex(
+            Order.objects.filter(user=1).select_related('mall').order_by('-created_at'), 'order_user_created_idx'
+        )
+
+    def test_orders_by_status(self):
+        self.assertUsesIndex(
+            Order.objects.filter(status='PENDING').order_by('created_at'), 'order_status_created_idx'
+        )
+
+
+class OrderAdminTests(QueryBudgetTestCase):
+    QUERY_BUDGETS = {
+        # session, user, (filter choices), count estimate, count, rows with totals
+        # or related objects
+        'admin_cart_list': 5,
+        'admin_order_list': 6,
+    }
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username="admin", email="admin@example.com", password="pw")
+        self.client.force_login(self.admin)
+        self.mall = Mall.objects.create(name="Mall", location="Here", latitude=12.97, longitude=77.59)
+        self.products = make_products(self.mall, 3)
+
+    def make_user(self):
+        n = User.objects.count()
+        return User.objects.create_user(username=f"u{n}", email=f"u{n}@example.com", password="pw")
+
+    def add_carts(self, count):
+        for _ in range(count):
+            user = self.make_user()
+            cart = Cart.objects.create(user=user)
+            for product in self.products:
+                CartItem.objects.create(cart=cart, product=product, quantity=2)
+
+    def add_orders(self, count):
+        for _ in range(count):
+            user = self.make_user()
+            Order.objects.create(
+                user=user, mall=self.mall, order_number=f"ORD-{Order.objects.count()}",
+                payment_method='UPI', subtotal=100, tax=18, total=108,
+            )
+
+    def test_cart_list(self):
+        self.add_carts(1)
+        self.assertQueryBudget(
+            'admin_cart_list', lambda: self.client.get('/admin/orders/cart/'), lambda: self.add_carts(10),
+        )
+
+    def test_cart_list_totals(self):
+        self.add_carts(1)
+        response = self.client.get('/admin/orders/cart/')
+        cart = response.context['cl'].result_list[0]
+        # 3 products at 90, two of each
+        self.assertEqual((cart.item_count, cart.item_subtotal), (3, 540))
+        self.assertContains(response, '583.20')  # 540 + 97.20 tax - 54 discount
+
+    def test_order_list(self):
+        self.add_orders(1)
+        self.assertQueryBudget(
+            'admin_order_list', lambda: self.client.get('/admin/orders/order/'), lambda: self.add_orders(10),
+        )
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "Reads SQLite's ANALYZE statistics")
+@override_settings(ADMIN_EXACT_COUNT_LIMIT=1000)
+class EstimatedCountPaginatorTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username="shopper", password="pw")
+        for i in range(3):
+            Order.objects.create(
+                user=user, order_number=f"ORD-{i}", payment_method='UPI', subtotal=100, tax=18, total=108,
+            )
+
+    def set_row_estimate(self, rows):
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+            cursor.execute("UPDATE sqlite_stat1 SET stat = %s WHERE tbl = 'orders_order'", [f"{rows} 1"])
+
+    def test_counts_exactly_without_statistics(self):
+        self.assertEqual(EstimatedCountPaginator(Order.objects.order_by('pk'), 10).count, 3)
+
+    def test_estimates_large_unfiltered_tables(self):
+        self.set_row_estimate(5000000)
+        self.assertEqual(EstimatedCountPaginator(Order.objects.order_by('pk'), 10).count, 5000000)
+        # Filtered lists are narrowed by an index, and counted exactly
+        self.assertEqual(EstimatedCountPaginator(Order.objects.filter(status='PENDING').order_by('pk'), 10).count, 3)
+
+    def test_counts_small_tables_exactly(self):
+        self.set_row_estimate(500)
+        self.assertEqual(EstimatedCountPaginator(Order.objects.order_by('pk'), 10).count, 3)
+
+
+def load_benchmarks():
+    spec = importlib.util.spec_from_file_location('benchmarks_run', settings.BASE_DIR / 'benchmarks' / 'run.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class BenchmarkTests(TestCase):
+    seed_options = {'malls': 2, 'categories': 2, 'products': 5, 'users': 3, 'orders': 2, 'cart_items': 3}
+
+    def test_reseeding_replaces_earlier_data(self):
+        call_command('seed_benchmark_data', stdout=io.StringIO(), **self.seed_options)
+        out = io.StringIO()
+        call_command('seed_benchmark_data', stdout=out, **self.seed_options)
+        self.assertIn("Deleted", out.getvalue())
+        self.assertEqual(Mall.objects.count(), 2)
+        self.assertEqual(Product.objects.count(), 10)
+        self.assertEqual(Order.objects.count(), 6)
+
+    def test_seeded_carts_hold_one_mall(self):
+        call_command('seed_benchmark_data', stdout=io.StringIO(), **self.seed_options)
+        for cart in Cart.objects.all():
+            self.assertEqual(len({item.product.mall_id for item in cart.items.select_related('product')}), 1)
+
+    def test_percentiles(self):
+        run = load_benchmarks()
+        self.assertEqual(run.percentiles([]), {'p50_ms': None, 'p95_ms': None, 'p99_ms': None})
+        self.assertEqual(run.percentiles([0.01]), {'p50_ms': 10.0, 'p95_ms': 10.0, 'p99_ms': 10.0})
+        self.assertEqual(run.percentiles([i / 1000 for i in range(1, 102)])['p50_ms'], 51.0)
+        # A scenario without samples isn't a regression
+        baseline = {'scan': {'p95_ms': 5.0, 'throughput': 0}}
+        self.assertEqual(run.compare({'scan': {'throughput': 0, **run.percentiles([])}}, baseline, 0.15), [])
+
+
+@override_settings(RECEIPT_REVOCATION_SYNC_INTERVAL=0, GATE_TOKEN='gate-token')
+class ExitReceiptTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        # Gates have no user, just the gate token
+        self.gate = self.client_class()
+        self.gate.credentials(HTTP_AUTHORIZATION="Bearer gate-token")
+        self.user = User.objects.create_user(username="shopper", email="shopper@example.com", password="pw")
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.user).access_token}")
+        self.mall = Mall.objects.create(name="Mall", location="Here", latitude=12.97, longitude=77.59)
+        self.products = make_products(self.mall, 2)
+
+    def checkout(self):
+        for product in self.products:
+            self.client.post(reverse('cart_add_item'), {'product_id': product.pk, 'quantity': 2}, format='json')
+        response = self.client.post(reverse('order_create'), {'payment_method': 'UPI'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data
+
+    def verify(self, receipt, **data):
+        data.setdefault('mall', self.mall.pk)
+        return self.gate.post(reverse('receipt_verify'), {'receipt': receipt, **data}, format='json')
+
+    def test_gate_token_required(self):
+        receipt = self.checkout()['exit_receipt']
+        # No token, a wrong one, and a customer's access token
+        customer = f"Bearer {RefreshToken.for_user(self.user).access_token}"
+        for authorization in (None, "Bearer wrong", customer):
+            client = self.client_class()
+            if authorization:
+                client.credentials(HTTP_AUTHORIZATION=authorization)
+            with self.subTest(authorization):
+                response = client.post(reverse('receipt_verify'), {'receipt': receipt, 'mall': self.mall.pk}, format='json')
+                self.assertEqual(response.status_code, 403)
+                self.assertEqual(client.get(reverse('receipt_revoked')).status_code, 403)
+        with override_settings(GATE_TOKEN=None):
+            self.assertEqual(self.verify(receipt).status_code, 403)
+        # Refused attempts don't use the receipt up
+        self.assertEqual(self.verify(receipt).status_code, 200)
+
+    def test_checkout_receipt_verifies_without_queries(self):
+        order = self.checkout()
+        with override_settings(RECEIPT_REVOCATION_SYNC_INTERVAL=60):
+            receipt_revocations.load()
+            with self.assertNumQueries(0):
+                response = self.verify(order['exit_receipt'], mall=self.mall.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['order_number'], order['order_number'])
+        self.assertEqual(response.data['mall'], self.mall.pk)
+        self.assertEqual(response.data['item_count'], 4)
+        self.assertEqual(response.data['total'], order['total'])
+
+        detail = self.client.get(reverse('order_detail', args=[order['id']]))
+        self.assertEqual(detail.data['exit_receipt'], order['exit_receipt'])
+
+    def test_receipts_open_the_gate_once(self):
+        receipt = self.checkout()['exit_receipt']
+        self.assertEqual(self.verify(receipt).status_code, 200)
+        self.assertEqual(self.verify(receipt).data, {'valid': False, 'error': "Receipt already used"})
+
+    def test_rejects_tampered_expired_and_foreign_receipts(self):
+        receipt = self.checkout()['exit_receipt']
+        tampered = ('A' if receipt[0] != 'A' else 'B') + receipt[1:]
+        self.assertEqual(self.verify(tampered).data, {'valid': False, 'error': "Invalid signature"})
+        self.assertEqual(self.verify(receipt, mall=self.mall.pk + 1).data['error'], "Receipt is for another mall")
+        self.assertEqual(self.verify(receipt, mall='').data, {'error': "mall is required"})
+        with self.assertRaisesMessage(InvalidReceipt, "Receipt expired"):
+            verify_receipt(receipt, self.mall.pk, now=time.time() + settings.RECEIPT_MAX_AGE + 1)
+        with override_settings(RECEIPT_SIGNING_KEY='another key'):
+            self.assertEqual(self.verify(receipt).status_code, 400)
+
+    def test_signing_key_is_not_the_secret_key(self):
+        self.assertNotEqual(settings.RECEIPT_SIGNING_KEY, settings.SECRET_KEY)
+        out = io.StringIO()
+        call_command('receipt_signing_key', stdout=out)
+        self.assertEqual(out.getvalue().strip(), settings.RECEIPT_SIGNING_KEY)
+
+    def test_key_rotation(self):
+        order = Order.objects.get(pk=self.checkout()['id'])
+        with override_settings(RECEIPT_SIGNING_KEY='old key'):
+            receipt = sign_receipt(order, 4)
+        with override_settings(RECEIPT_SIGNING_KEY='new key', RECEIPT_SIGNING_KEY_FALLBACKS=['old key']):
+            self.assertEqual(verify_receipt(receipt, self.mall.pk)['order_number'], order.order_number)
+
+    def test_cancelled_orders_are_revoked(self):
+        first, second = self.checkout(), self.checkout()
+        self.client.post(reverse('order_cancel', args=[first['id']]))
+        self.assertEqual(self.verify(first['exit_receipt']).data['error'], "Order cancelled")
+        self.assertIsNone(self.client.get(reverse('order_detail', args=[first['id']])).data['exit_receipt'])
+
+        revoked = self.gate.get(reverse('receipt_revoked')).data
+        self.assertEqual([entry['order_number'] for entry in revoked['revoked']], [first['order_number']])
+
+        # Cancelled by another process: picked up at the next sync
+        Order.objects.filter(pk=second['id']).update(status='CANCELLED', updated_at=timezone.now())
+        self.assertEqual(self.verify(second['exit_receipt']).data['error'], "Order cancelled")
+        response = self.gate.get(reverse('receipt_revoked'), {'since': revoked['synced_at'].isoformat()})
+        self.assertEqual([entry['order_number'] for entry in response.data['revoked']], [second['order_number']])
+        self.assertEqual(self.gate.get(reverse('receipt_revoked'), {'since': 'yesterday'}).status_code, 400)
+
+
+class ShardingTests(ShardedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="shopper", email="shopper@example.com", password="pw")
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.user).access_token}")
+        self.north = Mall.objects.create(name="North", location="N", latitude=13.0, longitude=77.6, shard='shard1')
+        self.south = Mall.objects.create(name="South", location="S", latitude=12.9, longitude=77.6, shard='shard2')
+        self.north_products = make_products(self.north, 2)
+        self.south_products = make_products(self.south, 2, start=10)
+
+    def checkout(self, product):
+        response = self.client.post(reverse('cart_add_item'), {'product_id': product.pk}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        response = self.client.post(reverse('order_create'), {'payment_method': 'UPI'}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data['id']
+
+    def order_ids(self):
+        response = self.client.get(reverse('order_list'))
+        self.assertEqual(response.status_code, 200)
+        return [order['id'] for order in response.data]
+
+    def test_rows_live_on_their_malls_shard(self):
+        product = self.north_products[0]
+        self.assertTrue(Product.objects.using('shard1').filter(pk=product.pk).exists())
+        self.assertFalse(Product.objects.using('default').filter(mall=self.north).exists())
+        # Numbered from the shard's own block of ids
+        self.assertEqual(product.pk // SHARD_ID_SPAN, 1)
+        # Reference rows are copied to every shard
+        self.assertTrue(User.objects.using('shard2').filter(pk=self.user.pk).exists())
+        self.assertTrue(Mall.objects.using('shard2').filter(pk=self.north.pk, shard='shard1').exists())
+
+        response = self.client.get(reverse('product_detail', args=[self.south_products[0].pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['mall']['id'], self.south.pk)
+        response = self.client.get(reverse('product_list'), {'mall': self.north.pk})
+        self.assertEqual({product['id'] for product in response.data}, {p.pk for p in self.north_products})
+        self.assertEqual(len(self.client.get(reverse('product_list')).data), 4)
+
+    def test_order_history_merges_shards(self):
+        north_order = self.checkout(self.north_products[0])
+        south_order = self.checkout(self.south_products[0])
+        self.assertTrue(Order.objects.using('shard1').filter(pk=north_order).exists())
+        self.assertTrue(Order.objects.using('shard2').filter(pk=south_order).exists())
+
+        self.assertEqual(self.order_ids(), [south_order, north_order])
+        response = self.client.get(reverse('order_detail', args=[north_order]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['items']), 1)
+        self.assertEqual(Product.objects.using('shard1').get(pk=self.north_products[0].pk).stock_quantity, 49)
+
+    def test_cart_stays_on_one_shard(self):
+        self.client.post(reverse('cart_add_item'), {'product_id': self.north_products[0].pk}, format='json')
+        response = self.client.post(reverse('cart_add_item'), {'product_id': self.south_products[0].pk}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(len(self.client.get(reverse('cart')).data['items']), 1)
+
+    def test_bootstrap_reads_the_cart_from_its_shard(self):
+        self.client.post(reverse('cart_add_item'), {'product_id': self.north_products[0].pk}, format='json')
+        response = self.client.get(reverse('bootstrap'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['product']['id'] for item in response.data['cart']['items']], [self.north_products[0].pk])
+        self.assertFalse(Cart.objects.using('default').filter(user=self.user).exists())
+
+    def test_checkout_work_waits_for_the_shard_commit(self):
+        with self.captureOnCommitCallbacks(using='shard1', execute=True):
+            order = self.checkout(self.north_products[0])
+        self.assertEqual(Task.objects.get(name='orders.tasks.render_invoice').args, [order])
+
+    def test_shard_map_changes_on_commit(self):
+        mall = Mall.objects.create(name="East", location="E", latitude=13.0, longitude=77.7)
+        self.assertIsNone(shard_map().get(mall.pk))
+        with self.captureOnCommitCallbacks() as callbacks:
+            mall.shard = 'shard2'
+            mall.save()
+            # Not yet committed: other workers must keep routing by the old map
+            self.assertIsNone(shard_map().get(mall.pk))
+        for callback in callbacks:
+            callback()
+        self.assertEqual(shard_map()[mall.pk], 'shard2')
+
+    def test_move_mall(self):
+        order = self.checkout(self.north_products[0])
+        self.client.post(reverse('cart_add_item'), {'product_id': self.north_products[1].pk}, format='json')
+        Recommendation.objects.using('shard1').create(
+            product=self.north_products[0], recommended=self.north_products[1], rank=1, score=1,
+        )
+
+        out = io.StringIO()
+        # The shard map changes as the move commits
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('move_mall', self.north.pk, 'shard2', stdout=out)
+        self.assertIn("Moved North from shard1 to shard2", out.getvalue())
+
+        self.assertFalse(Product.objects.using('shard1').filter(mall=self.north).exists())
+        self.assertFalse(Order.objects.using('shard1').exists())
+        self.assertEqual(Product.objects.using('shard2').filter(mall=self.north).count(), 2)
+        moved = Order.objects.using('shard2').get(pk=order)
+        self.assertEqual(moved.items.count(), 1)
+        self.assertTrue(Recommendation.objects.using('shard2').filter(product=self.north_products[0]).exists())
+        self.assertEqual(Mall.objects.get(pk=self.north.pk).shard, 'shard2')
+
+        # Everything is found where it went, ids unchanged
+        self.assertEqual(self.order_ids(), [order])
+        self.assertEqual(self.client.get(reverse('product_detail', args=[self.north_products[0].pk])).status_code, 200)
+        cart = self.client.get(reverse('cart')).data
+        self.assertEqual([item['product']['id'] for item in cart['items']], [self.north_products[1].pk])
+        # ...and the cart can now take the other mall on the same shard
+        response = self.client.post(reverse('cart_add_item'), {'product_id': self.south_products[0].pk}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        with self.assertRaisesMessage(CommandError, "is on shard2 already"):
+            call_command('move_mall', self.north.pk, 'shard2')
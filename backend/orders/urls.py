@@ -1,5 +1,8 @@
+from django.conf import settings
 from django.urls import path
 from .views import (
+    AsyncCartView,
+    AsyncOrderListView,
     CartView,
     CartItemAddView,
     CartItemUpdateView,
@@ -8,19 +11,30 @@ from .views import (
     OrderCreateView,
     OrderInvoiceView,
     CancelOrderView,
+    ReceiptVerifyView,
+    RevokedReceiptListView,
 )
 
+if settings.ASYNC_READ_VIEWS:
+    cart_view, order_list_view = AsyncCartView, AsyncOrderListView
+else:
+    cart_view, order_list_view = CartView, OrderListView
+
 urlpatterns = [
     # Cart endpoints
-    path('cart/', CartView.as_view(), name='cart'),
+    path('cart/', cart_view.as_view(), name='cart'),
     path('cart/add/', CartItemAddView.as_view(), name='cart_add_item'),
     path('cart/items/<int:pk>/', CartItemUpdateView.as_view(), name='cart_update_item'),
     
     # Order endpoints
-    path('orders/', OrderListView.as_view(), name='order_list'),
+    path('orders/', order_list_view.as_view(), name='order_list'),
     path('orders/<int:pk>/', OrderDetailView.as_view(), name='order_detail'),
     path('orders/create/', OrderCreateView.as_view(), name='order_create'),
-    path("orders/<int:pk>/invoice/", OrderInvoiceView.as_view()),
-    path("orders/<int:pk>/cancel/", CancelOrderView.as_view()),
+    path("orders/<int:pk>/invoice/", OrderInvoiceView.as_view(), name="order_invoice"),
+    path("orders/<int:pk>/cancel/", CancelOrderView.as_view(), name="order_cancel"),
+
+    # Exit gate endpoints
+    path("receipts/verify/", ReceiptVerifyView.as_view(), name="receipt_verify"),
+    path("receipts/revoked/", RevokedReceiptListView.as_view(), name="receipt_revoked"),
 
 ]
\ No newline at end of file
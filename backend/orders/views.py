@@ -1,13 +1,27 @@
 from rest_framework import generics, permissions, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from django.conf import settings
 from django.db import transaction
-from django.shortcuts import get_object_or_404
+from django.http import Http404
+from django.utils.dateparse import parse_datetime
+import hmac
 import uuid
-from django.db.models import F
-
+from operator import attrgetter
+from django.db.models import Case, F, When
+from django.utils import timezone
+
+from paymall.asyncviews import AsyncAPIView, json_response
+from paymall.conditional import conditional
+from paymall.sharding import afan_out, afind_shard, fan_out, find_shard, locate, shard_for
+from paymall.throttling import IPSlidingWindowThrottle
 from products.models import Product
+from products.live import publish_products
+from products.signals import invalidate_products
+from .invoices import invoice_filename, invoice_path, write_invoice
 from .models import Cart, CartItem, Order, OrderItem
+from .receipts import InvalidReceipt, receipt_revocations, verify_receipt
+from .tasks import render_invoice
 from .serializers import (
     CartSerializer, 
     CartItemSerializer, 
@@ -15,19 +29,39 @@ from .serializers import (
     OrderDetailSerializer
 )
 
-from django.http import HttpResponse
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
+from django.core.files.storage import default_storage
+from django.http import FileResponse, HttpResponse
+
+
+# A cart holds products of malls on one shard and lives there; an empty
+# cart may be left on any shard
+
+def cart_shard(user):
+    """Shard of the user's cart with items in it (None if there is none, or unsharded)"""
+    return find_shard(Cart.objects.filter(items__isnull=False), user=user)
+
+
+async def acart_shard(user):
+    return await afind_shard(Cart.objects.filter(items__isnull=False), user=user)
+
+
+def get_order_or_404(queryset, pk):
+    """The order ``pk`` of ``queryset`` from whichever shard holds it"""
+    order = locate(queryset, pk=pk)
+    if order is None:
+        raise Http404("No Order matches the given query.")
+    return order
+
     
 class CartView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        cart, _ = Cart.objects.get_or_create(user=request.user)
+        cart, _ = Cart.objects.with_items().using(cart_shard(request.user)).get_or_create(user=request.user)
         return Response(CartSerializer(cart).data)
 
     def delete(self, request):
-        cart, _ = Cart.objects.get_or_create(user=request.user)
+        cart, _ = Cart.objects.using(cart_shard(request.user)).get_or_create(user=request.user)
         cart.items.all().delete()
         return Response({"message": "Cart cleared"})
 
@@ -40,12 +74,22 @@ class CartItemAddView(APIView):
         quantity = int(request.data.get("quantity", 1))
         print("Quantity:", quantity)
 
-        product = get_object_or_404(Product, id=product_id, is_available=True)
+        product = locate(Product.objects.filter(is_available=True), id=product_id)
+        if product is None:
+            raise Http404("No Product matches the given query.")
         if product.stock_quantity < quantity:
             return Response({"error": "Insufficient stock"}, status=400)
 
-        cart, _ = Cart.objects.get_or_create(user=request.user)
-        item, created = CartItem.objects.get_or_create(
+        shard = shard_for(product)
+        current = cart_shard(request.user)
+        if current is not None and current != shard:
+            return Response(
+                {"error": "The cart holds products of another mall; check out or clear it first"},
+                status=status.HTTP_409_CONFLICT,
+            )
+
+        cart, _ = Cart.objects.using(shard).get_or_create(user=request.user)
+        item, created = CartItem.objects.using(shard).get_or_create(
             cart=cart,
             product=product,
             defaults={"quantity": quantity}
@@ -55,6 +99,7 @@ class CartItemAddView(APIView):
             item.quantity += quantity
             item.save()
 
+        cart = Cart.objects.with_items().using(shard).get(pk=cart.pk)
         return Response(CartSerializer(cart).data)
 
 
@@ -73,9 +118,12 @@ class CartItemUpdateView(APIView):
         if quantity <= 0:
             return Response({"error": "Quantity must be positive"}, status=status.HTTP_400_BAD_REQUEST)
         
+        shard = find_shard(CartItem.objects.all(), pk=pk, cart__user=request.user)
         try:
-            cart = Cart.objects.get(user=request.user)
-            cart_item = CartItem.objects.get(pk=pk, cart=cart)
+            cart = Cart.objects.using(shard).get(user=request.user)
+            cart_item = CartItem.objects.using(shard).select_related(
+                'product__category', 'product__mall'
+            ).get(pk=pk, cart=cart)
         except (Cart.DoesNotExist, CartItem.DoesNotExist):
             return Response({"error": "Cart item not found"}, status=status.HTTP_404_NOT_FOUND)
         
@@ -90,9 +138,10 @@ class CartItemUpdateView(APIView):
     
     def delete(self, request, pk):
         """Remove item from cart"""
+        shard = find_shard(CartItem.objects.all(), pk=pk, cart__user=request.user)
         try:
-            cart = Cart.objects.get(user=request.user)
-            cart_item = CartItem.objects.get(pk=pk, cart=cart)
+            cart = Cart.objects.using(shard).get(user=request.user)
+            cart_item = CartItem.objects.using(shard).get(pk=pk, cart=cart)
         except (Cart.DoesNotExist, CartItem.DoesNotExist):
             return Response({"error": "Cart item not found"}, status=status.HTTP_404_NOT_FOUND)
         
@@ -105,31 +154,89 @@ class OrderListView(generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
     
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user).order_by('-created_at')
+        return Order.objects.filter(user=self.request.user).select_related('mall').order_by('-created_at')
+
+    def list(self, request, *args, **kwargs):
+        # Orders from every mall the user shopped at, merged newest first across shards
+        orders = fan_out(self.get_queryset(), key=attrgetter('created_at'), reverse=True)
+        return Response(self.get_serializer(orders, many=True).data)
+
+def order_validators(view, request, pk):
+    # Items are written once at checkout, so the order row's stamp covers them
+    updated_at = locate(Order.objects.filter(user=request.user).values_list('updated_at', flat=True), pk=pk)
+    if updated_at is None:
+        return None
+    return ('order', pk, updated_at), updated_at
 
 class OrderDetailView(generics.RetrieveAPIView):
     """View to get details of a specific order"""
     serializer_class = OrderDetailSerializer
     permission_classes = [permissions.IsAuthenticated]
+
+    @conditional(order_validators)
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
     
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user)
+        return Order.objects.filter(user=self.request.user).prefetch_related('items')
+
+    def get_object(self):
+        order = get_order_or_404(self.get_queryset(), self.kwargs['pk'])
+        self.check_object_permissions(self.request, order)
+        return order
+
+
+
+class AsyncCartView(AsyncAPIView):
+    """CartView.get served with ASYNC_READ_VIEWS"""
+
+    async def get(self, request):
+        carts = Cart.objects.with_items().using(await acart_shard(request.user))
+        cart, created = await carts.aget_or_create(user=request.user)
+        if created:
+            # A new cart comes back without its (empty) items prefetched
+            cart = await carts.aget(pk=cart.pk)
+        return json_response(CartSerializer(cart).data)
+
+class AsyncOrderListView(AsyncAPIView):
+    """OrderListView served with ASYNC_READ_VIEWS"""
+
+    async def get(self, request):
+        orders = await afan_out(
+            Order.objects.filter(user=request.user).select_related('mall').order_by('-created_at'),
+            key=attrgetter('created_at'), reverse=True,
+        )
+        return json_response(OrderSerializer(orders, many=True, context={'request': request}).data)
 
 
 
 class OrderCreateView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
-    @transaction.atomic
     def post(self, request):
-        cart = Cart.objects.select_for_update().get(user=request.user)
+        # The cart, its products and the order all live on the cart's shard
+        shard = cart_shard(request.user)
+        with transaction.atomic(using=shard):
+            return self.place_order(request, shard)
 
-        if not cart.items.exists():
+    def place_order(self, request, shard):
+        cart = Cart.objects.using(shard).select_for_update().with_items().get(user=request.user)
+        items = list(cart.items.all())
+
+        if not items:
             return Response({"error": "Empty cart"}, status=400)
 
-        order = Order.objects.create(
+        # Lock every product in the cart with a single query
+        products = Product.objects.using(shard).select_for_update().in_bulk(
+            [item.product_id for item in items]
+        )
+        for item in items:
+            if products[item.product_id].stock_quantity < item.quantity:
+                raise Exception("Stock error")
+
+        order = Order.objects.using(shard).create(
             user=request.user,
-            mall=cart.items.first().product.mall,
+            mall=items[0].product.mall,
             order_number=f"ORD-{uuid.uuid4().hex[:8].upper()}",
             payment_method=request.data["payment_method"],
             subtotal=cart.subtotal,
@@ -137,69 +244,57 @@ class OrderCreateView(APIView):
             total=cart.total_amount,
         )
 
-        for item in cart.items.select_related("product"):
-            product = Product.objects.select_for_update().get(pk=item.product.pk)
-            if product.stock_quantity < item.quantity:
-                raise Exception("Stock error")
-
-            product.stock_quantity = F("stock_quantity") - item.quantity
-            product.save()
+        Product.objects.using(shard).filter(pk__in=products).update(
+            stock_quantity=Case(*[
+                When(pk=item.product_id, then=F("stock_quantity") - item.quantity)
+                for item in items
+            ]),
+            updated_at=timezone.now(),
+        )
+        invalidate_products(products.values(), using=shard)
+        publish_products(products.values(), using=shard)
 
-            OrderItem.objects.create(
+        OrderItem.objects.using(shard).bulk_create([
+            OrderItem(
                 order=order,
-                product=product,
-                product_name=product.name,
-                product_price=product.price,
-                product_barcode=product.barcode,
+                product=products[item.product_id],
+                product_name=products[item.product_id].name,
+                product_price=products[item.product_id].price,
+                product_barcode=products[item.product_id].barcode,
                 quantity=item.quantity,
                 total_price=item.total_price,
             )
+            for item in items
+        ])
 
         cart.items.all().delete()
+        render_invoice.delay(order.pk, using=shard)
         return Response(OrderDetailSerializer(order).data, status=201)
 
 class OrderInvoiceView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request, pk):
-        order = get_object_or_404(Order, pk=pk, user=request.user)
+        order = get_order_or_404(Order.objects.filter(user=request.user), pk)
+
+        # Rendered in the background at checkout (orders.tasks.render_invoice)
+        path = invoice_path(order)
+        if default_storage.exists(path):
+            return FileResponse(
+                default_storage.open(path), as_attachment=True,
+                filename=invoice_filename(order), content_type="application/pdf",
+            )
 
         response = HttpResponse(content_type="application/pdf")
-        response["Content-Disposition"] = f'attachment; filename="invoice_{order.order_number}.pdf"'
-
-        pdf = canvas.Canvas(response, pagesize=A4)
-        width, height = A4
-
-        pdf.setFont("Helvetica-Bold", 14)
-        pdf.drawString(40, height - 40, "PayMall Invoice")
-
-        pdf.setFont("Helvetica", 10)
-        pdf.drawString(40, height - 80, f"Order Number: {order.order_number}")
-        pdf.drawString(40, height - 100, f"Date: {order.created_at.strftime('%d %b %Y')}")
-        pdf.drawString(40, height - 120, f"Payment Method: {order.payment_method}")
-
-        y = height - 160
-        pdf.drawString(40, y, "Items:")
-        y -= 20
-
-        for item in order.items.all():
-            pdf.drawString(40, y, f"{item.quantity} x {item.product_name}")
-            pdf.drawRightString(width - 40, y, f"₹{item.total_price}")
-            y -= 15
-
-        y -= 20
-        pdf.drawString(40, y, f"Total: ₹{order.total}")
-
-        pdf.showPage()
-        pdf.save()
-
+        response["Content-Disposition"] = f'attachment; filename="{invoice_filename(order)}"'
+        write_invoice(order, response)
         return response
     
 class CancelOrderView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request, pk):
-        order = get_object_or_404(Order, pk=pk, user=request.user)
+        order = get_order_or_404(Order.objects.filter(user=request.user), pk)
 
         if order.status != "PENDING":
             return Response(
@@ -210,5 +305,65 @@ class CancelOrderView(APIView):
         order.status = "CANCELLED"
         order.payment_status = "REFUNDED" if order.payment_status == "PAID" else order.payment_status
         order.save()
+        receipt_revocations.revoke(order)
 
         return Response({"success": True})
+
+
+class IsGate(permissions.BasePermission):
+    """
+    Requests from exit gates, carrying "Authorization: Bearer <GATE_TOKEN>";
+    nobody when GATE_TOKEN is unset. Makes no database query.
+    """
+
+    def has_permission(self, request, view):
+        if not settings.GATE_TOKEN:
+            return False
+        scheme, _, token = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+        return scheme.lower() == 'bearer' and hmac.compare_digest(token.encode(), settings.GATE_TOKEN.encode())
+
+
+class ReceiptVerifyView(APIView):
+    """Check an exit receipt at the gate, without looking the order up"""
+    # Gates aren't users; this also keeps authentication from querying the database
+    authentication_classes = []
+    # Verifying uses a receipt up, so only gates may
+    permission_classes = [IsGate]
+    throttle_classes = [IPSlidingWindowThrottle]
+    throttle_scope = 'gate'
+
+    def post(self, request):
+        receipt, mall = request.data.get("receipt"), request.data.get("mall")
+        if not isinstance(receipt, str) or not receipt:
+            return Response({"error": "receipt is required"}, status=400)
+        if mall in (None, ""):
+            return Response({"error": "mall is required"}, status=400)
+        try:
+            contents = verify_receipt(receipt, mall)
+        except InvalidReceipt as e:
+            return Response({"valid": False, "error": str(e)}, status=400)
+        return Response({"valid": True, **contents, "total": str(contents["total"])})
+
+
+class RevokedReceiptListView(APIView):
+    """Receipts revoked since ``?since=`` (an earlier response's ``synced_at``), for gates verifying offline"""
+    authentication_classes = []
+    permission_classes = [IsGate]
+    throttle_classes = [IPSlidingWindowThrottle]
+    throttle_scope = 'gate'
+
+    def get(self, request):
+        since = request.query_params.get("since")
+        if since:
+            since = parse_datetime(since)
+            if since is None:
+                return Response({"error": "since must be an ISO 8601 datetime"}, status=400)
+        revoked = receipt_revocations.since(since or None)
+        return Response({
+            "synced_at": receipt_revocations.loaded_at,
+            "max_age": settings.RECEIPT_MAX_AGE,
+            "revoked": [
+                {"order_number": order_number, "cancelled_at": cancelled_at}
+                for order_number, cancelled_at in revoked
+            ],
+        })
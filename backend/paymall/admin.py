@@ -0,0 +1,63 @@
+"""
+Admin helpers for tables too large to count.
+
+``EstimatedCountPaginator`` takes an unfiltered changelist's row count from
+the database's table statistics (``pg_class.reltuples`` on PostgreSQL,
+``information_schema`` on MySQL, ``sqlite_stat1`` after ``ANALYZE`` on
+SQLite) instead of ``COUNT(*)`` once the table is past
+``ADMIN_EXACT_COUNT_LIMIT`` rows. Filtered and searched lists, which the
+indexes narrow down, are still counted exactly. ``LargeTableAdmin`` uses it
+and also skips the changelist's second, unfiltered count.
+"""
+from django.conf import settings
+from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+
+
+def estimate_count(queryset):
+    """Approximate row count of the queryset's table, or None without statistics"""
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    if connection.vendor == 'postgresql':
+        sql, params = "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [table]
+    elif connection.vendor == 'mysql':
+        sql = "SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s"
+        params = [table]
+    elif connection.vendor == 'sqlite':
+        # The first number of each stat is the table's row count
+        sql, params = "SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1", [table]
+    else:
+        return None
+
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+    except DatabaseError:
+        # sqlite_stat1 only exists once ANALYZE has run
+        return None
+    if row is None or row[0] is None:
+        return None
+    estimate = int(str(row[0]).split()[0])
+    # reltuples is -1 (0 before PostgreSQL 14) for a table never analyzed
+    return estimate if estimate > 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if isinstance(queryset, QuerySet) and not queryset.query.where:
+            estimate = estimate_count(queryset)
+            if estimate is not None and estimate > settings.ADMIN_EXACT_COUNT_LIMIT:
+                return estimate
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # "N results (M total)" would count the whole table again
+    show_full_result_count = False
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class PaymallConfig(AppConfig):
+    name = 'paymall'
+
+    def ready(self):
+        from . import instrumentation
+
+        instrumentation.install_all()
@@ -14,3 +14,15 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'paymall.settings')
 
 application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402
+
+if settings.WARM_UP_ON_START:
+    import threading
+
+    from paymall.warmup import warm_up_on_start
+
+    # Servers like uvicorn import the app inside their event loop, where the ORM won't run
+    thread = threading.Thread(target=warm_up_on_start)
+    thread.start()
+    thread.join()
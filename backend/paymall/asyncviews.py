@@ -0,0 +1,55 @@
+"""
+Async counterparts of the DRF read endpoints.
+
+``AsyncAPIView`` is a plain Django async view that authenticates with
+``CachedJWTAuthentication`` and applies the same sliding-window throttles as
+the DRF views, without DRF's sync request/response machinery. Handlers
+return ``json_response(data)``; the body is rendered with the same
+ORJSONRenderer as the DRF views so both flavours produce identical bytes.
+
+Serve them under ``paymall.asgi`` with ``ASYNC_READ_VIEWS=True``.
+"""
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+
+from accounts.authentication import CachedJWTAuthentication
+from .renderers import ORJSONRenderer
+
+
+def json_response(data, status=200):
+    """JSON response that keeps ``data`` around for cache tagging"""
+    response = HttpResponse(ORJSONRenderer().render(data), content_type='application/json', status=status)
+    response.data = data
+    return response
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncAPIView(View):
+    authentication_required = True
+    throttle_classes = []
+    throttle_scope = None
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            result = await CachedJWTAuthentication().aauthenticate(request)
+        except (InvalidToken, AuthenticationFailed) as e:
+            return json_response(e.detail if isinstance(e.detail, dict) else {'detail': e.detail}, status=401)
+
+        request.user = result[0] if result else AnonymousUser()
+        if self.authentication_required and not request.user.is_authenticated:
+            return json_response({'detail': 'Authentication credentials were not provided.'}, status=401)
+
+        for throttle_class in self.throttle_classes:
+            throttle = throttle_class()
+            if not throttle.allow_request(request, self):
+                response = json_response({'detail': 'Request was throttled.'}, status=429)
+                wait = throttle.wait()
+                if wait is not None:
+                    response['Retry-After'] = str(max(1, round(wait)))
+                return response
+
+        return await super().dispatch(request, *args, **kwargs)
@@ -0,0 +1,183 @@
+"""
+Tag-based caching of rendered DRF responses.
+
+Decorate a view's ``get`` with ``cache_response()`` and give the view a
+``get_cache_tags(data)`` method returning tags such as ``product:12`` or
+``mall:3``. A cached entry is served only while none of its tags has been
+invalidated (``invalidate_tags``) since the entry started computing.
+Invalidation happens when the write's transaction commits, so a write
+racing with a cache fill can never leave a stale entry behind: a fill that
+read the old rows started before the commit.
+
+Entries and invalidations live in the ``default`` cache. That is
+per-process memory unless ``REDIS_URL`` is set, and then a write reaches
+only the worker that made it: the others serve stale responses for up to
+``RESPONSE_CACHE_TIMEOUT`` seconds. Run more than one worker only with the
+shared cache.
+
+Only one worker recomputes a missing entry at a time; others wait up to
+``RESPONSE_CACHE_LOCK_WAIT`` seconds for it before computing it themselves.
+"""
+import asyncio
+import functools
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+
+
+def _tag_key(tag):
+    return f"cache-tag:{tag}"
+
+
+def invalidate_tags(*tags, using=None):
+    """
+    Mark every cached response carrying any of ``tags`` as stale once the
+    transaction on database ``using`` (default) commits, or at once outside one
+    """
+    def invalidate():
+        now = time.time()
+        # Outlive any entry that could still carry the tag
+        cache.set_many(
+            {_tag_key(tag): now for tag in tags},
+            settings.RESPONSE_CACHE_TIMEOUT * 2,
+        )
+
+    transaction.on_commit(invalidate, using=using)
+
+
+def _is_fresh(entry, invalidated):
+    return all(ts < entry['computed_at'] for ts in invalidated.values())
+
+
+def _response_key(view, request, kwargs, per_user, fmt):
+    scope = f"user-{request.user.pk}" if per_user else 'public'
+    params = sorted(request.GET.lists())
+    digest = hashlib.md5(repr((sorted(kwargs.items()), params)).encode(), usedforsecurity=False)
+    return ':'.join((
+        'response',
+        f"{type(view).__module__}.{type(view).__qualname__}",
+        scope,
+        fmt,
+        digest.hexdigest(),
+    ))
+
+
+def _entry(response, tags, computed_at):
+    return {
+        'content': response.content,
+        'content_type': response['Content-Type'],
+        'tags': sorted(set(tags)),
+        'computed_at': computed_at,
+    }
+
+
+def _cached(entry):
+    if entry is None:
+        return None
+    invalidated = cache.get_many([_tag_key(tag) for tag in entry['tags']])
+    return _from_entry(entry) if _is_fresh(entry, invalidated) else None
+
+
+async def _acached(entry):
+    if entry is None:
+        return None
+    invalidated = await cache.aget_many([_tag_key(tag) for tag in entry['tags']])
+    return _from_entry(entry) if _is_fresh(entry, invalidated) else None
+
+
+def _from_entry(entry):
+    response = HttpResponse(entry['content'], content_type=entry['content_type'])
+    response['X-Cache'] = 'HIT'
+    return response
+
+
+def cache_response(timeout=None, per_user=False):
+    """
+    Cache the rendered 200 responses of a DRF view handler.
+
+    Authentication, permissions and throttling still run on every request;
+    only the handler (queries and serialization) is skipped on a hit.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(view, request, *args, **kwargs):
+            key = _response_key(view, request, kwargs, per_user, request.accepted_renderer.format)
+            if (hit := _cached(cache.get(key))) is not None:
+                return hit
+
+            lock_key = f"{key}:lock"
+            locked = cache.add(lock_key, 1, settings.RESPONSE_CACHE_LOCK_WAIT)
+            if not locked:
+                deadline = time.monotonic() + settings.RESPONSE_CACHE_LOCK_WAIT
+                while time.monotonic() < deadline:
+                    time.sleep(0.05)
+                    if (hit := _cached(cache.get(key))) is not None:
+                        return hit
+
+            try:
+                computed_at = time.time()
+                response = handler(view, request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+
+                response = view.finalize_response(request, response, *args, **kwargs)
+                response.render()
+                cache.set(
+                    key,
+                    _entry(response, view.get_cache_tags(response.data), computed_at),
+                    timeout or settings.RESPONSE_CACHE_TIMEOUT,
+                )
+                response['X-Cache'] = 'MISS'
+                return response
+            finally:
+                if locked:
+                    cache.delete(lock_key)
+
+        return wrapper
+    return decorator
+
+
+def acache_response(timeout=None, per_user=False):
+    """
+    Async counterpart of cache_response for AsyncAPIView handlers, which
+    return JSON responses carrying their payload in ``response.data``.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(view, request, *args, **kwargs):
+            key = _response_key(view, request, kwargs, per_user, 'json')
+            if (hit := await _acached(await cache.aget(key))) is not None:
+                return hit
+
+            lock_key = f"{key}:lock"
+            locked = await cache.aadd(lock_key, 1, settings.RESPONSE_CACHE_LOCK_WAIT)
+            if not locked:
+                deadline = time.monotonic() + settings.RESPONSE_CACHE_LOCK_WAIT
+                while time.monotonic() < deadline:
+                    await asyncio.sleep(0.05)
+                    if (hit := await _acached(await cache.aget(key))) is not None:
+                        return hit
+
+            try:
+                computed_at = time.time()
+                response = await handler(view, request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+
+                await cache.aset(
+                    key,
+                    _entry(response, view.get_cache_tags(response.data), computed_at),
+                    timeout or settings.RESPONSE_CACHE_TIMEOUT,
+                )
+                response['X-Cache'] = 'MISS'
+                return response
+            finally:
+                if locked:
+                    await cache.adelete(lock_key)
+
+        return wrapper
+    return decorator
@@ -0,0 +1,57 @@
+"""
+Per-request query hooks for sync and async requests alike.
+
+The request middlewares (metrics, profiling, slow-query log) watch the SQL
+a request runs. ``connection.execute_wrapper()`` can't do that from an
+async middleware: the ORM runs in a ``sync_to_async`` thread, on connection
+objects that must be created there. So every connection gets one permanent
+execute wrapper, ``dispatch``, when it connects, and ``watch_queries(hook)``
+registers a hook for the current context. Context variables follow a
+request into its ``sync_to_async`` threads, so ``dispatch`` finds the hooks
+of whichever request is running the query.
+
+Hooks take the ``execute_wrapper`` arguments, ``(execute, sql, params,
+many, context)``; the first registered is the outermost.
+"""
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+_hooks = ContextVar('query_hooks', default=())
+
+
+def dispatch(execute, sql, params, many, context):
+    call = execute
+    for hook in reversed(_hooks.get()):
+        call = functools.partial(hook, call)
+    return call(sql, params, many, context)
+
+
+@contextmanager
+def watch_queries(hook):
+    """Pass the queries run in this context (and threads it starts via asgiref) through ``hook``"""
+    token = _hooks.set((*_hooks.get(), hook))
+    try:
+        yield
+    finally:
+        _hooks.reset(token)
+
+
+def install(connection):
+    if dispatch not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, dispatch)
+
+
+@receiver(connection_created)
+def install_on_connect(sender, connection, **kwargs):
+    install(connection)
+
+
+def install_all():
+    """Install on the connections of this thread, some of which may be connected already"""
+    for connection in connections.all(initialized_only=True):
+        install(connection)
@@ -0,0 +1,56 @@
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+SCRIPT = (
+    "import {module}\n"
+    "from django.urls import get_resolver\n"
+    "get_resolver().url_patterns\n"
+)
+
+
+def parse_importtime(stderr):
+    """[(module, self_us, cumulative_us)] from ``python -X importtime`` output"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+class Command(BaseCommand):
+    help = "Import the app the way a worker boots it and report the slowest modules"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--module', default='paymall.wsgi', help="Entry point to import")
+        parser.add_argument('--limit', type=int, default=25)
+        parser.add_argument('--sort', choices=('self', 'cumulative'), default='cumulative')
+
+    def handle(self, *args, **options):
+        # A fresh interpreter, so nothing is already imported
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'paymall.settings')}
+        env.pop('WARM_UP_ON_START', None)
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', SCRIPT.format(module=options['module'])],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        rows = parse_importtime(result.stderr)
+        if result.returncode != 0:
+            errors = [line for line in result.stderr.splitlines() if not line.startswith('import time:')]
+            raise CommandError(f"Importing {options['module']} failed:\n" + '\n'.join(errors[-20:]))
+
+        index = 1 if options['sort'] == 'self' else 2
+        rows.sort(key=lambda row: row[index], reverse=True)
+        total = sum(row[1] for row in rows)
+
+        self.stdout.write(f"{'self ms':>9} {'cumul ms':>9}  module")
+        for name, self_us, cumulative_us in rows[:options['limit']]:
+            self.stdout.write(f"{self_us / 1000:9.1f} {cumulative_us / 1000:9.1f}  {name}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(rows)} modules imported in {total / 1000:.1f} ms (sum of self times)"
+        ))
@@ -0,0 +1,66 @@
+import io
+import os
+import pstats
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from paymall.profiling import list_profiles, profile_token
+
+
+class Command(BaseCommand):
+    help = "List recent request profiles, or summarize one by id"
+
+    def add_arguments(self, parser):
+        parser.add_argument('profile_id', nargs='?', help="Profile to summarize (default: list them)")
+        parser.add_argument('--limit', type=int, default=20, help="Profiles to list")
+        parser.add_argument('--view', help="Only list profiles of this URL name")
+        parser.add_argument('--top', type=int, default=25, help="Functions/queries shown in a summary")
+        parser.add_argument('--sort', default='cumulative', help="pstats sort key, e.g. cumulative or tottime")
+        parser.add_argument('--token', action='store_true', help="Print a signed X-Profile header value")
+
+    def handle(self, *args, **options):
+        if options['token']:
+            self.stdout.write(profile_token())
+        elif options['profile_id']:
+            self.summarize(options['profile_id'], options['top'], options['sort'])
+        else:
+            self.list_recent(options['limit'], options['view'])
+
+    def list_recent(self, limit, view):
+        profiles = [p for p in list_profiles() if view is None or p['view'] == view][:limit]
+        if not profiles:
+            self.stdout.write(f"No profiles in {settings.PROFILE_DIR}")
+            return
+
+        self.stdout.write(f"{'id':<30} {'when':<19} {'ms':>9} {'queries':>7} {'sql ms':>8} {'status':>6}  request")
+        for p in profiles:
+            when = datetime.fromtimestamp(p['created']).strftime('%Y-%m-%d %H:%M:%S')
+            self.stdout.write(
+                f"{p['id']:<30} {when:<19} {p['duration_ms']:>9.1f} {p['query_count']:>7} "
+                f"{p['query_ms']:>8.1f} {p['status']:>6}  {p['method']} {p['path']} ({p['view']})"
+            )
+
+    def summarize(self, profile_id, top, sort):
+        summary = next((p for p in list_profiles() if p['id'] == profile_id), None)
+        if summary is None:
+            raise CommandError(f"No profile {profile_id!r} in {settings.PROFILE_DIR}")
+        base = os.path.join(settings.PROFILE_DIR, profile_id)
+
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{summary['method']} {summary['path']} -> {summary['status']} in {summary['duration_ms']:.1f} ms, "
+            f"{summary['query_count']} queries in {summary['query_ms']:.1f} ms"
+        ))
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\nTop functions by {sort}"))
+        out = io.StringIO()
+        pstats.Stats(f"{base}.prof", stream=out).strip_dirs().sort_stats(sort).print_stats(top)
+        self.stdout.write(out.getvalue().split('\n\n', 1)[-1].rstrip())
+
+        if summary['queries']:
+            self.stdout.write(self.style.MIGRATE_HEADING("\nSlowest queries"))
+            for query in sorted(summary['queries'], key=lambda q: q['ms'], reverse=True)[:top]:
+                self.stdout.write(f"{query['ms']:>9.3f} ms  [{query['alias']}] {query['sql'][:200]}")
+
+        self.stdout.write(f"\nFlame graph input: {base}.collapsed")
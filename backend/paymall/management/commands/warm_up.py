@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from paymall.warmup import warm_up
+
+
+class Command(BaseCommand):
+    help = "Prime connections, URL resolver, serializers and shared catalog caches"
+
+    def handle(self, *args, **options):
+        failed = []
+        for step, seconds in warm_up().items():
+            if seconds is None:
+                failed.append(step)
+                self.stdout.write(self.style.ERROR(f"{step:<12} failed (see log)"))
+            else:
+                self.stdout.write(f"{step:<12} {seconds * 1000:8.1f} ms")
+
+        if failed:
+            self.stdout.write(self.style.WARNING(f"Warm-up finished with {len(failed)} failed step(s)"))
+        else:
+            self.stdout.write(self.style.SUCCESS("Warm-up complete"))
@@ -0,0 +1,234 @@
+"""
+Per-view request metrics in Prometheus text format.
+
+``MetricsMiddleware`` records latency, DB query count/time, response size
+and status for every request, keyed by the resolved URL name. Each thread
+writes to its own shard, so recording takes no lock; shards are merged when
+``/metrics`` is scraped.
+
+With ``METRICS_MULTIPROC_DIR`` set, every worker also dumps its totals to
+``<dir>/<pid>.json`` at most every ``METRICS_DUMP_INTERVAL`` seconds and the
+scrape merges all workers' files.
+"""
+import hmac
+import json
+import os
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+from .instrumentation import watch_queries
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _new_stats():
+    return {
+        'buckets': [0] * (len(LATENCY_BUCKETS) + 1),
+        'duration': 0.0,
+        'count': 0,
+        'queries': 0,
+        'query_time': 0.0,
+        'bytes': 0,
+        'statuses': {},
+    }
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        self._dumped_at = 0
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def record(self, view, method, status, duration, queries, query_time, size):
+        shard = self._shard()
+        stats = shard.get(view)
+        if stats is None:
+            stats = shard[view] = _new_stats()
+
+        index = next((i for i, le in enumerate(LATENCY_BUCKETS) if duration <= le), len(LATENCY_BUCKETS))
+        stats['buckets'][index] += 1
+        stats['duration'] += duration
+        stats['count'] += 1
+        stats['queries'] += queries
+        stats['query_time'] += query_time
+        stats['bytes'] += size
+        key = f"{method} {status}"
+        stats['statuses'][key] = stats['statuses'].get(key, 0) + 1
+
+    def snapshot(self):
+        """Merge all thread shards of this process"""
+        with self._shards_lock:
+            shards = list(self._shards)
+        merged = {}
+        for shard in shards:
+            _merge(merged, dict(shard))
+        return merged
+
+    def maybe_dump(self):
+        directory = settings.METRICS_MULTIPROC_DIR
+        now = time.monotonic()
+        if not directory or now - self._dumped_at < settings.METRICS_DUMP_INTERVAL:
+            return
+        self._dumped_at = now
+        self.dump(directory)
+
+    def dump(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{os.getpid()}.json")
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp, path)
+
+    def collect(self):
+        """This process's live totals plus every other worker's last dump"""
+        merged = self.snapshot()
+        directory = settings.METRICS_MULTIPROC_DIR
+        if directory and os.path.isdir(directory):
+            own = f"{os.getpid()}.json"
+            for name in os.listdir(directory):
+                if name.endswith('.json') and name != own:
+                    try:
+                        with open(os.path.join(directory, name)) as f:
+                            _merge(merged, json.load(f))
+                    except (OSError, ValueError):
+                        continue  # worker is mid-write or gone
+        return merged
+
+
+def _merge(into, stats_by_view):
+    for view, stats in stats_by_view.items():
+        target = into.setdefault(view, _new_stats())
+        target['buckets'] = [a + b for a, b in zip(target['buckets'], stats['buckets'])]
+        for field in ('duration', 'count', 'queries', 'query_time', 'bytes'):
+            target[field] += stats[field]
+        for key, count in list(stats['statuses'].items()):
+            target['statuses'][key] = target['statuses'].get(key, 0) + count
+    return into
+
+
+registry = MetricsRegistry()
+
+
+def render_prometheus(stats_by_view):
+    lines = [
+        '# HELP paymall_http_requests_total Requests by view, method and status.',
+        '# TYPE paymall_http_requests_total counter',
+    ]
+    for view, stats in sorted(stats_by_view.items()):
+        for key, count in sorted(stats['statuses'].items()):
+            method, status = key.split(' ')
+            lines.append(
+                f'paymall_http_requests_total{{view="{view}",method="{method}",status="{status}"}} {count}'
+            )
+
+    lines += [
+        '# HELP paymall_http_request_duration_seconds Request latency by view.',
+        '# TYPE paymall_http_request_duration_seconds histogram',
+    ]
+    for view, stats in sorted(stats_by_view.items()):
+        cumulative = 0
+        for le, count in zip(LATENCY_BUCKETS + ('+Inf',), stats['buckets']):
+            cumulative += count
+            lines.append(f'paymall_http_request_duration_seconds_bucket{{view="{view}",le="{le}"}} {cumulative}')
+        lines.append(f'paymall_http_request_duration_seconds_sum{{view="{view}"}} {stats["duration"]}')
+        lines.append(f'paymall_http_request_duration_seconds_count{{view="{view}"}} {stats["count"]}')
+
+    for name, field, help_text in (
+        ('paymall_http_db_queries_total', 'queries', 'DB queries run by view.'),
+        ('paymall_http_db_query_seconds_total', 'query_time', 'Time spent in DB queries by view.'),
+        ('paymall_http_response_bytes_total', 'bytes', 'Response body bytes by view.'),
+    ):
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        for view, stats in sorted(stats_by_view.items()):
+            lines.append(f'{name}{{view="{view}"}} {stats[field]}')
+
+    return '\n'.join(lines) + '\n'
+
+
+class _QueryTimer:
+    """Query hook counting and timing the queries of one request"""
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.time += time.perf_counter() - start
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        queries = _QueryTimer()
+        start = time.perf_counter()
+        with watch_queries(queries):
+            response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - start, queries)
+        return response
+
+    async def __acall__(self, request):
+        queries = _QueryTimer()
+        start = time.perf_counter()
+        with watch_queries(queries):
+            response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - start, queries)
+        return response
+
+    def record(self, request, response, duration, queries):
+        match = request.resolver_match
+        view = (match.url_name or match.route) if match else 'unresolved'
+        size = 0 if response.streaming else len(response.content)
+        registry.record(view, request.method, response.status_code, duration, queries.count, queries.time, size)
+        registry.maybe_dump()
+
+
+# Set by proxies; a request carrying one did not come from REMOTE_ADDR itself
+_PROXY_HEADERS = ('HTTP_X_FORWARDED_FOR', 'HTTP_FORWARDED', 'HTTP_X_REAL_IP')
+
+
+def _may_scrape(request):
+    if settings.METRICS_TOKEN:
+        scheme, _, token = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+        return scheme.lower() == 'bearer' and hmac.compare_digest(token.encode(), settings.METRICS_TOKEN.encode())
+    return (
+        request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
+        and not any(header in request.META for header in _PROXY_HEADERS)
+    )
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint, for METRICS_TOKEN holders or direct connections from METRICS_ALLOWED_IPS"""
+    if not _may_scrape(request):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        render_prometheus(registry.collect()),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
@@ -0,0 +1,283 @@
+"""
+On-demand request profiling.
+
+``ProfilingMiddleware`` profiles a request when it carries an ``X-Profile``
+header signed by ``profile_token()`` (see ``manage.py profiles --token``),
+or at random for a ``PROFILE_SAMPLE_RATE`` fraction of requests. The
+request then runs under cProfile while a sampler thread records its stack
+every ``PROFILE_SAMPLE_INTERVAL`` seconds, and every SQL query is timed.
+An async request is profiled in both threads it runs in: the event loop's
+and the sync thread its ORM calls run in. Other requests the loop runs
+meanwhile show up in the loop thread's share, so profile async requests
+on a quiet worker.
+Three files land in ``PROFILE_DIR``, named by the profile id that is also
+returned in the ``X-Profile-Id`` response header:
+
+- ``<id>.prof``: pstats data, for ``python -m pstats`` or snakeviz
+- ``<id>.collapsed``: collapsed stacks, for flamegraph.pl or speedscope
+- ``<id>.json``: request summary and the SQL queries with timings
+
+Only the newest ``PROFILE_KEEP`` profiles are kept.
+"""
+import cProfile
+import json
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core import signing
+
+from .instrumentation import watch_queries
+
+HEADER = 'HTTP_X_PROFILE'
+_SALT = 'paymall.profiling'
+
+
+def profile_token():
+    """Value for the X-Profile header, valid for PROFILE_TOKEN_MAX_AGE seconds"""
+    return signing.TimestampSigner(salt=_SALT).sign('profile')
+
+
+def _valid_token(token):
+    try:
+        signing.TimestampSigner(salt=_SALT).unsign(token, max_age=settings.PROFILE_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def _frame_name(code, roots):
+    filename = code.co_filename
+    for root in roots:
+        if filename.startswith(root + os.sep):
+            filename = filename[len(root) + 1:]
+            break
+    # ';' separates frames in the collapsed format
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(';', ':')
+
+
+class _Sampler(threading.Thread):
+    """Counts the stacks of some threads at a fixed interval"""
+
+    def __init__(self, thread_ids, interval):
+        super().__init__(name='paymall-profile-sampler', daemon=True)
+        self.thread_ids = thread_ids
+        self.interval = interval
+        self.stacks = Counter()
+        self._done = threading.Event()
+        self._roots = sorted({*filter(None, sys.path), str(settings.BASE_DIR)}, key=len, reverse=True)
+        self._names = {}
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in self.thread_ids:
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    name = self._names.get(code)
+                    if name is None:
+                        name = self._names[code] = _frame_name(code, self._roots)
+                    stack.append(name)
+                    frame = frame.f_back
+                if stack:
+                    self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+# Threads running a profiler: a second one would silently replace it
+_profiled_threads = set()
+_profiled_lock = threading.Lock()
+
+
+def _start_profiler():
+    """A cProfile profiler enabled in this thread, or None if the thread is already profiled"""
+    thread_id = threading.get_ident()
+    with _profiled_lock:
+        if thread_id in _profiled_threads:
+            return None
+        _profiled_threads.add(thread_id)
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler already owns this interpreter
+        _stop_profiler(None)
+        return None
+    return profiler
+
+
+def _stop_profiler(profiler):
+    if profiler is not None:
+        profiler.disable()
+    with _profiled_lock:
+        _profiled_threads.discard(threading.get_ident())
+
+
+class _QueryRecorder(list):
+    """Query hook recording the queries of one request with their timings"""
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.append({
+                'alias': context['connection'].alias,
+                'sql': sql,
+                'many': many,
+                'ms': round((time.perf_counter() - start) * 1000, 3),
+            })
+
+
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def should_profile(self, request):
+        token = request.META.get(HEADER)
+        if token:
+            return _valid_token(token)
+        rate = settings.PROFILE_SAMPLE_RATE
+        return rate > 0 and random.random() < rate
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.should_profile(request):
+            return self.get_response(request)
+
+        profiler = _start_profiler()
+        if profiler is None:
+            return self.get_response(request)
+
+        queries = _QueryRecorder()
+        sampler = _Sampler([threading.get_ident()], settings.PROFILE_SAMPLE_INTERVAL)
+        sampler.start()
+        start = time.perf_counter()
+        try:
+            with watch_queries(queries):
+                response = self.get_response(request)
+        finally:
+            duration = time.perf_counter() - start
+            _stop_profiler(profiler)
+            sampler.stop()
+
+        return self.finish(request, response, [profiler], sampler, duration, queries)
+
+    async def __acall__(self, request):
+        if not self.should_profile(request):
+            return await self.get_response(request)
+
+        # The request's sync_to_async calls all run in this one thread
+        sync_profiler = await sync_to_async(_start_profiler)()
+        if sync_profiler is None:
+            return await self.get_response(request)
+        sync_thread_id = await sync_to_async(threading.get_ident)()
+        profiler = _start_profiler()
+        if profiler is None:
+            await sync_to_async(_stop_profiler)(sync_profiler)
+            return await self.get_response(request)
+
+        queries = _QueryRecorder()
+        sampler = _Sampler([threading.get_ident(), sync_thread_id], settings.PROFILE_SAMPLE_INTERVAL)
+        sampler.start()
+        start = time.perf_counter()
+        try:
+            with watch_queries(queries):
+                response = await self.get_response(request)
+        finally:
+            duration = time.perf_counter() - start
+            _stop_profiler(profiler)
+            await sync_to_async(_stop_profiler)(sync_profiler)
+            sampler.stop()
+
+        return self.finish(request, response, [profiler, sync_profiler], sampler, duration, queries)
+
+    def finish(self, request, response, profilers, sampler, duration, queries):
+        profile_id = f"{int(time.time())}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        match = request.resolver_match
+        stats = pstats.Stats(*profilers)
+        write_profile(profile_id, stats, sampler.stacks, {
+            'id': profile_id,
+            'created': time.time(),
+            'method': request.method,
+            'path': request.path,
+            'view': (match.url_name or match.route) if match else None,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 3),
+            'query_count': len(queries),
+            'query_ms': round(sum(query['ms'] for query in queries), 3),
+            'queries': queries,
+        })
+        response['X-Profile-Id'] = profile_id
+        return response
+
+
+def write_profile(profile_id, stats, stacks, summary):
+    directory = settings.PROFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, profile_id)
+
+    stats.dump_stats(f"{base}.prof")
+    with open(f"{base}.collapsed", 'w') as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+    # Written last: list_profiles() only sees complete profiles
+    with open(f"{base}.json.tmp", 'w') as f:
+        json.dump(summary, f, indent=1)
+    os.replace(f"{base}.json.tmp", f"{base}.json")
+    _prune(directory)
+
+
+def _prune(directory):
+    """Remove all but the newest PROFILE_KEEP profiles, going by file times rather than reading each summary"""
+    summaries = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.endswith('.json'):
+                try:
+                    summaries.append((entry.stat().st_mtime, entry.name[:-len('.json')]))
+                except FileNotFoundError:
+                    continue  # pruned by another worker
+    if len(summaries) <= settings.PROFILE_KEEP:
+        return
+    summaries.sort(reverse=True)
+    for _, profile_id in summaries[settings.PROFILE_KEEP:]:
+        for ext in ('.json', '.prof', '.collapsed'):
+            try:
+                os.remove(os.path.join(directory, profile_id + ext))
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles():
+    """Summaries of the stored profiles, newest first"""
+    directory = settings.PROFILE_DIR
+    if not os.path.isdir(directory):
+        return []
+    summaries = []
+    for name in os.listdir(directory):
+        if name.endswith('.json'):
+            try:
+                with open(os.path.join(directory, name)) as f:
+                    summaries.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # removed or half-written by another worker
+    return sorted(summaries, key=lambda summary: summary['created'], reverse=True)
@@ -0,0 +1,139 @@
+"""
+Database routing: per-mall shards and primary/replica.
+
+``ShardRouter`` sends sharded models to their mall's shard when it is given
+the row (see ``paymall.sharding``) and otherwise leaves them to
+``PrimaryReplicaRouter``.
+
+Catalog and order-history models are read from the aliases listed in
+``DATABASE_REPLICAS`` (alias -> weight), round-robin by weight. Everything
+else, all writes and ``select_for_update`` querysets use ``default``.
+
+Reads are pinned to the primary for the rest of a request once it writes,
+for the whole of any unsafe (POST/PUT/PATCH/DELETE) request, and for
+``REPLICA_PIN_SECONDS`` afterwards through a cookie, so clients read their
+own writes despite replication lag.
+
+Replicas are only read within a ``replica_reads()`` block: a request, or a
+task run by the worker. Everything else (management commands, shells,
+threads of their own) reads the primary, so nothing outside those blocks is
+left pinned, or unpinned, by an earlier unit of work.
+
+Replicas get their schema through replication; ``migrate`` skips them.
+"""
+import itertools
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import sharding
+
+PIN_COOKIE = 'db_pin_primary'
+
+# None outside replica_reads(): pinned, and writes have nothing to pin
+_pinned = ContextVar('db_pinned', default=None)
+
+
+@contextmanager
+def replica_reads(pinned=False):
+    """Let reads in this block use the replicas until it writes (from the start if ``pinned``)"""
+    token = _pinned.set(pinned)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+def pin_to_primary():
+    if _pinned.get() is not None:
+        _pinned.set(True)
+
+
+def is_pinned():
+    return _pinned.get() is not False
+
+
+class ShardRouter:
+    def _shard(self, model, hints):
+        instance = hints.get('instance')
+        if instance is None or not sharding.is_sharded() or not sharding.is_sharded_model(model):
+            return None
+        return sharding.shard_for(instance)
+
+    def db_for_read(self, model, **hints):
+        return self._shard(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._shard(model, hints)
+
+
+class PrimaryReplicaRouter:
+    def __init__(self):
+        aliases = [
+            alias
+            for alias, weight in settings.DATABASE_REPLICAS.items()
+            for _ in range(weight)
+        ]
+        self.replicas = itertools.cycle(aliases) if aliases else None
+
+    def db_for_read(self, model, **hints):
+        if (
+            self.replicas is None
+            or is_pinned()
+            or model._meta.label_lower not in settings.REPLICA_READ_MODELS
+        ):
+            return 'default'
+        return next(self.replicas)
+
+    def db_for_write(self, model, **hints):
+        pin_to_primary()
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas copy the primary's schema along with its data
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class ReplicaPinningMiddleware:
+    """Pin the request's reads to the primary when it writes or recently wrote"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        unsafe = self.is_unsafe(request)
+        with replica_reads(pinned=unsafe or PIN_COOKIE in request.COOKIES):
+            return self.set_cookie(unsafe, self.get_response(request))
+
+    async def __acall__(self, request):
+        unsafe = self.is_unsafe(request)
+        with replica_reads(pinned=unsafe or PIN_COOKIE in request.COOKIES):
+            return self.set_cookie(unsafe, await self.get_response(request))
+
+    def is_unsafe(self, request):
+        return request.method not in ('GET', 'HEAD', 'OPTIONS')
+
+    def set_cookie(self, unsafe, response):
+        if unsafe and response.status_code < 400:
+            response.set_cookie(
+                PIN_COOKIE, '1',
+                max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
@@ -1,8 +1,14 @@
 from pathlib import Path
 from datetime import timedelta
+import hashlib
+import hmac
+import importlib.util
 import os
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
+from .db import database_config, replica_configs, shard_configs
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -35,13 +41,20 @@ INSTALLED_APPS = [
     'rest_framework',
     'rest_framework_simplejwt',
     'corsheaders',
+    'paymall',
     'accounts',
     'products',
     'orders',
+    'tasks',
 ]
 
 MIDDLEWARE = [
+    'paymall.metrics.MetricsMiddleware',
+    'paymall.profiling.ProfilingMiddleware',
+    'paymall.slowqueries.SlowQueryMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'django.middleware.gzip.GZipMiddleware',
+    'paymall.routers.ReplicaPinningMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -74,12 +87,124 @@ WSGI_APPLICATION = 'paymall.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
+# Configured from DATABASE_URL (see paymall/db.py), e.g.
+# postgres://paymall:secret@db:5432/paymall; defaults to the local SQLite file.
 
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+    'default': database_config(os.getenv('DATABASE_URL', f"sqlite:///{BASE_DIR / 'db.sqlite3'}")),
+}
+
+# Read replicas, e.g. DATABASE_REPLICA_URLS=sqlite:///replica.sqlite3#2,postgres://...
+_replicas = replica_configs(os.getenv('DATABASE_REPLICA_URLS', ''))
+DATABASES.update({alias: config for alias, (config, _) in _replicas.items()})
+DATABASE_REPLICAS = {alias: weight for alias, (_, weight) in _replicas.items()}
+
+# Per-mall shards besides default (see paymall/sharding.py), e.g.
+# DATABASE_SHARD_URLS=shard1=sqlite:///shard1.sqlite3,shard2=postgres://...
+_shards = shard_configs(os.getenv('DATABASE_SHARD_URLS', ''))
+DATABASES.update(_shards)
+DATABASE_SHARDS = ['default', *_shards]
+
+DATABASE_ROUTERS = ['paymall.routers.ShardRouter', 'paymall.routers.PrimaryReplicaRouter']
+
+# Models whose rows live on the shard of their mall
+SHARDED_MODELS = {
+    'products.product',
+    'orders.cart',
+    'orders.cartitem',
+    'orders.order',
+    'orders.orderitem',
+    'products.copurchase',
+    'products.copurchasewatermark',
+    'products.recommendation',
+}
+
+# Models whose reads may be served by a replica
+REPLICA_READ_MODELS = {
+    'products.mall',
+    'products.category',
+    'products.product',
+    'orders.order',
+    'orders.orderitem',
+}
+
+# Seconds a client's reads stay on the primary after it writes
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 5))
+
+
+# Cache
+# Shared Redis cache when REDIS_URL is set, otherwise per-process memory.
+# Shards need the shared cache: every worker routes by the cached shard map
+# (paymall.sharding.shard_map), and a move must reach them all at once.
+if _shards and not os.getenv('REDIS_URL'):
+    raise ImproperlyConfigured("DATABASE_SHARD_URLS needs the shared cache; set REDIS_URL")
+
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'paymall',
+        }
     }
+
+# Rendered API responses (paymall.cache)
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('RESPONSE_CACHE_TIMEOUT', 300))
+RESPONSE_CACHE_LOCK_WAIT = float(os.getenv('RESPONSE_CACHE_LOCK_WAIT', 2))
+
+
+# Request metrics (paymall.metrics), scraped from /metrics with
+# "Authorization: Bearer <METRICS_TOKEN>". Without a token, only direct
+# connections from METRICS_ALLOWED_IPS may scrape: behind a reverse proxy
+# every request comes from the proxy's address, so set the token there
+METRICS_TOKEN = os.getenv('METRICS_TOKEN') or None
+METRICS_ALLOWED_IPS = os.getenv('METRICS_ALLOWED_IPS', '127.0.0.1').split(',')
+METRICS_MULTIPROC_DIR = os.getenv('METRICS_MULTIPROC_DIR') or None
+METRICS_DUMP_INTERVAL = float(os.getenv('METRICS_DUMP_INTERVAL', 5))
+
+# On-demand request profiling (paymall/profiling.py): requests with a signed
+# X-Profile header, plus a random PROFILE_SAMPLE_RATE fraction of the rest
+PROFILE_DIR = os.getenv('PROFILE_DIR', str(BASE_DIR / 'profiles'))
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', 0.005))
+PROFILE_TOKEN_MAX_AGE = int(os.getenv('PROFILE_TOKEN_MAX_AGE', 60 * 60))
+PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', 200))
+
+# Slow-query log (paymall.slowqueries); SLOW_QUERY_MS=0 turns it off
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 200))
+SLOW_QUERY_REPEAT_INTERVAL = float(os.getenv('SLOW_QUERY_REPEAT_INTERVAL', 60))
+SLOW_QUERY_LOG = os.getenv('SLOW_QUERY_LOG', str(BASE_DIR / 'logs' / 'slow_queries.log'))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        # Messages are already JSON objects
+        'jsonl': {'format': '{message}', 'style': '{'},
+    },
+    'handlers': {
+        'slow_queries': {
+            'class': 'paymall.slowqueries.MakedirsRotatingFileHandler',
+            'filename': SLOW_QUERY_LOG,
+            'maxBytes': int(os.getenv('SLOW_QUERY_LOG_MAX_BYTES', 10 * 1024 * 1024)),
+            'backupCount': int(os.getenv('SLOW_QUERY_LOG_BACKUPS', 5)),
+            'formatter': 'jsonl',
+            'delay': True,
+        },
+    },
+    'loggers': {
+        'paymall.slowqueries': {
+            'handlers': ['slow_queries'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
 }
 
 
@@ -129,15 +254,41 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 # REST Framework settings
+# MessagePack is offered through content negotiation when msgpack is installed
+MSGPACK_AVAILABLE = importlib.util.find_spec('msgpack') is not None
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'accounts.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
-    ]
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'paymall.renderers.ORJSONRenderer',
+        *(['paymall.renderers.MessagePackRenderer'] if MSGPACK_AVAILABLE else []),
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'paymall.renderers.ORJSONParser',
+        *(['paymall.renderers.MessagePackParser'] if MSGPACK_AVAILABLE else []),
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    # Per-view rates for paymall.throttling (views set throttle_scope)
+    'DEFAULT_THROTTLE_RATES': {
+        'scan': os.getenv('THROTTLE_RATE_SCAN', '120/min'),
+        'catalog': os.getenv('THROTTLE_RATE_CATALOG', '60/min'),
+        'register': os.getenv('THROTTLE_RATE_REGISTER', '10/hour'),
+        'gate': os.getenv('THROTTLE_RATE_GATE', '600/min'),
+        'live': os.getenv('THROTTLE_RATE_LIVE', '30/min'),
+    },
 }
 
+# Optional cache alias used to aggregate throttle counters across workers
+THROTTLE_SHARED_CACHE = os.getenv('THROTTLE_SHARED_CACHE') or None
+THROTTLE_SHARED_FLUSH_INTERVAL = float(os.getenv('THROTTLE_SHARED_FLUSH_INTERVAL', 1))
+
 # Simple JWT settings
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=5),
@@ -154,9 +305,97 @@ SIMPLE_JWT = {
     'TOKEN_TYPE_CLAIM': 'token_type',
 }
 
+# Refresh-token revocation store (accounts.revocation)
+TOKEN_REVOCATION_BLOOM_CAPACITY = int(os.getenv('TOKEN_REVOCATION_BLOOM_CAPACITY', 100000))
+TOKEN_REVOCATION_SYNC_INTERVAL = int(os.getenv('TOKEN_REVOCATION_SYNC_INTERVAL', 5))
+# Each sync re-reads revocations created this many seconds before the last
+# one, to catch those that committed late or on a server with a slower clock
+TOKEN_REVOCATION_SYNC_OVERLAP = int(os.getenv('TOKEN_REVOCATION_SYNC_OVERLAP', 60))
+TOKEN_REVOCATION_REBUILD_INTERVAL = int(os.getenv('TOKEN_REVOCATION_REBUILD_INTERVAL', 60 * 60))
+
+# Signed exit receipts (orders.receipts). Gate devices verifying offline hold
+# the signing key, so it is never SECRET_KEY, which also signs access tokens:
+# unset, it is derived from SECRET_KEY (manage.py receipt_signing_key prints
+# it). Old keys go in the comma-separated fallbacks while receipts signed
+# with them are still valid
+RECEIPT_SIGNING_KEY = os.getenv('RECEIPT_SIGNING_KEY') or (
+    hmac.new(SECRET_KEY.encode(), b'paymall.receipts', hashlib.sha256).hexdigest() if SECRET_KEY else None
+)
+RECEIPT_SIGNING_KEY_FALLBACKS = [key for key in os.getenv('RECEIPT_SIGNING_KEY_FALLBACKS', '').split(',') if key]
+if SECRET_KEY and SECRET_KEY in (RECEIPT_SIGNING_KEY, *RECEIPT_SIGNING_KEY_FALLBACKS):
+    raise ImproperlyConfigured("RECEIPT_SIGNING_KEY must not be SECRET_KEY; gate devices hold it")
+# Seconds after checkout a receipt opens the exit gate, once
+RECEIPT_MAX_AGE = int(os.getenv('RECEIPT_MAX_AGE', 60 * 60))
+RECEIPT_REVOCATION_SYNC_INTERVAL = int(os.getenv('RECEIPT_REVOCATION_SYNC_INTERVAL', 10))
+# Gate devices send "Authorization: Bearer <GATE_TOKEN>" to verify receipts and
+# list revoked ones; unset, both endpoints refuse every request
+GATE_TOKEN = os.getenv('GATE_TOKEN') or None
+
+# Admin changelists of unfiltered tables past this many rows show an
+# estimated count from table statistics (paymall/admin.py)
+ADMIN_EXACT_COUNT_LIMIT = int(os.getenv('ADMIN_EXACT_COUNT_LIMIT', 100000))
+
+# Background tasks (tasks/queue.py), run by manage.py run_workers
+TASK_WORKERS = int(os.getenv('TASK_WORKERS', 4))
+TASK_POOL = os.getenv('TASK_POOL', 'thread')  # or 'process' for CPU-bound tasks
+TASK_POLL_INTERVAL = float(os.getenv('TASK_POLL_INTERVAL', 1))
+TASK_MAX_ATTEMPTS = int(os.getenv('TASK_MAX_ATTEMPTS', 5))
+TASK_RETRY_BACKOFF = float(os.getenv('TASK_RETRY_BACKOFF', 30))
+TASK_RETRY_BACKOFF_MAX = float(os.getenv('TASK_RETRY_BACKOFF_MAX', 60 * 60))
+# Seconds a task may run before it is presumed lost with its worker
+TASK_LOCK_TIMEOUT = int(os.getenv('TASK_LOCK_TIMEOUT', 15 * 60))
+# Seconds finished tasks are kept; failed ones stay until deleted
+TASK_KEEP_DONE = int(os.getenv('TASK_KEEP_DONE', 24 * 60 * 60))
+
+# Cart items untouched this many days are dropped (orders.tasks.purge_abandoned_carts)
+CART_ABANDON_DAYS = int(os.getenv('CART_ABANDON_DAYS', 7))
+
+# Uploaded product images are shrunk to fit this many pixels (products.tasks.shrink_image)
+PRODUCT_IMAGE_MAX_SIZE = int(os.getenv('PRODUCT_IMAGE_MAX_SIZE', 1024))
+
+# "Frequently bought together" products shown per product (products.recommendations)
+RECOMMENDATIONS_TOP_K = int(os.getenv('RECOMMENDATIONS_TOP_K', 5))
+# Orders are counted into recommendations once this many seconds old
+RECOMMENDATIONS_SETTLE_SECONDS = int(os.getenv('RECOMMENDATIONS_SETTLE_SECONDS', 5 * 60))
+
 # Custom user model
 AUTH_USER_MODEL = 'accounts.User'
 
+# ModelBackend, hashing in a process pool on the async login path (accounts/backends.py)
+AUTHENTICATION_BACKENDS = ['accounts.backends.PooledModelBackend']
+
+# Seconds an authenticated user stays cached by CachedJWTAuthentication.
+# Saving a user invalidates the copies in the shared cache at once; with
+# per-process memory (no REDIS_URL) other workers keep theirs until this
+# runs out, and a deactivated user gets in there until then, so it is short
+AUTH_USER_CACHE_TIMEOUT = int(os.getenv('AUTH_USER_CACHE_TIMEOUT', 60 if os.getenv('REDIS_URL') else 5))
+
+# Serve login/registration from the async views (run under paymall.asgi)
+ASYNC_AUTH_VIEWS = os.getenv('ASYNC_AUTH_VIEWS', 'False') == 'True'
+
+# Serve the catalog, cart and order-list reads from the async views
+ASYNC_READ_VIEWS = os.getenv('ASYNC_READ_VIEWS', 'False') == 'True'
+
+# Live stock/price server-sent events at /api/products/events/ (products/live.py);
+# needs paymall.asgi
+LIVE_EVENTS = os.getenv('LIVE_EVENTS', 'False') == 'True'
+LIVE_COALESCE_SECONDS = float(os.getenv('LIVE_COALESCE_SECONDS', 0.5))
+LIVE_KEEPALIVE_SECONDS = float(os.getenv('LIVE_KEEPALIVE_SECONDS', 15))
+LIVE_RETRY_MS = int(os.getenv('LIVE_RETRY_MS', 3000))
+# Open streams per worker, in all and per client (user, else IP), and mall
+# plus product ids per stream; opening streams is throttled at the 'live' rate
+LIVE_MAX_STREAMS = int(os.getenv('LIVE_MAX_STREAMS', 1000))
+LIVE_MAX_STREAMS_PER_CLIENT = int(os.getenv('LIVE_MAX_STREAMS_PER_CLIENT', 4))
+LIVE_MAX_IDS = int(os.getenv('LIVE_MAX_IDS', 50))
+# Carries change batches to every worker; the default only reaches this process
+LIVE_BACKPLANE = os.getenv('LIVE_BACKPLANE', 'products.live.LocalBackplane')
+
+# Prime connections and caches in paymall.wsgi/asgi before serving (paymall/warmup.py)
+WARM_UP_ON_START = os.getenv('WARM_UP_ON_START', 'False') == 'True'
+
+# Processes used by the async views for PBKDF2 hashing
+PASSWORD_HASHING_WORKERS = int(os.getenv('PASSWORD_HASHING_WORKERS', os.cpu_count() or 1))
+
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:8080",
     "http://127.0.0.1:8080",
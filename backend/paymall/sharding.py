@@ -0,0 +1,335 @@
+"""
+Per-mall sharding.
+
+Everything that belongs to one mall (``SHARDED_MODELS``: its products, the
+orders placed there and the carts holding its products) lives on the mall's
+shard, one of the databases in ``DATABASE_SHARDS``. ``Mall.shard`` is the
+shard map. ``ShardRouter`` sends saves and related lookups of a sharded row
+to its mall's shard, and ``move_mall()`` (``manage.py move_mall``) moves a
+mall's rows from one shard to another.
+
+Users, malls and categories (``REFERENCE_MODELS``) are written to
+``default`` and copied to every other shard, so foreign keys and joins from
+sharded rows resolve on the shard itself.
+
+A router never sees a queryset's filters, so code querying sharded models
+picks the shard itself: ``on_shard()`` for one mall, ``locate()`` and
+``find_shard()`` for a row by key, and ``for_shards()``/``fan_out()`` to
+read every shard and merge the results, e.g. for a user's order history.
+Each shard numbers sharded rows from its own block of ``SHARD_ID_SPAN``
+ids, so ids stay unique across shards and name the shard a row was created
+on, which is where ``locate()`` looks first.
+
+With only the ``default`` shard all of these leave routing to the other
+routers (read replicas included) and cost no extra queries.
+"""
+import copy
+import heapq
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from .conditional import version
+
+SHARD_ID_SPAN = 10 ** 12
+
+REFERENCE_MODELS = (settings.AUTH_USER_MODEL, 'products.Mall', 'products.Category')
+
+
+def shards():
+    return settings.DATABASE_SHARDS
+
+
+def is_sharded():
+    return len(settings.DATABASE_SHARDS) > 1
+
+
+def is_sharded_model(model):
+    return model._meta.label_lower in settings.SHARDED_MODELS
+
+
+def shard_map():
+    """
+    {mall id: shard} of every mall that isn't on the default shard, cached
+    under the ``malls`` version. Saving a mall bumps it once the save
+    commits, so every worker sharing the cache reads the new map from then on.
+    """
+    key = f"shard-map:{version('malls')}"
+    mapping = cache.get(key)
+    if mapping is None:
+        Mall = apps.get_model('products', 'Mall')
+        mapping = dict(
+            Mall.objects.using(DEFAULT_DB_ALIAS).exclude(shard=DEFAULT_DB_ALIAS).values_list('id', 'shard')
+        )
+        cache.set(key, mapping, settings.RESPONSE_CACHE_TIMEOUT)
+    return mapping
+
+
+def shard_for_mall(mall_id):
+    """The shard of ``mall_id``; None (let the routers decide) when unsharded"""
+    if not is_sharded() or mall_id is None:
+        return None
+    return shard_map().get(int(mall_id), DEFAULT_DB_ALIAS)
+
+
+def shard_for(instance):
+    """The shard of a sharded row, or of a mall's rows; None if not known"""
+    if not is_sharded():
+        return None
+    if instance._meta.label_lower == 'products.mall':
+        return shard_for_mall(instance.pk)
+    if not is_sharded_model(type(instance)):
+        return None
+    mall_id = getattr(instance, 'mall_id', None)
+    if mall_id is not None:
+        return shard_for_mall(mall_id)
+    # Carts and items live with the rows they were loaded from or attached to
+    return instance._state.db
+
+
+def on_shard(queryset, mall_id):
+    """``queryset`` on the shard of ``mall_id``"""
+    return queryset.using(shard_for_mall(mall_id))
+
+
+def for_shards(queryset):
+    """``queryset`` on each shard; as it is when unsharded or already on one"""
+    if not is_sharded() or queryset._db is not None:
+        return [queryset]
+    return [queryset.using(alias) for alias in shards()]
+
+
+def _merge(results, key, reverse):
+    if key is None:
+        return [row for rows in results for row in rows]
+    return list(heapq.merge(*results, key=key, reverse=reverse))
+
+
+def fan_out(queryset, key=None, reverse=False):
+    """
+    The rows of ``queryset`` from every shard. Give the ``key`` (and
+    ``reverse``) it is ordered by to merge them in that order.
+    """
+    return _merge([list(queryset) for queryset in for_shards(queryset)], key, reverse)
+
+
+async def afan_out(queryset, key=None, reverse=False):
+    return _merge([[row async for row in queryset] for queryset in for_shards(queryset)], key, reverse)
+
+
+def _search_order(queryset, lookups):
+    if not is_sharded() or queryset._db is not None:
+        return [queryset]
+    aliases = list(shards())
+    # Look first on the shard the row was created on
+    pk = lookups.get('pk', lookups.get('id'))
+    try:
+        home = aliases[int(pk) // SHARD_ID_SPAN]
+    except (TypeError, ValueError, IndexError):
+        home = None
+    if home is not None:
+        aliases.remove(home)
+        aliases.insert(0, home)
+    return [queryset.using(alias) for alias in aliases]
+
+
+def locate(queryset, **lookups):
+    """The first row of ``queryset`` matching ``lookups`` on any shard, or None"""
+    for candidate in _search_order(queryset, lookups):
+        row = candidate.filter(**lookups).first()
+        if row is not None:
+            return row
+    return None
+
+
+async def alocate(queryset, **lookups):
+    for candidate in _search_order(queryset, lookups):
+        row = await candidate.filter(**lookups).afirst()
+        if row is not None:
+            return row
+    return None
+
+
+def find_shard(queryset, **lookups):
+    """
+    The shard with a row of ``queryset`` matching ``lookups``; None when
+    unsharded (no query is made) or when no shard has one.
+    """
+    if not is_sharded() or queryset._db is not None:
+        return queryset._db
+    for candidate in _search_order(queryset, lookups):
+        if candidate.filter(**lookups).exists():
+            return candidate._db
+    return None
+
+
+async def afind_shard(queryset, **lookups):
+    if not is_sharded() or queryset._db is not None:
+        return queryset._db
+    for candidate in _search_order(queryset, lookups):
+        if await candidate.filter(**lookups).aexists():
+            return candidate._db
+    return None
+
+
+def insert_raw(model, objs, using):
+    """Insert ``objs`` as they are, like loaddata: ids and timestamps are not assigned again"""
+    fields = model._meta.local_concrete_fields
+    batch_size = connections[using].ops.bulk_batch_size(fields, objs) or len(objs)
+    for start in range(0, len(objs), batch_size):
+        model._base_manager.using(using)._insert(objs[start:start + batch_size], fields=fields, using=using, raw=True)
+
+
+def replicate(instance, using, raw=False):
+    """Copy a reference row saved on default to the other shards"""
+    if not is_sharded() or raw or using != DEFAULT_DB_ALIAS:
+        return
+    for alias in shards()[1:]:
+        # Raw saves write the fields as they are and tell receivers (this one too) to skip them
+        copy.copy(instance).save_base(raw=True, using=alias)
+
+
+def unreplicate(instance, using):
+    """Delete the copies of a reference row deleted on default"""
+    if not is_sharded() or using != DEFAULT_DB_ALIAS:
+        return
+    for alias in shards()[1:]:
+        type(instance)._base_manager.using(alias).filter(pk=instance.pk).delete()
+
+
+def sync_reference_tables(using, batch_size=1000):
+    """Copy the reference rows that shard ``using`` is missing from default"""
+    for label in REFERENCE_MODELS:
+        model = apps.get_model(label)
+        rows = model._base_manager.using(DEFAULT_DB_ALIAS).order_by('pk')
+        last = None
+        while batch := list((rows if last is None else rows.filter(pk__gt=last))[:batch_size]):
+            last = batch[-1].pk
+            present = set(
+                model._base_manager.using(using).filter(pk__in=[row.pk for row in batch]).values_list('pk', flat=True)
+            )
+            missing = [row for row in batch if row.pk not in present]
+            if missing:
+                insert_raw(model, missing, using)
+
+
+def prepare_shard(using):
+    """Ready a newly migrated shard: its own block of ids and the reference rows"""
+    if using not in shards()[1:]:
+        return
+    reserve_id_blocks(using)
+    sync_reference_tables(using)
+
+
+def reserve_id_blocks(using):
+    """Start the ids of sharded tables on shard ``using`` at the shard's block"""
+    if using not in shards():
+        return
+    start = shards().index(using) * SHARD_ID_SPAN
+    if not start:
+        return
+    connection = connections[using]
+    tables = set(connection.introspection.table_names())
+    with connection.cursor() as cursor:
+        for label in sorted(settings.SHARDED_MODELS):
+            table = apps.get_model(label)._meta.db_table
+            if table not in tables:
+                continue
+            if connection.vendor == 'sqlite':
+                # AUTOINCREMENT tables continue from sqlite_sequence
+                cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = %s", [table])
+                row = cursor.fetchone()
+                if row is None:
+                    cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)", [table, start])
+                elif row[0] < start:
+                    cursor.execute("UPDATE sqlite_sequence SET seq = %s WHERE name = %s", [start, table])
+            elif connection.vendor == 'postgresql':
+                cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+                sequence = cursor.fetchone()[0]
+                cursor.execute(f"SELECT last_value FROM {sequence}")
+                if cursor.fetchone()[0] < start:
+                    cursor.execute("SELECT setval(%s, %s)", [sequence, start])
+
+
+def move_mall(mall, target, batch_size=500):
+    """
+    Move the products, recommendations, orders and cart items of ``mall``
+    to shard ``target`` and point the shard map at it. Returns {model label:
+    rows moved}.
+
+    Checkout at the mall waits for the move: the mall's products stay locked
+    until it commits. Shards don't share transactions, so the source is
+    only cleared once the target has committed, and rows left on the target
+    by an interrupted move are deleted before copying again.
+    """
+    if target not in shards():
+        raise ValueError(f"Unknown shard {target!r}; shards are {', '.join(shards())}")
+    source = shard_for_mall(mall.pk) or DEFAULT_DB_ALIAS
+    if source == target:
+        raise ValueError(f"{mall} is on {target} already")
+
+    Product = apps.get_model('products', 'Product')
+    Cart, CartItem = apps.get_model('orders', 'Cart'), apps.get_model('orders', 'CartItem')
+    # Copied in this order, deleted in reverse; cart items are copied last, into the target's carts
+    tables = [
+        (apps.get_model(label), lookup)
+        for label, lookup in (
+            ('products.Product', 'mall'),
+            ('products.CoPurchase', 'product__mall'),
+            ('products.Recommendation', 'product__mall'),
+            ('products.CoPurchaseWatermark', 'mall'),
+            ('orders.Order', 'mall'),
+            ('orders.OrderItem', 'order__mall'),
+        )
+    ]
+
+    def rows(model, alias, **lookups):
+        return model._base_manager.using(alias).filter(**lookups).order_by('pk')
+
+    def clear(alias):
+        rows(CartItem, alias, product__mall=mall).delete()
+        for model, lookup in reversed(tables):
+            rows(model, alias, **{lookup: mall}).delete()
+
+    def copy_rows(model, queryset, prepare=None):
+        count, last = 0, None
+        while batch := list((queryset if last is None else queryset.filter(pk__gt=last))[:batch_size]):
+            last = batch[-1].pk
+            if prepare:
+                prepare(batch)
+            insert_raw(model, batch, target)
+            count += len(batch)
+        return count
+
+    sync_reference_tables(target)
+    moved = {}
+    with transaction.atomic(using=source):
+        # Checkout locks the products it sells, so this holds it off until the move commits
+        list(rows(Product, source, mall=mall).select_for_update().values_list('pk', flat=True))
+
+        with transaction.atomic(using=target):
+            clear(target)
+            for model, lookup in tables:
+                moved[model._meta.label_lower] = copy_rows(model, rows(model, source, **{lookup: mall}))
+
+            # Items join the user's cart on the target, which may hold other malls' items
+            carts = {}
+
+            def to_target_carts(items):
+                for item in items:
+                    if item.cart.user_id not in carts:
+                        carts[item.cart.user_id] = Cart._base_manager.using(target).get_or_create(
+                            user_id=item.cart.user_id,
+                        )[0].pk
+                    item.cart_id = carts[item.cart.user_id]
+
+            moved['orders.cartitem'] = copy_rows(
+                CartItem, rows(CartItem, source, product__mall=mall).select_related('cart'), to_target_carts,
+            )
+
+        clear(source)
+        mall.shard = target
+        mall.save(update_fields=['shard', 'updated_at'])
+    return moved
@@ -0,0 +1,182 @@
+"""
+Slow-query log.
+
+``SlowQueryMiddleware`` times every statement a request runs and logs
+those slower than ``SLOW_QUERY_MS`` to the ``paymall.slowqueries`` logger as
+one JSON object per line, with the view and the innermost project stack
+frame that issued them. Statements are grouped by a fingerprint of their
+normalized SQL: the first slow occurrence of a fingerprint is logged with
+its ``EXPLAIN`` plan; later ones are folded into a repeat entry logged at
+most every ``SLOW_QUERY_REPEAT_INTERVAL`` seconds.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import traceback
+from logging.handlers import RotatingFileHandler
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .instrumentation import watch_queries
+
+logger = logging.getLogger(__name__)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_LIST = re.compile(r"\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)")
+_SPACE = re.compile(r"\s+")
+_READ = re.compile(r"\s*(SELECT|WITH)\b", re.IGNORECASE)
+
+
+def normalize(sql):
+    """SQL with literals and IN-list lengths erased"""
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = sql.replace('%s', '?')
+    sql = _LIST.sub('(?+)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+def fingerprint(sql):
+    return hashlib.md5(normalize(sql).encode(), usedforsecurity=False).hexdigest()[:16]
+
+
+# Modules whose execute wrappers sit between the ORM and the database, and
+# sharding.py, which evaluates querysets on its callers' behalf
+_WRAPPER_MODULES = {
+    os.path.join('paymall', name)
+    for name in ('instrumentation.py', 'metrics.py', 'profiling.py', 'slowqueries.py', 'sharding.py')
+}
+
+
+def _origin():
+    """Innermost stack frame in project code, skipping the execute wrappers"""
+    root = str(settings.BASE_DIR) + os.sep
+    for frame in reversed(traceback.extract_stack()):
+        if not frame.filename.startswith(root) or f"{os.sep}site-packages{os.sep}" in frame.filename:
+            continue
+        path = os.path.relpath(frame.filename, root)
+        if path not in _WRAPPER_MODULES:
+            return f"{path}:{frame.lineno} in {frame.name}"
+    return None
+
+
+class SlowQueryLog:
+    def __init__(self, max_fingerprints=10000):
+        self.max_fingerprints = max_fingerprints
+        self.seen = {}
+        self._local = threading.local()
+
+    def explain(self, connection, sql, params):
+        # Our wrapper sees the EXPLAIN too; don't recurse into it
+        self._local.explaining = True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(f"{connection.ops.explain_query_prefix()} {sql}", params)
+                # SQLite prefixes each plan line with node ids; the text is last
+                return [str(row[-1]) for row in cursor.fetchall()]
+        except Exception as e:
+            return [f"EXPLAIN failed: {e}"]
+        finally:
+            self._local.explaining = False
+
+    def record(self, connection, sql, params, explain, duration, view):
+        key = fingerprint(sql)
+        entry = {
+            'fingerprint': key,
+            'ms': round(duration * 1000, 3),
+            'alias': connection.alias,
+            'view': view,
+            'origin': _origin(),
+        }
+        now = time.monotonic()
+        stats = self.seen.get(key)
+
+        if stats is None:
+            if len(self.seen) >= self.max_fingerprints:
+                self.seen.clear()
+            self.seen[key] = {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'logged_at': now}
+            entry.update(
+                event='slow_query',
+                sql=normalize(sql),
+                plan=self.explain(connection, sql, params) if explain else None,
+            )
+            logger.warning(json.dumps(entry))
+            return
+
+        stats['count'] += 1
+        stats['total_ms'] += entry['ms']
+        stats['max_ms'] = max(stats['max_ms'], entry['ms'])
+        if now - stats['logged_at'] >= settings.SLOW_QUERY_REPEAT_INTERVAL:
+            entry.update(
+                event='slow_query_repeat',
+                count=stats['count'],
+                total_ms=round(stats['total_ms'], 3),
+                max_ms=stats['max_ms'],
+            )
+            logger.warning(json.dumps(entry))
+            stats.update(count=0, total_ms=0.0, max_ms=0.0, logged_at=now)
+
+    def wrapper(self, request):
+        threshold = settings.SLOW_QUERY_MS / 1000
+
+        def log_slow(execute, sql, params, many, context):
+            if getattr(self._local, 'explaining', False):
+                return execute(sql, params, many, context)
+            start = time.perf_counter()
+            failed = True
+            try:
+                result = execute(sql, params, many, context)
+                failed = False
+                return result
+            finally:
+                duration = time.perf_counter() - start
+                if duration >= threshold:
+                    match = request.resolver_match
+                    view = (match.url_name or match.route) if match else None
+                    # Only EXPLAIN reads that succeeded: a failing EXPLAIN would
+                    # abort the surrounding transaction on PostgreSQL
+                    explain = not many and not failed and _READ.match(sql) is not None
+                    self.record(context['connection'], sql, params, explain, duration, view)
+
+        return log_slow
+
+
+slow_query_log = SlowQueryLog()
+
+
+class SlowQueryMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.SLOW_QUERY_MS:
+            return self.get_response(request)
+        with watch_queries(slow_query_log.wrapper(request)):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        if not settings.SLOW_QUERY_MS:
+            return await self.get_response(request)
+        with watch_queries(slow_query_log.wrapper(request)):
+            return await self.get_response(request)
+
+
+class MakedirsRotatingFileHandler(RotatingFileHandler):
+    """RotatingFileHandler that creates the log directory on first write"""
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        return super()._open()
@@ -0,0 +1,149 @@
+import os
+import re
+import tempfile
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+
+from .db import database_config
+
+
+class QueryBudgetTestCase(APITestCase):
+    """
+    Checks that an endpoint runs a fixed number of queries however large its
+    fixture grows, and no more than the budget recorded in QUERY_BUDGETS.
+    """
+    QUERY_BUDGETS = {}
+
+    def _run(self, request):
+        # Measure the cold path: no cached user or response
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = request()
+        self.assertLess(response.status_code, 400, getattr(response, 'data', response))
+        return context.captured_queries
+
+    def assertQueryBudget(self, name, request, grow):
+        """Run ``request`` before and after ``grow()`` enlarges the fixture"""
+        small = self._run(request)
+        grow()
+        large = self._run(request)
+
+        budget = self.QUERY_BUDGETS[name]
+        if len(large) != len(small) or len(large) > budget:
+            sql = '\n'.join(f"  {i}. {query['sql']}" for i, query in enumerate(large, 1))
+            self.fail(
+                f"{name}: {len(small)} queries on the small fixture, {len(large)} on the "
+                f"large one (budget {budget}). Queries on the large fixture:\n{sql}"
+            )
+
+
+class QueryPlanTestCase(TestCase):
+    """
+    Checks via EXPLAIN that hot queries are answered from the expected
+    index rather than a full table scan or a sort.
+    """
+
+    def assertUsesIndex(self, queryset, index):
+        table = queryset.model._meta.db_table
+        if connection.vendor == 'postgresql':
+            # Tiny test tables would otherwise always be scanned sequentially
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+        plan = queryset.explain()
+
+        self.assertIn(index, plan, f"{index} not used:\n{plan}")
+        if connection.vendor == 'sqlite':
+            self.assertIsNone(
+                re.search(rf"\bSCAN {table}\b(?! USING (COVERING )?INDEX)", plan), f"Full scan:\n{plan}"
+            )
+            self.assertNotIn('USE TEMP B-TREE', plan, f"Sorts outside the index:\n{plan}")
+        elif connection.vendor == 'postgresql':
+            self.assertNotIn(f"Seq Scan on {table}", plan, f"Full scan:\n{plan}")
+
+
+class ShardedTestCase(APITestCase):
+    """
+    Runs with two SQLite shards besides default, ``shard1`` and ``shard2``,
+    migrated into a temporary directory for the test class.
+    """
+    shards = ('shard1', 'shard2')
+
+    @classmethod
+    def setUpClass(cls):
+        cls._shard_dir = tempfile.TemporaryDirectory()
+        shards = {
+            alias: database_config(f"sqlite:///{os.path.join(cls._shard_dir.name, alias)}.sqlite3")
+            for alias in cls.shards
+        }
+        configured = connections.configure_settings({'default': connections.settings['default'], **shards})
+        for alias in cls.shards:
+            connections.settings[alias] = configured[alias]
+        # Only now, so the test runner doesn't look for the shards before they exist
+        cls.databases = {'default', *cls.shards}
+        cls._shard_settings = override_settings(DATABASE_SHARDS=['default', *cls.shards])
+        cls._shard_settings.enable()
+        for alias in cls.shards:
+            call_command('migrate', database=alias, verbosity=0)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls._shard_settings.disable()
+        for alias in cls.shards:
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+        cls._shard_dir.cleanup()
+
+    def setUp(self):
+        # The shard map is cached
+        cache.clear()
+
+
+class ReplicaTestCase(APITestCase):
+    """
+    Runs with a read replica of default, ``replica``: a second SQLite file
+    with the schema but none of the data, so any read it serves shows.
+    """
+    replicas = ('replica',)
+
+    @classmethod
+    def setUpClass(cls):
+        cls._replica_dir = tempfile.TemporaryDirectory()
+        replicas = {
+            alias: database_config(f"sqlite:///{os.path.join(cls._replica_dir.name, alias)}.sqlite3")
+            for alias in cls.replicas
+        }
+        configured = connections.configure_settings({'default': connections.settings['default'], **replicas})
+        for alias in cls.replicas:
+            connections.settings[alias] = configured[alias]
+            # Before it is a replica, which migrate skips
+            call_command('migrate', database=alias, verbosity=0)
+        cls.databases = {'default', *cls.replicas}
+        # Setting the routers again builds them anew, with the replicas
+        cls._replica_settings = override_settings(
+            DATABASE_REPLICAS={alias: 1 for alias in cls.replicas},
+            DATABASE_ROUTERS=list(settings.DATABASE_ROUTERS),
+        )
+        cls._replica_settings.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls._replica_settings.disable()
+        for alias in cls.replicas:
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+        cls._replica_dir.cleanup()
+
+    def setUp(self):
+        cache.clear()
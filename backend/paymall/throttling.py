@@ -0,0 +1,165 @@
+"""
+Sliding-window request throttles.
+
+Views opt in with ``throttle_classes`` and a ``throttle_scope`` whose rate is
+configured in ``REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']``. Counters live in
+process memory, so a throttled request never touches the database. When
+``THROTTLE_SHARED_CACHE`` names a cache alias, each process also flushes its
+counts to that cache at most every ``THROTTLE_SHARED_FLUSH_INTERVAL`` seconds
+and uses the aggregated total for its decisions.
+"""
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import ScopedRateThrottle
+
+
+class _Window:
+    __slots__ = ('start', 'duration', 'previous', 'current', 'pending', 'flushed_at')
+
+    def __init__(self, start, duration):
+        self.start = start
+        self.duration = duration
+        self.previous = 0
+        self.current = 0
+        self.pending = 0
+        self.flushed_at = start
+
+
+class SlidingWindowCounters:
+    """
+    Per-process sliding-window counters keyed by throttle cache key.
+
+    At most ``max_keys`` keys are kept; past that the least recently hit is
+    dropped, live or not, so a flood of distinct keys can't grow memory.
+    A client evicted while active starts counting afresh.
+
+    No locks are taken: increments racing on the same key may occasionally
+    be lost, which only makes the limit slightly soft.
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self.windows = OrderedDict()
+
+    def hit(self, key, duration, now):
+        """Record a request and return the sliding-window estimate including it"""
+        start = now - now % duration
+        window = self.windows.get(key)
+        if window is None:
+            while len(self.windows) >= self.max_keys:
+                try:
+                    self.windows.popitem(last=False)
+                except KeyError:
+                    break  # emptied by another thread
+            window = self.windows.setdefault(key, _Window(start, duration))
+        else:
+            try:
+                self.windows.move_to_end(key)
+            except KeyError:
+                pass  # evicted by another thread meanwhile
+
+        if window.start != start:
+            window.previous = window.current if start - window.start == duration else 0
+            window.start = start
+            window.current = window.pending = 0
+
+        window.current += 1
+        window.pending += 1
+
+        shared = settings.THROTTLE_SHARED_CACHE
+        if shared and now - window.flushed_at >= settings.THROTTLE_SHARED_FLUSH_INTERVAL:
+            self._flush(caches[shared], key, window, duration, now)
+        elif not shared:
+            window.pending = 0
+
+        weight = 1 - (now - start) / duration
+        return window.previous * weight + window.current
+
+    def _flush(self, cache, key, window, duration, now):
+        shared_key = f"{key}_{int(window.start)}"
+        pending, window.pending = window.pending, 0
+        cache.add(shared_key, 0, duration * 2)
+        try:
+            window.current = cache.incr(shared_key, pending)
+        except ValueError:
+            # Expired between add() and incr(); keep the local count
+            window.pending += pending
+        window.flushed_at = now
+
+    def time_left(self, key, duration, now):
+        window = self.windows.get(key)
+        if window is None:
+            return None
+        return max(0, window.start + duration - now)
+
+
+counters = SlidingWindowCounters()
+
+
+class SlidingWindowThrottle(ScopedRateThrottle):
+    """
+    Base sliding-window throttle; subclasses choose what identifies a client.
+
+    Like ScopedRateThrottle, views without a ``throttle_scope`` are not
+    throttled.
+    """
+    counters = counters
+
+    def allow_request(self, request, view):
+        self.scope = getattr(view, self.scope_attr, None)
+        if not self.scope:
+            return True
+
+        self.rate = self.get_rate()
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        self.now = self.timer()
+        return self.counters.hit(self.key, self.duration, self.now) <= self.num_requests
+
+    def wait(self):
+        return self.counters.time_left(self.key, self.duration, self.now)
+
+
+class IPSlidingWindowThrottle(SlidingWindowThrottle):
+    """Throttle by client IP address"""
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+class UserSlidingWindowThrottle(SlidingWindowThrottle):
+    """Throttle by authenticated user, falling back to client IP"""
+
+    def get_cache_key(self, request, view):
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            ident = f"user-{user.pk}"
+        else:
+            ident = self.get_ident(request)
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+
+class DeviceSlidingWindowThrottle(UserSlidingWindowThrottle):
+    """
+    Throttle by the X-Device-ID header, falling back to user then IP.
+
+    The header is the client's say-so, so anonymous requests count against
+    the device at their IP: another client can't use up a device's limit by
+    sending its id.
+    """
+
+    def get_cache_key(self, request, view):
+        device_id = request.META.get('HTTP_X_DEVICE_ID')
+        if not device_id:
+            return super().get_cache_key(request, view)
+        ident = f"device-{device_id[:64]}"
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_authenticated:
+            ident = f"{ident}-{self.get_ident(request)}"
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
@@ -3,16 +3,21 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from .metrics import metrics_view
+from .views import BootstrapView
+
 # API URL patterns
 api_urlpatterns = [
     path('users/', include('accounts.urls')),
     path('products/', include('products.urls')),
     path('orders/', include('orders.urls')),
+    path('bootstrap/', BootstrapView.as_view(), name='bootstrap'),
 ]
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include(api_urlpatterns)),  # All API endpoints under /api/
+    path('metrics', metrics_view, name='metrics'),  # Internal Prometheus scrape
 ]
 
 # Serve media files in development
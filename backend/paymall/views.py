@@ -0,0 +1,52 @@
+import hashlib
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from rest_framework import permissions, status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from accounts.serializers import UserSerializer, PaymentMethodSerializer
+from orders.models import Cart
+from orders.serializers import CartSerializer
+from orders.views import cart_shard
+from products.models import Category
+from products.serializers import CategorySerializer
+
+
+def _etag(data):
+    body = json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True).encode()
+    return hashlib.md5(body, usedforsecurity=False).hexdigest()
+
+
+class BootstrapView(APIView):
+    """
+    APP STARTUP
+    - Profile, payment methods, cart with totals and categories in one call
+    - Per-section ETags in the body, overall ETag header for If-None-Match
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        cart, _ = Cart.objects.with_items().using(cart_shard(request.user)).get_or_create(user=request.user)
+
+        data = {
+            'profile': UserSerializer(request.user).data,
+            'payment_methods': PaymentMethodSerializer(
+                request.user.payment_methods.all(), many=True
+            ).data,
+            'cart': CartSerializer(cart).data,
+            'categories': CategorySerializer(
+                Category.objects.all(), many=True, context={'request': request}
+            ).data,
+        }
+        data['etags'] = {section: _etag(value) for section, value in data.items()}
+
+        etag = quote_etag(_etag(data['etags']))
+        # Weak comparison against each ETag of the If-None-Match list
+        if get_conditional_response(request, etag=etag) is not None:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        return Response(data, headers={'ETag': etag})
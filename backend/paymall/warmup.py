@@ -0,0 +1,99 @@
+"""
+Prime per-process state before a worker takes traffic.
+
+``warm_up()`` opens the database connections, populates the URL resolver,
+builds the serializer field maps, revocation Bloom filter and receipt
+revocation list, and fills the shared category-list and mall-index caches,
+so the first real requests don't pay for any of it. It runs from ``paymall.wsgi``/``paymall.asgi``
+when ``WARM_UP_ON_START`` is set (``warm_up_on_start()``), or on demand via
+``manage.py warm_up``.
+
+At server start the connections are closed again once warmed up: with
+``gunicorn --preload`` the app is imported before the workers fork, and
+forked workers must not share the parent's connections; under ASGI the
+warm-up thread's connections would never be used again.
+"""
+import logging
+import time
+
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.db import connections
+from django.test import RequestFactory
+from django.urls import get_resolver, resolve, reverse
+
+logger = logging.getLogger(__name__)
+
+
+def _connect():
+    for connection in connections.all():
+        connection.ensure_connection()
+
+
+def _urls():
+    get_resolver().reverse_dict
+
+
+def _serializers():
+    from accounts.serializers import PaymentMethodSerializer, UserSerializer
+    from orders.serializers import CartSerializer, OrderDetailSerializer, OrderSerializer
+    from products.serializers import CategorySerializer, ProductDetailSerializer, ProductSerializer
+
+    for serializer_class in (
+        UserSerializer, PaymentMethodSerializer, CategorySerializer, ProductSerializer,
+        ProductDetailSerializer, CartSerializer, OrderSerializer, OrderDetailSerializer,
+    ):
+        serializer_class().fields
+
+
+def _revocations():
+    from accounts.revocation import revocation_store
+    from orders.receipts import receipt_revocations
+    revocation_store.load()
+    receipt_revocations.load()
+
+
+def _categories():
+    # Through whichever view is routed, so its response cache entry is filled
+    path = reverse('category_list')
+    view = resolve(path).func
+    if iscoroutinefunction(view):
+        view = async_to_sync(view)
+    view(RequestFactory().get(path, HTTP_ACCEPT='application/json'))
+
+
+def _malls():
+    from products.views import mall_index
+    mall_index()
+
+
+STEPS = (
+    ('database', _connect),
+    ('urls', _urls),
+    ('serializers', _serializers),
+    ('revocations', _revocations),
+    ('categories', _categories),
+    ('malls', _malls),
+)
+
+
+def warm_up():
+    """Run every step, logging failures; returns {step: seconds or None}"""
+    timings = {}
+    for name, step in STEPS:
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception:
+            logger.exception("Warm-up step %r failed", name)
+            timings[name] = None
+        else:
+            timings[name] = time.perf_counter() - start
+    return timings
+
+
+def warm_up_on_start():
+    """warm_up(), then close this thread's connections; see the module docstring"""
+    try:
+        return warm_up()
+    finally:
+        connections.close_all()
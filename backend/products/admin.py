@@ -1,20 +1,25 @@
 from django.contrib import admin
+from paymall.admin import LargeTableAdmin
 from .models import Mall, Category, Product
 
 class MallAdmin(admin.ModelAdmin):
-    list_display = ('name', 'location', 'is_active', 'created_at')
-    list_filter = ('is_active',)
+    list_display = ('name', 'location', 'is_active', 'shard', 'created_at')
+    list_filter = ('is_active', 'shard')
     search_fields = ('name', 'location')
+    # Changed by manage.py move_mall, which moves the mall's rows along with it
+    readonly_fields = ('shard',)
 
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ('name', 'created_at')
     search_fields = ('name',)
 
-class ProductAdmin(admin.ModelAdmin):
+class ProductAdmin(LargeTableAdmin):
     list_display = ('name', 'barcode', 'price', 'marked_price', 'discount_percentage', 
                     'category', 'mall', 'stock_quantity', 'is_available')
     list_filter = ('is_available', 'category', 'mall')
+    list_select_related = ('category', 'mall')
     search_fields = ('name', 'barcode', 'description')
+    autocomplete_fields = ('category', 'mall')
     readonly_fields = ('discount_percentage',)
 
 admin.site.register(Mall, MallAdmin)
@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def prepare_shard(using, **kwargs):
+    from paymall.sharding import prepare_shard
+    prepare_shard(using)
 
 
 class ProductsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'products'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        post_migrate.connect(prepare_shard, sender=self)
@@ -0,0 +1,214 @@
+"""
+Live stock and price updates.
+
+Product saves (and the bulk stock/price updates of checkout and repricing,
+via ``publish_products``) mark products as changed once their transaction
+commits. The ``ChangeCollector`` coalesces changes for
+``LIVE_COALESCE_SECONDS``, loads the current price and stock of everything
+changed in one query, and publishes the batch on the backplane. Every
+worker's ``Broadcaster`` receives it from the backplane and fans each change
+out to the subscribers of its mall or product, which
+``ProductEventStreamView`` streams to clients as server-sent events.
+
+The backplane (``LIVE_BACKPLANE``) is what carries a batch to every worker.
+``LocalBackplane`` is the single-process stand-in; a Redis PUBLISH/SUBSCRIBE
+backplane with the same two methods would reach all workers, since batches
+are plain JSON-serializable lists.
+
+Enabled with ``LIVE_EVENTS``; the stream needs ``paymall.asgi``. Each
+worker holds at most ``LIVE_MAX_STREAMS`` streams, and
+``LIVE_MAX_STREAMS_PER_CLIENT`` of them for one client.
+"""
+import asyncio
+import logging
+import threading
+from collections import Counter, defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils.module_loading import import_string
+
+from paymall.sharding import shard_for_mall
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+LIVE_FIELDS = ('price', 'marked_price', 'discount_percentage', 'stock_quantity', 'is_available')
+
+
+class LocalBackplane:
+    """In-process stand-in for a pub/sub channel shared by all workers"""
+
+    def __init__(self):
+        self._handlers = []
+
+    def subscribe(self, handler):
+        self._handlers.append(handler)
+
+    def publish(self, changes):
+        for handler in self._handlers:
+            handler(changes)
+
+
+class TooManyStreams(Exception):
+    pass
+
+
+class Subscription:
+    """One client's stream; changes pending delivery are merged per product"""
+
+    def __init__(self, broadcaster, malls, products, client=None):
+        self.broadcaster = broadcaster
+        self.client = client
+        self.channels = {('mall', pk) for pk in malls} | {('product', pk) for pk in products}
+        self.loop = asyncio.get_running_loop()
+        self._pending = {}
+        self._ready = asyncio.Event()
+
+    def push(self, changes):
+        """Queue ``changes`` from any thread"""
+        try:
+            self.loop.call_soon_threadsafe(self._deliver, changes)
+        except RuntimeError:
+            # The client's event loop is gone
+            self.close()
+
+    def _deliver(self, changes):
+        for change in changes:
+            self._pending[change['id']] = change
+        self._ready.set()
+
+    async def get(self):
+        """Wait for the changes since the last call"""
+        await self._ready.wait()
+        self._ready.clear()
+        changes, self._pending = list(self._pending.values()), {}
+        return changes
+
+    def close(self):
+        self.broadcaster.unsubscribe(self)
+
+
+class Broadcaster:
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._open = set()
+        self._per_client = Counter()
+        self._lock = threading.Lock()
+
+    def subscribe(self, malls=(), products=(), client=None):
+        """
+        Subscribe the running event loop to changes of ``malls`` and
+        ``products`` for ``client``; raises TooManyStreams past the limits
+        """
+        subscription = Subscription(self, malls, products, client)
+        with self._lock:
+            if len(self._open) >= settings.LIVE_MAX_STREAMS:
+                raise TooManyStreams("Too many open streams")
+            if client is not None and self._per_client[client] >= settings.LIVE_MAX_STREAMS_PER_CLIENT:
+                raise TooManyStreams("Too many open streams for this client")
+            self._open.add(subscription)
+            if client is not None:
+                self._per_client[client] += 1
+            for channel in subscription.channels:
+                self._subscribers[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription not in self._open:
+                return
+            self._open.discard(subscription)
+            if subscription.client is not None:
+                self._per_client[subscription.client] -= 1
+                if not self._per_client[subscription.client]:
+                    del self._per_client[subscription.client]
+            for channel in subscription.channels:
+                subscribers = self._subscribers.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[channel]
+
+    def dispatch(self, changes):
+        per_subscription = defaultdict(list)
+        with self._lock:
+            for change in changes:
+                channels = (('mall', change['mall']), ('product', change['id']))
+                for subscription in set().union(*(self._subscribers.get(channel, ()) for channel in channels)):
+                    per_subscription[subscription].append(change)
+        for subscription, matching in per_subscription.items():
+            subscription.push(matching)
+
+
+class ChangeCollector:
+    def __init__(self, publish):
+        self.publish = publish
+        self._pending = {}
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def add(self, products):
+        """Mark (pk, mall_id) pairs changed; published at the end of the window"""
+        with self._lock:
+            self._pending.update(products)
+            if self._timer is None:
+                self._timer = threading.Timer(settings.LIVE_COALESCE_SECONDS, self._flush_in_timer)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _flush_in_timer(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Publishing product changes failed")
+        finally:
+            # The timer thread's own connection
+            connections.close_all()
+
+    def flush(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        # From the primary (a replica may not have the write yet) of each mall's shard
+        by_shard = defaultdict(list)
+        for pk, mall_id in pending.items():
+            by_shard[shard_for_mall(mall_id) or DEFAULT_DB_ALIAS].append(pk)
+        rows = [
+            row
+            for alias, pks in by_shard.items()
+            for row in Product.objects.using(alias).filter(pk__in=pks).values('id', 'mall_id', *LIVE_FIELDS)
+        ]
+        # Decimals as strings, like the API, so batches stay JSON for the backplane
+        changes = [
+            {
+                'id': row.pop('id'),
+                'mall': row.pop('mall_id'),
+                **{field: str(value) if isinstance(value, Decimal) else value for field, value in row.items()},
+            }
+            for row in rows
+        ]
+        found = {change['id'] for change in changes}
+        changes += [{'id': pk, 'mall': mall_id, 'deleted': True} for pk, mall_id in pending.items() if pk not in found]
+        self.publish(changes)
+
+
+backplane = import_string(settings.LIVE_BACKPLANE)()
+broadcaster = Broadcaster()
+backplane.subscribe(broadcaster.dispatch)
+collector = ChangeCollector(backplane.publish)
+
+
+def publish_products(products, using=None):
+    """Push the current state of ``products`` to live subscribers once the transaction on ``using`` commits"""
+    if not settings.LIVE_EVENTS:
+        return
+    pairs = [(product.pk, product.mall_id) for product in products]
+    if pairs:
+        transaction.on_commit(lambda: collector.add(pairs), using=using)
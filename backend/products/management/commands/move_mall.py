@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from paymall.sharding import move_mall, shard_for_mall
+from products.models import Mall
+
+
+class Command(BaseCommand):
+    help = "Move a mall's products, recommendations, orders and cart items to another shard (see paymall/sharding.py)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('mall', type=int, help="Mall id")
+        parser.add_argument('shard', help="Target database alias, one of DATABASE_SHARDS")
+        parser.add_argument('--batch-size', type=int, default=500, help="Rows copied per INSERT (default 500)")
+
+    def handle(self, *args, **options):
+        try:
+            mall = Mall.objects.get(pk=options['mall'])
+        except Mall.DoesNotExist:
+            raise CommandError(f"No mall with id {options['mall']}")
+
+        source = shard_for_mall(mall.pk) or 'default'
+        try:
+            moved = move_mall(mall, options['shard'], batch_size=options['batch_size'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        for label, count in moved.items():
+            self.stdout.write(f"{label:<30} {count:>8}")
+        self.stdout.write(self.style.SUCCESS(f"Moved {mall} from {source} to {options['shard']}"))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from products.models import Mall
+from products.recommendations import refresh
+
+
+class Command(BaseCommand):
+    help = "Add the orders placed since the last refresh to the frequently-bought-together recommendations"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mall', type=int, action='append', help="Only this mall id (repeatable)")
+
+    def handle(self, *args, **options):
+        malls = None
+        if options['mall']:
+            malls = list(Mall.objects.filter(pk__in=options['mall']).order_by('pk'))
+            missing = set(options['mall']) - {mall.pk for mall in malls}
+            if missing:
+                raise CommandError(f"No mall with id {', '.join(map(str, sorted(missing)))}")
+
+        refreshed = refresh(malls)
+        for mall_id, count in refreshed.items():
+            self.stdout.write(f"Mall {mall_id}: {count} products re-ranked")
+        self.stdout.write(self.style.SUCCESS(f"Refreshed {len(refreshed)} malls"))
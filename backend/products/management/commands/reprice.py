@@ -0,0 +1,60 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.pricing import markdown, price_list, read_price_list
+
+
+class Command(BaseCommand):
+    help = "Reprice products in bulk: a percent markdown, or fixed prices from a CSV file"
+
+    def add_arguments(self, parser):
+        rule = parser.add_mutually_exclusive_group(required=True)
+        rule.add_argument('--percent', type=Decimal, help="Price at this percent off the marked price")
+        rule.add_argument('--price-list', metavar='FILE', help="CSV of barcode,price")
+        parser.add_argument('--mall', type=int, help="Only products of this mall id")
+        parser.add_argument('--category', type=int, help="Only products of this category id (--percent)")
+        parser.add_argument('--round-to', type=Decimal, help="Round prices to a multiple of this, e.g. 0.05")
+        parser.add_argument('--ending', type=Decimal, help="Round prices down to end in this, e.g. 0.99")
+        parser.add_argument('--dry-run', action='store_true', help="Show the changes without writing them")
+        parser.add_argument('--limit', type=int, default=50, help="Changes listed (default 50)")
+
+    def handle(self, *args, **options):
+        rounding = {'step': options['round_to'], 'ending': options['ending']}
+        if options['ending'] is not None and not 0 <= options['ending'] < 1:
+            raise CommandError("--ending must be at least 0 and below 1")
+
+        if options['percent'] is not None:
+            if not 0 <= options['percent'] < 100:
+                raise CommandError("--percent must be at least 0 and below 100")
+            repricing = markdown(options['percent'], options['mall'], options['category'], **rounding)
+        else:
+            if options['category'] is not None:
+                raise CommandError("--category only applies to --percent")
+            try:
+                with open(options['price_list'], newline='') as f:
+                    prices = read_price_list(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"{options['price_list']}: {e}")
+            repricing = price_list(prices, options['mall'], **rounding)
+
+        for barcode in repricing.unknown_barcodes:
+            self.stdout.write(self.style.WARNING(f"Unknown barcode {barcode}"))
+
+        if not options['dry_run']:
+            count = repricing.apply()
+            self.stdout.write(self.style.SUCCESS(f"Repriced {count} products"))
+            return
+
+        count = 0
+        for change in repricing.changes():
+            count += 1
+            if count <= options['limit']:
+                self.stdout.write(
+                    f"{change['barcode']:<20} {change['name'][:30]:<30} "
+                    f"{change['price']:>10} -> {change['new_price']:<10} "
+                    f"discount {change['discount_percentage']}% -> {change['new_discount']}%"
+                )
+        if count > options['limit']:
+            self.stdout.write(f"... and {count - options['limit']} more")
+        self.stdout.write(self.style.SUCCESS(f"Would reprice {count} products (dry run)"))
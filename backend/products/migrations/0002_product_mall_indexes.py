@@ -0,0 +1,25 @@
+# Generated by Django 5.2.7 on 2026-10-19 16:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mall',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['id', 'name', 'latitude', 'longitude'], name='mall_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['mall', 'category'], name='product_avail_mall_cat_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['category'], name='product_avail_cat_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 16:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0002_product_mall_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mall',
+            name='shard',
+            field=models.CharField(default='default', max_length=50),
+        ),
+    ]
@@ -9,10 +9,23 @@ class Mall(models.Model):
     longitude = models.FloatField()
     image = models.ImageField(upload_to='mall_images/', blank=True, null=True)
     is_active = models.BooleanField(default=True)
+    # Database holding the mall's products and orders (paymall.sharding);
+    # changed by manage.py move_mall, which moves them
+    shard = models.CharField(max_length=50, default='default')
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        indexes = [
+            # Covers the cached mall index (active malls and their coordinates)
+            models.Index(
+                fields=['id', 'name', 'latitude', 'longitude'],
+                condition=models.Q(is_active=True),
+                name='mall_active_idx',
+            ),
+        ]
+    
     def __str__(self):
         return self.name
 
@@ -50,12 +63,69 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        # Partial on is_available: filter(is_available=True) compiles to a bare
+        # boolean column, which can't use an index on that column
+        indexes = [
+            # Product list filtered by mall (and category)
+            models.Index(
+                fields=['mall', 'category'],
+                condition=models.Q(is_available=True),
+                name='product_avail_mall_cat_idx',
+            ),
+            # Product list filtered by category only
+            models.Index(
+                fields=['category'],
+                condition=models.Q(is_available=True),
+                name='product_avail_cat_idx',
+            ),
+        ]
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember where the product was listed so cache invalidation can
+        # also reach the mall/category it is moved out of
+        loaded = dict(zip(field_names, values))
+        instance._loaded_placement = (loaded.get('mall_id'), loaded.get('category_id'))
+        instance._loaded_image = loaded.get('image')
+        return instance
+    
     def save(self, *args, **kwargs):
-        # Calculate discount percentage if not provided
-        if self.marked_price > 0 and self.discount_percentage == 0:
+        # Keep the discount in step with the prices (products.pricing.discount_for in SQL)
+        if self.marked_price > 0:
             discount = ((self.marked_price - self.price) / self.marked_price) * 100
             self.discount_percentage = round(discount, 2)
         super().save(*args, **kwargs)
     
     def __str__(self):
         return f"{self.name} - {self.barcode}"
+
+class CoPurchase(models.Model):
+    """Orders containing both products: one entry of a mall's co-occurrence matrix (products.recommendations)"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    other = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    count = models.PositiveIntegerField()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'other'], name='copurchase_pair_unique'),
+        ]
+
+class CoPurchaseWatermark(models.Model):
+    """Orders of the mall placed up to ``counted_until`` are in its CoPurchase counts"""
+    mall = models.OneToOneField(Mall, on_delete=models.CASCADE, related_name='+')
+    counted_until = models.DateTimeField(null=True)
+
+class Recommendation(models.Model):
+    """A product's top co-purchased products ("frequently bought together"), by rank"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.PositiveIntegerField()
+    
+    class Meta:
+        constraints = [
+            # Also the index of the detail and barcode endpoints' lookup
+            models.UniqueConstraint(fields=['product', 'rank'], name='recommendation_rank_unique'),
+        ]
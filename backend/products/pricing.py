@@ -0,0 +1,157 @@
+"""
+Set-based repricing.
+
+A ``Repricing`` is a list of (product queryset, price expression)
+statements evaluated entirely by the database. ``changes()`` previews the
+products whose price or discount would change; ``apply()`` writes each
+statement as one UPDATE that also recomputes ``discount_percentage`` from
+the new price, then invalidates the affected products' cached responses
+and pushes their new prices to live subscribers.
+
+Build one with ``markdown()`` (percent off the marked price, for a mall
+and/or category) or ``price_list()`` (fixed prices by barcode, in batches
+of ``batch_size`` per UPDATE). Both take the rounding rules of
+``rounded()``, and write to each shard holding the products concerned.
+
+Across shards ``apply()`` is not a distributed transaction: it holds one
+transaction per shard and commits them one after another, so if a commit
+fails (or the process dies) between two of them, some shards are repriced
+and the rest are not. Applying the same repricing again completes it.
+"""
+import csv
+from contextlib import ExitStack
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Value, When
+from django.db.models.functions import Floor, Round
+from django.db.models.lookups import GreaterThanOrEqual
+from django.utils import timezone
+
+from paymall.sharding import for_shards, on_shard
+from .live import publish_products
+from .models import Product
+from .signals import invalidate_products
+
+PRICE = DecimalField(max_digits=10, decimal_places=2)
+PERCENT = DecimalField(max_digits=5, decimal_places=2)
+
+CHANGE_FIELDS = ('id', 'barcode', 'name', 'mall_id', 'price', 'new_price', 'discount_percentage', 'new_discount')
+
+
+def rounded(price, step=None, ending=None):
+    """
+    ``price`` rounded to a multiple of ``step`` (e.g. 0.05), then down to the
+    nearest amount ending in ``ending`` (e.g. 0.99 for 9.99, 19.99, ...).
+    SQLite computes in floating point, so exact halves may round down there.
+    """
+    if step:
+        price = Round(price / Value(step, PRICE)) * Value(step, PRICE)
+    if ending is not None:
+        ending = Value(ending, PRICE)
+        # Prices below the ending are left as they are rather than made negative
+        price = Case(When(GreaterThanOrEqual(price, ending), then=Floor(price - ending) + ending), default=price)
+    return Round(price, 2, output_field=PRICE)
+
+
+def discount_for(price):
+    """Product.save()'s discount_percentage, computed from ``price`` in SQL"""
+    return Case(
+        When(marked_price__gt=0, then=Round((F('marked_price') - price) * Value(100) / F('marked_price'), 2)),
+        default=F('discount_percentage'),
+        output_field=PERCENT,
+    )
+
+
+class Repricing:
+    def __init__(self, statements, unknown_barcodes=()):
+        self.statements = statements
+        # Price list entries that matched no product
+        self.unknown_barcodes = list(unknown_barcodes)
+
+    @staticmethod
+    def _changed(queryset, price):
+        return queryset.annotate(new_price=price, new_discount=discount_for(price)).exclude(
+            price=F('new_price'), discount_percentage=F('new_discount'),
+        )
+
+    def changes(self):
+        """Rows of CHANGE_FIELDS for every product that would change"""
+        for queryset, price in self.statements:
+            yield from self._changed(queryset, price).order_by('id').values(*CHANGE_FIELDS)
+
+    def apply(self):
+        """
+        Reprice in one UPDATE per statement; returns the number of products
+        changed. An error before the commits rolls back every shard, but the
+        shards commit one by one; see the module docstring.
+        """
+        now = timezone.now()
+        products = []
+        with ExitStack() as stack:
+            for alias in dict.fromkeys(queryset.select_for_update().db for queryset, _ in self.statements):
+                stack.enter_context(transaction.atomic(using=alias))
+            for queryset, price in self.statements:
+                changed = self._changed(queryset, price)
+                # Placement of everything about to change, for cache invalidation
+                products += changed.select_for_update().only('pk', 'mall_id', 'category_id')
+                changed.update(price=price, discount_percentage=discount_for(price), updated_at=now)
+        invalidate_products(products)
+        publish_products(products)
+        return len(products)
+
+
+def _products(mall):
+    """Products of ``mall`` on its shard, or of every mall, one queryset per shard"""
+    if mall is None:
+        return for_shards(Product.objects.all())
+    return [on_shard(Product.objects.filter(mall=mall), getattr(mall, 'pk', mall))]
+
+
+def markdown(percent, mall=None, category=None, step=None, ending=None):
+    """Price every product of ``mall``/``category`` at ``percent`` off its marked price"""
+    price = F('marked_price') * Value((Decimal(100) - Decimal(percent)) / 100, PRICE)
+    statements = []
+    for queryset in _products(mall):
+        if category is not None:
+            queryset = queryset.filter(category=category)
+        statements.append((queryset, rounded(price, step, ending)))
+    return Repricing(statements)
+
+
+def price_list(prices, mall=None, step=None, ending=None, batch_size=500):
+    """Set each product to its price in ``prices``, a list of (barcode, price)"""
+    prices = dict(prices)
+    barcodes = list(prices)
+    statements, found = [], set()
+    for start in range(0, len(barcodes), batch_size):
+        batch = barcodes[start:start + batch_size]
+        price = Case(
+            *[When(barcode=barcode, then=Value(prices[barcode], PRICE)) for barcode in batch],
+            output_field=PRICE,
+        )
+        for queryset in _products(mall):
+            found.update(queryset.filter(barcode__in=batch).values_list('barcode', flat=True))
+            statements.append((queryset.filter(barcode__in=batch), rounded(price, step, ending)))
+    return Repricing(statements, unknown_barcodes=[barcode for barcode in barcodes if barcode not in found])
+
+
+def read_price_list(file):
+    """(barcode, price) pairs from CSV lines ``barcode,price``; a header line is skipped"""
+    prices = []
+    for line, row in enumerate(csv.reader(file), 1):
+        if not row or not ''.join(row).strip():
+            continue
+        if len(row) != 2:
+            raise ValueError(f"Line {line}: expected barcode,price")
+        barcode, price = (value.strip() for value in row)
+        try:
+            price = Decimal(price)
+        except InvalidOperation:
+            if line == 1:
+                continue  # header
+            raise ValueError(f"Line {line}: invalid price {price!r}")
+        if price < 0:
+            raise ValueError(f"Line {line}: negative price")
+        prices.append((barcode, price))
+    return prices
@@ -0,0 +1,166 @@
+"""
+"Frequently bought together" recommendations.
+
+Each mall has a sparse product-by-product co-occurrence matrix in
+``CoPurchase``: how many of its orders contained both products. A refresh
+(``refresh_recommendations`` task, hourly, or ``manage.py
+refresh_recommendations``) counts only the orders placed since the mall's
+``CoPurchaseWatermark`` and adds them to the matrix, then re-ranks the
+``RECOMMENDATIONS_TOP_K`` most co-purchased products of every product whose
+row changed into ``Recommendation``. The detail and barcode endpoints read
+those with one indexed lookup (``recommendations_prefetch``).
+
+The watermark is a time, not an order id: ids are not ordered across
+shard id blocks or mall moves. Orders are only counted once they are
+``RECOMMENDATIONS_SETTLE_SECONDS`` old, so a checkout still committing
+isn't skipped. Cancelled orders are left out when counted; cancelling an
+order later does not take it back out.
+
+The matrix is built with SciPy when it is installed, and with plain
+Python otherwise.
+"""
+import heapq
+import itertools
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+
+from paymall.cache import invalidate_tags
+from paymall.conditional import bump_version
+from paymall.sharding import shard_for_mall
+from .models import CoPurchase, CoPurchaseWatermark, Mall, Recommendation
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = sparse = None
+
+# Products per IN (...) list
+CHUNK_SIZE = 500
+
+
+def recommendations_prefetch():
+    """Prefetch a product's available recommendations, in rank order, into ``frequently_bought_together``"""
+    return Prefetch(
+        'recommendations',
+        queryset=Recommendation.objects.select_related('recommended').filter(
+            recommended__is_available=True,
+        ).order_by('rank'),
+        to_attr='frequently_bought_together',
+    )
+
+
+def _chunks(items):
+    items = list(items)
+    for start in range(0, len(items), CHUNK_SIZE):
+        yield items[start:start + CHUNK_SIZE]
+
+
+def cooccurrence(baskets):
+    """{(product, other): orders containing both} over ``baskets``, sets of product ids"""
+    if sparse is None:
+        return Counter(pair for basket in baskets for pair in itertools.permutations(basket, 2))
+
+    products = sorted(set().union(*baskets))
+    column = {pk: index for index, pk in enumerate(products)}
+    rows = np.repeat(np.arange(len(baskets)), [len(basket) for basket in baskets])
+    columns = np.fromiter((column[pk] for basket in baskets for pk in basket), dtype=np.int64, count=len(rows))
+    # Basket-by-product incidence matrix; X^T X counts the baskets holding each pair
+    incidence = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int64), (rows, columns)), shape=(len(baskets), len(products)),
+    )
+    counts = (incidence.T @ incidence).tocoo()
+    ids = np.asarray(products)
+    off_diagonal = counts.row != counts.col
+    return dict(zip(
+        zip(ids[counts.row[off_diagonal]].tolist(), ids[counts.col[off_diagonal]].tolist()),
+        counts.data[off_diagonal].tolist(),
+    ))
+
+
+def _baskets(mall, since, until, using):
+    """Product sets of the mall's orders placed in (since, until] and not cancelled"""
+    from orders.models import OrderItem
+
+    items = OrderItem.objects.using(using).filter(
+        order__mall=mall, order__created_at__lte=until, product__mall=mall,
+    ).exclude(order__status='CANCELLED')
+    if since is not None:
+        items = items.filter(order__created_at__gt=since)
+    baskets = defaultdict(set)
+    for order_id, product_id in items.values_list('order_id', 'product_id').iterator(chunk_size=2000):
+        baskets[order_id].add(product_id)
+    # A single product co-occurs with nothing
+    return [basket for basket in baskets.values() if len(basket) > 1]
+
+
+def top_k(row, k):
+    """The ``k`` (other, count) of ``row`` with the highest counts, the lowest id first among equals"""
+    return heapq.nsmallest(k, row.items(), key=lambda entry: (-entry[1], entry[0]))
+
+
+def refresh_mall(mall, now=None):
+    """Count the mall's orders since its watermark; returns the number of products re-ranked"""
+    using = shard_for_mall(mall.pk) or DEFAULT_DB_ALIAS
+    until = (now or timezone.now()) - timedelta(seconds=settings.RECOMMENDATIONS_SETTLE_SECONDS)
+
+    with transaction.atomic(using=using):
+        watermark, _ = CoPurchaseWatermark.objects.using(using).select_for_update().get_or_create(
+            mall=mall, defaults={'counted_until': None},
+        )
+        since = watermark.counted_until
+        if since is not None and since >= until:
+            return 0
+        deltas = cooccurrence(_baskets(mall, since, until, using))
+
+        affected = {product for product, _ in deltas}
+        rows = defaultdict(dict)
+        existing = {}
+        for chunk in _chunks(sorted(affected)):
+            for entry in CoPurchase.objects.using(using).filter(product__in=chunk):
+                existing[entry.product_id, entry.other_id] = entry
+                rows[entry.product_id][entry.other_id] = entry.count
+
+        created, updated = [], []
+        for (product, other), count in deltas.items():
+            rows[product][other] = rows[product].get(other, 0) + count
+            entry = existing.get((product, other))
+            if entry is None:
+                created.append(CoPurchase(product_id=product, other_id=other, count=count))
+            else:
+                entry.count += count
+                updated.append(entry)
+        CoPurchase.objects.using(using).bulk_create(created, batch_size=CHUNK_SIZE)
+        CoPurchase.objects.using(using).bulk_update(updated, ['count'], batch_size=CHUNK_SIZE)
+
+        for chunk in _chunks(sorted(affected)):
+            Recommendation.objects.using(using).filter(product__in=chunk).delete()
+            Recommendation.objects.using(using).bulk_create(
+                [
+                    Recommendation(product_id=product, recommended_id=other, rank=rank, score=count)
+                    for product in chunk
+                    for rank, (other, count) in enumerate(top_k(rows[product], settings.RECOMMENDATIONS_TOP_K), 1)
+                ],
+                batch_size=CHUNK_SIZE,
+            )
+
+        watermark.counted_until = until
+        watermark.save(update_fields=['counted_until'])
+
+    if affected:
+        invalidate_tags(*[f"product:{pk}" for pk in affected])
+        # Changes the ETags of product_validators
+        bump_version('recommendations')
+    return len(affected)
+
+
+def refresh(malls=None):
+    """Refresh every mall (or ``malls``); returns {mall id: products re-ranked}"""
+    if malls is None:
+        malls = Mall.objects.using(DEFAULT_DB_ALIAS).order_by('pk')
+    return {mall.pk: refresh_mall(mall) for mall in malls}
@@ -1,3 +1,5 @@
+from decimal import Decimal
+
 from rest_framework import serializers
 from .models import Mall, Category, Product
 
@@ -24,13 +26,48 @@ class ProductSerializer(serializers.ModelSerializer):
                  'discount_percentage', 'image', 'category', 'category_name', 
                  'mall', 'mall_name', 'stock_quantity', 'is_available')
 
+class RecommendedProductSerializer(serializers.ModelSerializer):
+    """A frequently-bought-together product, as shown with another product"""
+    class Meta:
+        model = Product
+        fields = ('id', 'name', 'barcode', 'price', 'marked_price', 'discount_percentage', 'image', 'stock_quantity')
+
 class ProductDetailSerializer(serializers.ModelSerializer):
     """Detailed serializer for Product model (detail view)"""
     category = CategorySerializer(read_only=True)
     mall = MallSerializer(read_only=True)
+    # Prefetched by products.recommendations.recommendations_prefetch
+    frequently_bought_together = serializers.SerializerMethodField()
     
     class Meta:
         model = Product
         fields = ('id', 'name', 'barcode', 'description', 'price', 'marked_price', 
                  'discount_percentage', 'image', 'category', 'mall', 
-                 'stock_quantity', 'is_available', 'created_at', 'updated_at')
\ No newline at end of file
+                 'stock_quantity', 'is_available', 'created_at', 'updated_at',
+                 'frequently_bought_together')
+    
+    def get_frequently_bought_together(self, product):
+        recommended = [entry.recommended for entry in getattr(product, 'frequently_bought_together', [])]
+        return RecommendedProductSerializer(recommended, many=True, context=self.context).data
+
+
+class PriceEntrySerializer(serializers.Serializer):
+    barcode = serializers.CharField(max_length=50)
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0)
+
+class RepriceSerializer(serializers.Serializer):
+    """Repricing rule for RepriceView: a percent markdown or a price list"""
+    percent = serializers.DecimalField(max_digits=5, decimal_places=2, min_value=0, max_value=Decimal('99.99'), required=False)
+    prices = PriceEntrySerializer(many=True, required=False)
+    mall = serializers.PrimaryKeyRelatedField(queryset=Mall.objects.all(), required=False)
+    category = serializers.PrimaryKeyRelatedField(queryset=Category.objects.all(), required=False)
+    round_to = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0.01'), required=False)
+    ending = serializers.DecimalField(max_digits=3, decimal_places=2, min_value=0, max_value=Decimal('0.99'), required=False)
+    dry_run = serializers.BooleanField(default=False)
+    
+    def validate(self, data):
+        if ('percent' in data) == ('prices' in data):
+            raise serializers.ValidationError("Give either a markdown percent or a price list.")
+        if 'prices' in data and 'category' in data:
+            raise serializers.ValidationError("A category only applies to a markdown.")
+        return data
@@ -0,0 +1,79 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from paymall.cache import invalidate_tags
+from paymall.conditional import bump_version
+from paymall.sharding import replicate, unreplicate
+from .live import LIVE_FIELDS, publish_products
+from .models import Mall, Category, Product
+
+
+def _product_tags(product, mall_id, category_id):
+    tags = {f"product:{product.pk}", f"mall-products:{mall_id}", 'product:all'}
+    if category_id:
+        tags.add(f"category-products:{category_id}")
+    return tags
+
+
+def invalidate_products(products, using=None):
+    """
+    Invalidate cached responses for ``products``, including the lists they
+    were loaded in, once the transaction on ``using`` commits. Call this
+    after queryset updates, which send no signals.
+    """
+    tags = set()
+    for product in products:
+        tags |= _product_tags(product, product.mall_id, product.category_id)
+        if hasattr(product, '_loaded_placement'):
+            tags |= _product_tags(product, *product._loaded_placement)
+    if tags:
+        invalidate_tags(*tags, using=using)
+
+
+@receiver(post_save, sender=Mall)
+@receiver(post_delete, sender=Mall)
+def invalidate_mall(sender, instance, using, **kwargs):
+    invalidate_tags(f"mall:{instance.pk}", using=using)
+    # The shard map is cached under this version: bumped any sooner, another
+    # worker could cache the map as it was before the commit under the new one
+    transaction.on_commit(lambda: bump_version('malls'), using=using)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category(sender, instance, using, **kwargs):
+    invalidate_tags(f"category:{instance.pk}", 'category:all', using=using)
+    transaction.on_commit(lambda: bump_version('categories'), using=using)
+
+
+@receiver(post_save, sender=Mall)
+@receiver(post_save, sender=Category)
+def copy_to_shards(sender, instance, using, raw=False, **kwargs):
+    replicate(instance, using, raw)
+
+
+@receiver(post_delete, sender=Mall)
+@receiver(post_delete, sender=Category)
+def delete_from_shards(sender, instance, using, **kwargs):
+    unreplicate(instance, using)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product(sender, instance, using, **kwargs):
+    invalidate_products([instance], using=using)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def push_product(sender, instance, using, update_fields=None, **kwargs):
+    if update_fields is None or not update_fields.isdisjoint(LIVE_FIELDS):
+        publish_products([instance], using=using)
+
+
+@receiver(post_save, sender=Product)
+def shrink_new_image(sender, instance, using, raw=False, **kwargs):
+    if not raw and instance.image and instance.image.name != getattr(instance, '_loaded_image', None):
+        from .tasks import shrink_image
+        shrink_image.delay(instance.pk, using=using)
@@ -0,0 +1,47 @@
+import io
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image
+
+from paymall.sharding import locate, shard_for
+from tasks.queue import task
+from .models import Product
+from .recommendations import refresh
+from .signals import invalidate_products
+
+
+@task(dedupe=True)
+def shrink_image(product_id):
+    """Downscale an uploaded product image to fit PRODUCT_IMAGE_MAX_SIZE"""
+    product = locate(Product.objects.all(), pk=product_id)
+    if product is None or not product.image:
+        return
+
+    with product.image.open('rb') as f:
+        image = Image.open(f)
+        image.load()
+    size = settings.PRODUCT_IMAGE_MAX_SIZE
+    if max(image.size) <= size:
+        return
+
+    image_format = image.format
+    image.thumbnail((size, size))
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, optimize=True)
+
+    storage, name = product.image.storage, product.image.name
+    storage.delete(name)
+    saved = storage.save(name, ContentFile(buffer.getvalue()))
+    if saved != name:
+        # Another upload took the name in between; point the product at ours.
+        # A queryset update, so saving doesn't queue this task again
+        Product.objects.using(shard_for(product)).filter(pk=product.pk, image=name).update(image=saved)
+        invalidate_products([product])
+
+
+@task(every=timedelta(hours=1))
+def refresh_recommendations():
+    """Add the orders placed since the last run to every mall's recommendations"""
+    refresh()
@@ -1,3 +1,572 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import tempfile
+import unittest
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from paymall.sharding import shard_for_mall
+from paymall.testing import QueryBudgetTestCase, QueryPlanTestCase
+from .live import broadcaster, collector
+from . import recommendations
+from .models import Mall, Category, CoPurchase, Product, Recommendation
+from .pricing import markdown, price_list
+from .views import (
+    AsyncCategoryListView, AsyncNearbyMallView, AsyncProductBarcodeView, AsyncProductDetailView,
+    AsyncProductListView, ProductEventStreamView, product_list_queryset,
+)
+
+User = get_user_model()
+
+
+def make_products(mall, count, start=0):
+    categories = [Category.objects.create(name=f"Category {start + i}") for i in range(3)]
+    return [
+        Product.objects.using(shard_for_mall(mall.pk)).create(
+            name=f"Product {start + i}",
+            barcode=f"BC{mall.pk}-{start + i}",
+            price=90,
+            marked_price=100,
+            category=categories[i % 3],
+            mall=mall,
+            stock_quantity=50,
+        )
+        for i in range(count)
+    ]
+
+
+class CatalogQueryBudgetTests(QueryBudgetTestCase):
+    QUERY_BUDGETS = {
+        'category_list': 1,
+        # One validator query for the ETag, one for the body
+        'product_list': 2,
+        # ... and one for the recommendations
+        'product_detail': 3,
+        'product_barcode': 2,
+        'mall_list': 2,
+    }
+
+    def setUp(self):
+        self.mall = Mall.objects.create(name="Mall", location="Here", latitude=12.97, longitude=77.59)
+        self.products = make_products(self.mall, 1)
+
+    def grow(self):
+        products = make_products(self.mall, 20, start=len(self.products))
+        Recommendation.objects.bulk_create(
+            Recommendation(product=self.products[0], recommended=product, rank=rank, score=1)
+            for rank, product in enumerate(products[:5], 1)
+        )
+
+    def test_category_list(self):
+        self.assertQueryBudget('category_list', lambda: self.client.get(reverse('category_list')), self.grow)
+
+    def test_product_list(self):
+        url = reverse('product_list')
+        self.assertQueryBudget('product_list', lambda: self.client.get(url, {'mall': self.mall.pk}), self.grow)
+
+    def test_product_detail(self):
+        url = reverse('product_detail', args=[self.products[0].pk])
+        self.assertQueryBudget('product_detail', lambda: self.client.get(url), self.grow)
+
+    def test_product_barcode(self):
+        url = reverse('product_barcode', args=[self.products[0].barcode])
+        self.assertQueryBudget('product_barcode', lambda: self.client.get(url), self.grow)
+
+    def test_nearby_malls(self):
+        user = User.objects.create_user(username="shopper", email="shopper@example.com", password="pw")
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(user).access_token}")
+
+        def grow():
+            for i in range(20):
+                Mall.objects.create(name=f"Mall {i}", location="Near", latitude=12.97, longitude=77.59 + i / 1000)
+
+        self.assertQueryBudget(
+            'mall_list',
+            lambda: self.client.post(reverse('mall_list'), {'latitude': 12.97, 'longitude': 77.59}, format='json'),
+            grow,
+        )
+
+
+class ProductAdminTests(QueryBudgetTestCase):
+    QUERY_BUDGETS = {
+        # session, user, filter choices (categories, malls), count estimate,
+        # count, rows with category and mall
+        'admin_product_list': 7,
+    }
+
+    def test_product_list(self):
+        self.client.force_login(User.objects.create_superuser(username="admin", email="admin@example.com", password="pw"))
+        mall = Mall.objects.create(name="Mall", location="Here", latitude=12.97, longitude=77.59)
+        make_products(mall, 1)
+        self.assertQueryBudget(
+            'admin_product_list',
+            lambda: self.client.get('/admin/products/product/'),
+            lambda: make_products(mall, 20, start=100),
+        )
+
+
+class RepricingTests(APITestCase):
+    def setUp(self):
+        self.mall = Mall.objects.create(name="Mall", location="Here", latitude=12.97, longitude=77.59)
+        self.other_mall = Mall.objects.create(name="Other", location="There", latitude=13.0, longitude=77.6)
+        self.products = make_products(self.mall, 3)
+        self.other = make_products(self.other_mall, 1, start=10)[0]
+        self.admin = User.objects.create_superuser(username="admin", email="admin@example.com", password="pw")
+        self.client.force_authenticate(self.admin)
+
+    def prices(self):
+        return {
+            product.barcode: (product.price, product.discount_percentage)
+            for product in Product.objects.all()
+        }
+
+    def test_markdown_in_one_update(self):
+        repricing = markdown(20, mall=self.mall, ending=Decimal('0.99'))
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(repricing.apply(), 3)
+        self.assertEqual(len([q for q in context.captured_queries if q['sql'].startswith('UPDATE')]), 1)
+
+        prices = self.prices()
+        for product in self.products:
+            self.assertEqual(prices[product.barcode], (Decimal('79.99'), Decimal('20.01')))
+        self.assertEqual(prices[self.other.barcode], (Decimal('90.00'), Decimal('10.00')))
+        # Already at those prices
+        self.assertEqual(repricing.apply(), 0)
+
+    def test_markdown_by_category(self):
+        category = self.products[0].category
+        markdown(Decimal('12.5'), category=category, step=Decimal('0.05')).apply()
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).price, Decimal('87.50'))
+        self.assertEqual(Product.objects.get(pk=self.products[1].pk).price, Decimal('90.00'))
+
+    def test_price_list_in_batches(self):
+        repricing = price_list(
+            [(self.products[0].barcode, Decimal('55.57')), (self.products[1].barcode, Decimal('60')), ('nope', 1)],
+            step=Decimal('0.10'), batch_size=1,
+        )
+        self.assertEqual(repricing.unknown_barcodes, ['nope'])
+        self.assertEqual(repricing.apply(), 2)
+        prices = self.prices()
+        self.assertEqual(prices[self.products[0].barcode], (Decimal('55.60'), Decimal('44.40')))
+        self.assertEqual(prices[self.products[1].barcode], (Decimal('60.00'), Decimal('40.00')))
+
+    def test_invalidates_cached_products(self):
+        url = reverse('product_detail', args=[self.products[0].pk])
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            markdown(50, mall=self.mall).apply()
+        self.assertEqual(self.client.get(url).data['price'], '50.00')
+
+    def test_dry_run(self):
+        response = self.client.post(
+            reverse('product_reprice'), {'percent': 20, 'mall': self.mall.pk, 'dry_run': True}, format='json',
+        )
+        self.assertEqual(response.data['count'], 3)
+        change = response.data['changes'][0]
+        self.assertEqual((change['price'], change['new_price']), (90, 80))
+        self.assertEqual(Product.objects.filter(price=80).count(), 0)
+
+        response = self.client.post(reverse('product_reprice'), {'percent': 20, 'mall': self.mall.pk}, format='json')
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(Product.objects.filter(price=80).count(), 3)
+
+    def test_api_validation_and_permissions(self):
+        response = self.client.post(
+            reverse('product_reprice'), {'percent': 20, 'prices': [{'barcode': 'x', 'price': 1}]}, format='json',
+        )
+        self.assertEqual(response.status_code, 400)
+
+        self.client.force_authenticate(User.objects.create_user(username="u", email="u@example.com", password="pw"))
+        response = self.client.post(reverse('product_reprice'), {'percent': 20}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+    def test_command_price_list(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write(f"barcode,price\n{self.products[0].barcode},70\nmissing,5\n")
+        self.addCleanup(os.remove, f.name)
+
+        out = io.StringIO()
+        call_command('reprice', '--price-list', f.name, '--dry-run', stdout=out)
+        self.assertIn("Unknown barcode missing", out.getvalue())
+        self.assertIn("Would reprice 1 products", out.getvalue())
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).price, 90)
+
+        call_command('reprice', '--price-list', f.name, stdout=io.StringIO())
+        self.assertEqual(self.prices()[self.products[0].barcode], (Decimal('70.00'), Decimal('30.00')))
+
+    def test_save_keeps_discount_current(self):
+        product = self.products[0]
+        product.price = 75
+        product.save()
+        product.refresh_from_db()
+        self.assertEqual(product.discount_percentage, Decimal('25.00'))
+
+
+class RecommendationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        from orders.models import Order, OrderItem
+        self.Order, self.OrderItem = Order, OrderItem
+        self.user = User.objects.create_user(username="shopper", email="shopper@example.com", password="pw")
+        self.mall = Mall.objects.create(name="Mall", location="Here", latitude=12.97, longitude=77.59)
+        self.products = make_products(self.mall, 5)
+        self.placed_at = timezone.now() - timedelta(hours=2)
+
+    def order(self, *indexes, status='COMPLETED', placed_at=None):
+        order = self.Order.objects.create(
+            user=self.user, mall=self.mall, order_number=f"ORD-{self.Order.objects.count()}", status=status,
+            payment_method='UPI', subtotal=100, tax=18, total=118,
+        )
+        for i in indexes:
+            product = self.products[i]
+            self.OrderItem.objects.create(
+                order=order, product=product, product_name=product.name, product_price=product.price,
+                product_barcode=product.barcode, quantity=1, total_price=product.price,
+            )
+        self.Order.objects.filter(pk=order.pk).update(created_at=placed_at or self.placed_at)
+
+    def recommended(self, i):
+        return [
+            (self.products.index(entry.recommended), entry.score)
+            for entry in Recommendation.objects.filter(product=self.products[i]).order_by('rank')
+        ]
+
+    def place_orders(self):
+        self.order(0, 1)
+        self.order(0, 1)
+        self.order(0, 2)
+        self.order(0, 3)
+        self.order(1, 2)
+        self.order(4)
+        for _ in range(3):
+            self.order(0, 4, status='CANCELLED')
+
+    @override_settings(RECOMMENDATIONS_TOP_K=2)
+    def test_counts_and_top_k(self):
+        self.place_orders()
+        self.assertEqual(recommendations.refresh_mall(self.mall), 4)
+
+        pair = CoPurchase.objects.get(product=self.products[0], other=self.products[1])
+        self.assertEqual(pair.count, 2)
+        self.assertFalse(CoPurchase.objects.filter(product=self.products[4]).exists())
+        # Ties go to the lowest id
+        self.assertEqual(self.recommended(0), [(1, 2), (2, 1)])
+        self.assertEqual(self.recommended(3), [(0, 1)])
+
+    def test_incremental_refresh(self):
+        self.place_orders()
+        counted_at = self.placed_at + timedelta(minutes=30)
+        recommendations.refresh_mall(self.mall, now=counted_at)
+        self.assertEqual(recommendations.refresh_mall(self.mall, now=counted_at), 0)
+
+        self.order(0, 3, placed_at=timezone.now() - timedelta(hours=1))
+        self.order(0, 3, placed_at=timezone.now() - timedelta(hours=1))
+        # Not settled yet
+        self.order(0, 2, placed_at=timezone.now())
+        self.assertEqual(recommendations.refresh_mall(self.mall), 2)
+        self.assertEqual(self.recommended(0), [(3, 3), (1, 2), (2, 1)])
+        self.assertEqual(self.recommended(3), [(0, 3)])
+
+        self.assertEqual(recommendations.refresh_mall(self.mall, now=timezone.now() + timedelta(hours=1)), 2)
+        self.assertEqual(self.recommended(2), [(0, 2), (1, 1)])
+
+    def test_detail_and_barcode_show_recommendations(self):
+        self.place_orders()
+        url = reverse('product_detail', args=[self.products[0].pk])
+        self.assertEqual(self.client.get(url).json()['frequently_bought_together'], [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            recommendations.refresh_mall(self.mall)
+        Product.objects.filter(pk=self.products[3].pk).update(is_available=False)
+        response = self.client.get(url)
+        self.assertEqual([product['id'] for product in response.json()['frequently_bought_together']],
+                         [self.products[1].pk, self.products[2].pk])
+
+        response = self.client.get(reverse('product_barcode', args=[self.products[0].barcode]))
+        self.assertEqual(len(response.json()['frequently_bought_together']), 2)
+
+    def test_refresh_command(self):
+        self.place_orders()
+        out = io.StringIO()
+        call_command('refresh_recommendations', mall=[self.mall.pk], stdout=out)
+        self.assertIn("4 products re-ranked", out.getvalue())
+        self.assertEqual(Recommendation.objects.filter(product=self.products[0]).count(), 3)
+
+    @unittest.skipUnless(recommendations.sparse is not None, "SciPy is not installed")
+    def test_scipy_matches_python(self):
+        baskets = [{1, 2, 3}, {2, 3}, {1, 4}, {3, 4, 5, 1}]
+        with mock.patch.object(recommendations, 'sparse', None):
+            expected = dict(recommendations.cooccurrence(baskets))
+        self.assertEqual(recommendations.cooccurrence(baskets), expected)
+
+
+class PythonRecommendationTests(RecommendationTests):
+    """RecommendationTests on the plain-Python path taken without SciPy"""
+
+    def setUp(self):
+        super().setUp()
+        self.enterContext(mock.patch.object(recommendations, 'sparse', None))
+
+    test_scipy_matches_python = None
+
+
+class CatalogQueryPlanTests(QueryPlanTestCase):
+    def test_recommendations(self):
+        queryset = recommendations.recommendations_prefetch().queryset.filter(product_id=1)
+        # SQLite builds unique constraints into the table, under its own name
+        index = 'sqlite_autoindex_products_recommendation_1' if connection.vendor == 'sqlite' else 'recommendation_rank_unique'
+        self.assertUsesIndex(queryset, index)
+
+    def test_product_list_by_mall(self):
+        self.assertUsesIndex(product_list_queryset({'mall': 1}), 'product_avail_mall_cat_idx')
+
+    def test_product_list_by_mall_and_category(self):
+        self.assertUsesIndex(product_list_queryset({'mall': 1, 'category': 2}), 'product_avail_mall_cat_idx')
+
+    def test_product_list_by_category(self):
+        self.assertUsesIndex(product_list_queryset({'category': 2}), 'product_avail_cat_idx')
+
+    def test_mall_index(self):
+        self.assertUsesIndex(
+            Mall.objects.filter(is_active=True).values_list('id', 'name', 'latitude', 'longitude'),
+            'mall_active_idx',
+        )
+
+
+class CatalogConditionalGetTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.mall = Mall.objects.create(name="Mall", location="Here", latitude=12.97, longitude=77.59)
+        self.products = make_products(self.mall, 3)
+
+    def assertNotModified(self, url, queries, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(queries):
+            repeat = self.client.get(url, params, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(repeat.status_code, 304)
+        self.assertEqual(repeat['ETag'], response['ETag'])
+        return response['ETag']
+
+    def test_product_list(self):
+        url = reverse('product_list')
+        etag = self.assertNotModified(url, 1, mall=self.mall.pk)
+
+        self.products[0].price = 80
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[0].save()
+        response = self.client.get(url, {'mall': self.mall.pk}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.products[1].pk).delete()
+        response = self.client.get(url, {'mall': self.mall.pk}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 2)
+
+    def test_product_detail(self):
+        product = self.products[0]
+        url = reverse('product_detail', args=[product.pk])
+        etag = self.assertNotModified(url, 1)
+
+        self.mall.name = "Renamed"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.mall.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['mall']['name'], "Renamed")
+
+    def test_category_list(self):
+        url = reverse('category_list')
+        etag = self.assertNotModified(url, 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name="New")
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_cache_is_invalidated_on_commit(self):
+        url = reverse('product_detail', args=[self.products[0].pk])
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[0].price = 80
+            self.products[0].save()
+            # A fill now would read the old row; the entry it left must not outlive the commit
+            self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+        response = self.client.get(url)
+        self.assertEqual((response['X-Cache'], response.json()['price']), ('MISS', '80.00'))
+
+    def test_large_bodies_are_compressed(self):
+        make_products(self.mall, 20, start=3)
+        response = self.client.get(reverse('product_list'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+
+class AsyncCatalogViewTests(TestCase):
+    """The async read views must return exactly what their DRF twins do"""
+
+    def setUp(self):
+        cache.clear()
+        self.mall = Mall.objects.create(name="Mall", location="Here", latitude=12.97, longitude=77.59)
+        self.products = make_products(self.mall, 3)
+        self.factory = AsyncRequestFactory()
+
+    async def assertSameResponse(self, view, url, **kwargs):
+        expected = await self.async_client.get(url)
+        await cache.aclear()
+        response = await view.as_view()(self.factory.get(url), **kwargs)
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertJSONEqual(response.content, expected.content.decode())
+        self.assertEqual(response['X-Cache'], 'MISS')
+
+        cached = await view.as_view()(self.factory.get(url), **kwargs)
+        self.assertEqual(cached['X-Cache'], 'HIT')
+
+    async def test_product_list(self):
+        await self.assertSameResponse(AsyncProductListView, f"{reverse('product_list')}?mall={self.mall.pk}")
+
+    async def test_product_detail(self):
+        pk = self.products[0].pk
+        await self.assertSameResponse(AsyncProductDetailView, reverse('product_detail', args=[pk]), pk=pk)
+
+    async def test_product_barcode(self):
+        barcode = self.products[0].barcode
+        await self.assertSameResponse(
+            AsyncProductBarcodeView, reverse('product_barcode', args=[barcode]), barcode=barcode
+        )
+
+    async def test_missing_product(self):
+        response = await AsyncProductDetailView.as_view()(self.factory.get('/'), pk=0)
+        self.assertEqual(response.status_code, 404)
+
+    async def test_category_list(self):
+        await self.assertSameResponse(AsyncCategoryListView, reverse('category_list'))
+
+    async def test_nearby_malls(self):
+        user = await User.objects.acreate_user(username="shopper", email="shopper@example.com", password="pw")
+        headers = {'authorization': f"Bearer {RefreshToken.for_user(user).access_token}"}
+        body = {'latitude': 12.97, 'longitude': 77.59}
+        expected = await self.async_client.post(
+            reverse('mall_list'), body, content_type='application/json', headers=headers,
+        )
+        response = await AsyncNearbyMallView.as_view()(
+            self.factory.post(reverse('mall_list'), body, content_type='application/json', headers=headers)
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertJSONEqual(response.content, expected.content.decode())
+
+        malformed = await AsyncNearbyMallView.as_view()(
+            self.factory.post(reverse('mall_list'), 'not json', content_type='application/json', headers=headers)
+        )
+        self.assertEqual(malformed.status_code, 400)
+
+
+@override_settings(LIVE_EVENTS=True)
+class LiveEventTests(TestCase):
+    def setUp(self):
+        self.mall = Mall.objects.create(name="Mall", location="Here", latitude=12.97, longitude=77.59)
+        self.other_mall = Mall.objects.create(name="Other", location="There", latitude=13.0, longitude=77.6)
+        self.products = make_products(self.mall, 2)
+        self.other = make_products(self.other_mall, 1, start=10)[0]
+
+    async def subscribe(self, **params):
+        request = AsyncRequestFactory().get('/api/products/events/', params)
+        response = await ProductEventStreamView.as_view()(request)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertTrue((await anext(stream)).startswith(b'retry:'))
+        return stream
+
+    async def disconnect(self, stream, last=True):
+        # What the ASGI handler does when the client goes away
+        read = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0)
+        read.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await read
+        if last:
+            self.assertFalse(broadcaster._subscribers)
+
+    async def next_event(self, stream):
+        chunk = (await asyncio.wait_for(anext(stream), 5)).decode()
+        event, data = chunk.strip().split('\n')
+        self.assertEqual(event, 'event: products')
+        return sorted(json.loads(data.removeprefix('data: ')), key=lambda change: change['id'])
+
+    def commit_and_flush(self, change):
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        collector.flush()
+
+    def save_products(self):
+        first, second = self.products
+        first.price, first.stock_quantity = 50, 7
+        first.save()
+        first.stock_quantity = 6
+        first.save()
+        second.name = "Renamed"
+        second.save(update_fields=['name'])
+        self.other.save()
+
+    async def test_saves_are_coalesced_per_mall(self):
+        stream = await self.subscribe(mall=self.mall.pk)
+        await sync_to_async(self.commit_and_flush)(self.save_products)
+
+        changes = await self.next_event(stream)
+        # One change for the product saved twice, none for a non-price field or another mall
+        self.assertEqual(len(changes), 1)
+        self.assertEqual(changes[0]['id'], self.products[0].pk)
+        self.assertEqual((changes[0]['price'], changes[0]['stock_quantity']), ('50.00', 6))
+        await self.disconnect(stream)
+
+    async def test_bulk_updates_and_deletes(self):
+        stream = await self.subscribe(product=[self.products[1].pk, self.other.pk])
+        await sync_to_async(self.commit_and_flush)(lambda: markdown(50).apply())
+        changes = await self.next_event(stream)
+        self.assertEqual([change['price'] for change in changes], ['50.00', '50.00'])
+
+        await sync_to_async(self.commit_and_flush)(self.other.delete)
+        self.assertEqual([change.get('deleted') for change in await self.next_event(stream)], [True])
+        await self.disconnect(stream)
+
+    async def test_requires_a_subscription(self):
+        response = await ProductEventStreamView.as_view()(AsyncRequestFactory().get('/api/products/events/'))
+        self.assertEqual(response.status_code, 400)
+
+    async def test_limits_ids_per_stream(self):
+        request = AsyncRequestFactory().get('/api/products/events/', {'product': list(range(1, 52))})
+        response = await ProductEventStreamView.as_view()(request)
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(LIVE_MAX_STREAMS_PER_CLIENT=2)
+    async def test_limits_streams_per_client(self):
+        streams = [await self.subscribe(mall=self.mall.pk) for _ in range(2)]
+        request = AsyncRequestFactory().get('/api/products/events/', {'mall': self.mall.pk})
+        self.assertEqual((await ProductEventStreamView.as_view()(request)).status_code, 429)
+        other = AsyncRequestFactory().get('/api/products/events/', {'mall': self.mall.pk})
+        other.META['REMOTE_ADDR'] = '10.0.0.2'
+        response = await ProductEventStreamView.as_view()(other)
+        self.assertEqual(response.status_code, 200)
+
+        # Closed by Django with the response, even if never streamed
+        response.close()
+        await self.disconnect(streams.pop(), last=False)
+        response = await ProductEventStreamView.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        response.close()
+        await self.disconnect(streams.pop())
@@ -1,16 +1,39 @@
+from django.conf import settings
 from django.urls import path
 from .views import (
+    AsyncCategoryListView,
+    AsyncNearbyMallView,
+    AsyncProductBarcodeView,
+    AsyncProductDetailView,
+    AsyncProductListView,
     NearbyMallView,
     CategoryListView,
     ProductListView,
     ProductDetailView,
-    ProductBarcodeView
+    ProductBarcodeView,
+    ProductEventStreamView,
+    RepriceView,
 )
 
+if settings.ASYNC_READ_VIEWS:
+    nearby_view, category_list_view = AsyncNearbyMallView, AsyncCategoryListView
+    product_list_view, product_detail_view, product_barcode_view = (
+        AsyncProductListView, AsyncProductDetailView, AsyncProductBarcodeView
+    )
+else:
+    nearby_view, category_list_view = NearbyMallView, CategoryListView
+    product_list_view, product_detail_view, product_barcode_view = (
+        ProductListView, ProductDetailView, ProductBarcodeView
+    )
+
 urlpatterns = [
-    path('malls/nearby/', NearbyMallView.as_view(), name='mall_list'),
-    path('categories/', CategoryListView.as_view(), name='category_list'),
-    path('products/', ProductListView.as_view(), name='product_list'),
-    path('products/<int:pk>/', ProductDetailView.as_view(), name='product_detail'),
-    path('products/barcode/<str:barcode>/', ProductBarcodeView.as_view(), name='product_barcode'),
-]
\ No newline at end of file
+    path('malls/nearby/', nearby_view.as_view(), name='mall_list'),
+    path('categories/', category_list_view.as_view(), name='category_list'),
+    path('products/', product_list_view.as_view(), name='product_list'),
+    path('products/<int:pk>/', product_detail_view.as_view(), name='product_detail'),
+    path('products/barcode/<str:barcode>/', product_barcode_view.as_view(), name='product_barcode'),
+    path('products/reprice/', RepriceView.as_view(), name='product_reprice'),
+]
+
+if settings.LIVE_EVENTS:
+    urlpatterns.append(path('products/events/', ProductEventStreamView.as_view(), name='product_events'))
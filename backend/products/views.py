@@ -1,8 +1,25 @@
 from rest_framework import generics, permissions, status
 from rest_framework.response import Response
+from rest_framework.throttling import BaseThrottle
 from rest_framework.views import APIView
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.http import Http404, StreamingHttpResponse
 from .models import Mall, Category, Product
-from .serializers import MallSerializer, CategorySerializer, ProductSerializer, ProductDetailSerializer
+from .live import TooManyStreams, broadcaster
+from .pricing import markdown, price_list
+from .recommendations import recommendations_prefetch
+from .serializers import MallSerializer, CategorySerializer, ProductSerializer, ProductDetailSerializer, RepriceSerializer
+from paymall.asyncviews import AsyncAPIView, json_response
+from paymall.cache import acache_response, cache_response
+from paymall.conditional import aconditional, conditional, version
+from paymall.renderers import ORJSONRenderer
+from paymall.sharding import afan_out, alocate, fan_out, for_shards, locate, on_shard
+from paymall.throttling import DeviceSlidingWindowThrottle, UserSlidingWindowThrottle
+import asyncio
+import json
 import math
 
 def haversine(lat1, lon1, lat2, lon2):
@@ -14,6 +31,106 @@ def haversine(lat1, lon1, lat2, lon2):
     return R * (2 * math.atan2(math.sqrt(a), math.sqrt(1 - a)))
 
 
+def product_cache_tags(product):
+    """Cache tags for a serialized product (nested or flat mall/category)"""
+    mall, category = product['mall'], product['category']
+    tags = [f"product:{product['id']}", f"mall:{mall['id'] if isinstance(mall, dict) else mall}"]
+    if category:
+        tags.append(f"category:{category['id'] if isinstance(category, dict) else category}")
+    tags.extend(f"product:{recommended['id']}" for recommended in product.get('frequently_bought_together', ()))
+    return tags
+
+
+def product_detail_queryset():
+    """Products with what the detail and barcode endpoints show, in two queries"""
+    return Product.objects.select_related('category', 'mall').prefetch_related(recommendations_prefetch())
+
+
+def product_list_queryset(params):
+    """Available products filtered by the list endpoint's query params"""
+    queryset = Product.objects.filter(is_available=True).select_related('category', 'mall')
+
+    # Filter by category if provided
+    category_id = params.get('category')
+    if category_id:
+        queryset = queryset.filter(category_id=category_id)
+
+    # Filter by mall if provided
+    mall_id = params.get('mall')
+    if mall_id:
+        queryset = on_shard(queryset.filter(mall_id=mall_id), mall_id)
+
+    # Search by name or description
+    search = params.get('search')
+    if search:
+        queryset = queryset.filter(name__icontains=search) | queryset.filter(description__icontains=search)
+
+    return queryset
+
+
+def product_list_cache_tags(params, data):
+    # Membership tags: invalidated when a product enters/leaves/changes in the list
+    tags = [f"{name}-products:{params[name]}" for name in ('mall', 'category') if params.get(name)]
+    if not tags:
+        tags.append('product:all')
+    for product in data:
+        tags.extend(product_cache_tags(product))
+    return tags
+
+
+def category_validators(view, request):
+    return ('categories', version('categories')), None
+
+
+def product_list_validators(view, request):
+    # Row count catches deletions; the category version catches renames
+    stats = [
+        queryset.aggregate(count=Count('id'), last=Max('updated_at'), mall_last=Max('mall__updated_at'))
+        for queryset in for_shards(product_list_queryset(request.GET))
+    ]
+    count = sum(shard['count'] for shard in stats)
+    last = max(filter(None, (shard['last'] for shard in stats)), default=None)
+    mall_last = max(filter(None, (shard['mall_last'] for shard in stats)), default=None)
+    last_modified = max(filter(None, (last, mall_last)), default=None)
+    return ('products', count, last, mall_last, version('categories')), last_modified
+
+
+def product_validators(view, request, pk):
+    # Recommended products are shown too; the version catches them being re-ranked
+    row = locate(
+        Product.objects.annotate(recommended_at=Max('recommendations__recommended__updated_at')).values_list(
+            'updated_at', 'mall__updated_at', 'category__updated_at', 'recommended_at',
+        ),
+        pk=pk,
+    )
+    if row is None:
+        return None
+    return ('product', pk, row, version('recommendations')), max(filter(None, row))
+
+
+def mall_index():
+    """(id, name, latitude, longitude) of every active mall, cached until a mall changes"""
+    key = f"mall-index:{version('malls')}"
+    index = cache.get(key)
+    if index is None:
+        index = list(Mall.objects.filter(is_active=True).values_list('id', 'name', 'latitude', 'longitude'))
+        cache.set(key, index, settings.RESPONSE_CACHE_TIMEOUT)
+    return index
+
+
+def nearby_malls(lat, lng):
+    nearby = []
+    for mall_id, name, latitude, longitude in mall_index():
+        dist = haversine(lat, lng, latitude, longitude)
+        if dist <= 3:
+            nearby.append({
+                "id": mall_id,
+                "name": name,
+                "distance": round(dist, 2)
+            })
+    return sorted(nearby, key=lambda x: x["distance"])
+
+
 # class MallListView(generics.ListAPIView):
 #     """View to list all malls"""
 #     queryset = Mall.objects.filter(is_active=True)
@@ -26,51 +143,80 @@ class CategoryListView(generics.ListAPIView):
     serializer_class = CategorySerializer
     permission_classes = [permissions.AllowAny]
 
+    @conditional(category_validators)
+    @cache_response()
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    def get_cache_tags(self, data):
+        return ['category:all']
+
 class ProductListView(generics.ListAPIView):
     """View to list all products with optional filtering"""
     serializer_class = ProductSerializer
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [UserSlidingWindowThrottle]
+    throttle_scope = 'catalog'
+
+    @conditional(product_list_validators)
+    @cache_response()
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    def get_cache_tags(self, data):
+        return product_list_cache_tags(self.request.query_params, data)
     
     def get_queryset(self):
-        queryset = Product.objects.filter(is_available=True)
-        
-        # Filter by category if provided
-        category_id = self.request.query_params.get('category')
-        if category_id:
-            queryset = queryset.filter(category_id=category_id)
-        
-        # Filter by mall if provided
-        mall_id = self.request.query_params.get('mall')
-        if mall_id:
-            queryset = queryset.filter(mall_id=mall_id)
-        
-        # Search by name or description
-        search = self.request.query_params.get('search')
-        if search:
-            queryset = queryset.filter(name__icontains=search) | queryset.filter(description__icontains=search)
-        
-        return queryset
+        return product_list_queryset(self.request.query_params)
+
+    def list(self, request, *args, **kwargs):
+        # Without a mall, the products of every shard
+        return Response(self.get_serializer(fan_out(self.get_queryset()), many=True).data)
 
 class ProductDetailView(generics.RetrieveAPIView):
     """View to retrieve a specific product"""
-    queryset = Product.objects.all()
     serializer_class = ProductDetailSerializer
     permission_classes = [permissions.AllowAny]
 
+    @conditional(product_validators)
+    @cache_response()
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    def get_cache_tags(self, data):
+        return product_cache_tags(data)
+
+    def get_queryset(self):
+        return product_detail_queryset()
+
+    def get_object(self):
+        product = locate(self.get_queryset(), pk=self.kwargs['pk'])
+        if product is None:
+            raise Http404("No Product matches the given query.")
+        self.check_object_permissions(self.request, product)
+        return product
+
 class ProductBarcodeView(APIView):
     """View to retrieve a product by barcode"""
     permission_classes = [permissions.AllowAny]
-    
+    throttle_classes = [DeviceSlidingWindowThrottle]
+    throttle_scope = 'scan'
+
+    def get_cache_tags(self, data):
+        return product_cache_tags(data)
+
+    @cache_response()
     def get(self, request, barcode):
-        try:
-            product = Product.objects.get(barcode=barcode, is_available=True)
-            serializer = ProductDetailSerializer(product)
-            return Response(serializer.data)
-        except Product.DoesNotExist:
+        product = locate(
+            product_detail_queryset().filter(is_available=True), barcode=barcode
+        )
+        if product is None:
             return Response(
                 {"error": "Product with this barcode not found or not available"}, 
                 status=status.HTTP_404_NOT_FOUND
             )
+        serializer = ProductDetailSerializer(product)
+        return Response(serializer.data)
 
 class NearbyMallView(APIView):
     permission_classes = [permissions.IsAuthenticated]
@@ -79,14 +225,168 @@ class NearbyMallView(APIView):
         lat = request.data.get("latitude")
         lng = request.data.get("longitude")
 
-        malls = []
-        for mall in Mall.objects.filter(is_active=True):
-            dist = haversine(lat, lng, mall.latitude, mall.longitude)
-            if dist <= 3:
-                malls.append({
-                    "id": mall.id,
-                    "name": mall.name,
-                    "distance": round(dist, 2)
-                })
-
-        return Response(sorted(malls, key=lambda x: x["distance"]))
+        return Response(nearby_malls(lat, lng))
+
+
+class RepriceView(APIView):
+    """Apply a markdown or price list in bulk, or preview it with dry_run"""
+    permission_classes = [permissions.IsAdminUser]
+    # Changes listed in the response
+    preview_limit = 100
+
+    def post(self, request):
+        serializer = RepriceSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        rule = serializer.validated_data
+        rounding = {'step': rule.get('round_to'), 'ending': rule.get('ending')}
+
+        if 'percent' in rule:
+            repricing = markdown(rule['percent'], rule.get('mall'), rule.get('category'), **rounding)
+        else:
+            prices = [(entry['barcode'], entry['price']) for entry in rule['prices']]
+            repricing = price_list(prices, rule.get('mall'), **rounding)
+
+        result = {'dry_run': rule['dry_run'], 'unknown_barcodes': repricing.unknown_barcodes}
+        if rule['dry_run']:
+            changes = list(repricing.changes())
+            result.update(count=len(changes), changes=changes[:self.preview_limit])
+        else:
+            result['count'] = repricing.apply()
+        return Response(result)
+
+
+# Async read endpoints, served instead of the views above with ASYNC_READ_VIEWS
+
+class AsyncCategoryListView(AsyncAPIView):
+    authentication_required = False
+
+    def get_cache_tags(self, data):
+        return ['category:all']
+
+    @aconditional(category_validators)
+    @acache_response()
+    async def get(self, request):
+        categories = [category async for category in Category.objects.all()]
+        return json_response(CategorySerializer(categories, many=True, context={'request': request}).data)
+
+class AsyncProductListView(AsyncAPIView):
+    authentication_required = False
+    throttle_classes = [UserSlidingWindowThrottle]
+    throttle_scope = 'catalog'
+
+    def get_cache_tags(self, data):
+        return product_list_cache_tags(self.request.GET, data)
+
+    @aconditional(product_list_validators)
+    @acache_response()
+    async def get(self, request):
+        # Finding a mall's shard may read the shard map from the database
+        products = await afan_out(await sync_to_async(product_list_queryset)(request.GET))
+        return json_response(ProductSerializer(products, many=True, context={'request': request}).data)
+
+class AsyncProductDetailView(AsyncAPIView):
+    authentication_required = False
+
+    def get_cache_tags(self, data):
+        return product_cache_tags(data)
+
+    @aconditional(product_validators)
+    @acache_response()
+    async def get(self, request, pk):
+        product = await alocate(product_detail_queryset(), pk=pk)
+        if product is None:
+            return json_response({"detail": "No Product matches the given query."}, status=404)
+        return json_response(ProductDetailSerializer(product, context={'request': request}).data)
+
+class AsyncProductBarcodeView(AsyncAPIView):
+    authentication_required = False
+    throttle_classes = [DeviceSlidingWindowThrottle]
+    throttle_scope = 'scan'
+
+    def get_cache_tags(self, data):
+        return product_cache_tags(data)
+
+    @acache_response()
+    async def get(self, request, barcode):
+        product = await alocate(
+            product_detail_queryset().filter(is_available=True), barcode=barcode
+        )
+        if product is None:
+            return json_response(
+                {"error": "Product with this barcode not found or not available"}, status=404
+            )
+        return json_response(ProductDetailSerializer(product).data)
+
+class AsyncNearbyMallView(AsyncAPIView):
+
+    async def post(self, request):
+        try:
+            data = json.loads(request.body or b"{}")
+        except ValueError:
+            return json_response({"detail": "Malformed request body"}, status=400)
+
+        malls = await sync_to_async(nearby_malls)(data.get("latitude"), data.get("longitude"))
+        return json_response(malls)
+
+
+# Server-sent events, served with LIVE_EVENTS under paymall.asgi
+
+class ProductEventStreamView(AsyncAPIView):
+    """Stream stock and price changes of ?mall= and ?product= ids (both repeatable)"""
+    authentication_required = False
+    # Limits how often a client opens streams; LIVE_MAX_STREAMS_PER_CLIENT how many it holds
+    throttle_classes = [UserSlidingWindowThrottle]
+    throttle_scope = 'live'
+
+    async def get(self, request):
+        try:
+            malls = [int(pk) for pk in request.GET.getlist('mall')]
+            products = [int(pk) for pk in request.GET.getlist('product')]
+        except ValueError:
+            return json_response({"detail": "mall and product must be ids"}, status=400)
+        if not malls and not products:
+            return json_response({"detail": "Subscribe to at least one mall or product"}, status=400)
+        if len(malls) + len(products) > settings.LIVE_MAX_IDS:
+            return json_response({"detail": f"Subscribe to at most {settings.LIVE_MAX_IDS} ids"}, status=400)
+
+        user = request.user
+        client = f"user-{user.pk}" if user.is_authenticated else BaseThrottle().get_ident(request)
+        try:
+            subscription = broadcaster.subscribe(malls, products, client)
+        except TooManyStreams as e:
+            return json_response({"detail": str(e)}, status=429)
+
+        response = StreamingHttpResponse(EventStream(subscription), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Keep GZipMiddleware and proxies from buffering the stream
+        response['Content-Encoding'] = 'identity'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+class EventStream:
+    """
+    The SSE body of a subscription. Django closes it with the response,
+    which ends the subscription even if the stream never started.
+    """
+
+    def __init__(self, subscription):
+        self.subscription = subscription
+
+    def __aiter__(self):
+        return product_events(self.subscription)
+
+    def close(self):
+        self.subscription.close()
+
+async def product_events(subscription):
+    try:
+        yield f"retry: {settings.LIVE_RETRY_MS}\n\n"
+        while True:
+            try:
+                changes = await asyncio.wait_for(subscription.get(), settings.LIVE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: products\ndata: {ORJSONRenderer().render(changes).decode()}\n\n"
+    finally:
+        subscription.close()
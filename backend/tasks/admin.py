@@ -0,0 +1,29 @@
+from django.contrib import admin
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from paymall.admin import LargeTableAdmin
+
+from .models import Task
+
+
+class TaskAdmin(LargeTableAdmin):
+    list_display = ('name', 'status', 'attempts', 'max_attempts', 'run_at', 'locked_by', 'created_at', 'finished_at')
+    list_filter = ('status', 'name')
+    search_fields = ('name', 'dedupe_key')
+    readonly_fields = ('attempts', 'locked_by', 'locked_at', 'last_error', 'created_at', 'finished_at')
+    actions = ['retry']
+
+    @admin.action(description="Retry selected failed tasks now")
+    def retry(self, request, queryset):
+        retried = 0
+        for task in queryset.filter(status='FAILED'):
+            try:
+                with transaction.atomic():
+                    retried += Task.objects.filter(pk=task.pk, status='FAILED').update(
+                        status='QUEUED', attempts=0, run_at=timezone.now(), finished_at=None,
+                    )
+            except IntegrityError:
+                pass  # the same work is already queued
+        self.message_user(request, f"Queued {retried} task(s)")
+
+admin.site.register(Task, TaskAdmin)
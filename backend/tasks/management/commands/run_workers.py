@@ -0,0 +1,34 @@
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from tasks.worker import Worker
+
+
+class Command(BaseCommand):
+    help = "Run queued background tasks (see tasks/queue.py)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=settings.TASK_WORKERS,
+                            help="Tasks run at once (default: TASK_WORKERS)")
+        parser.add_argument('--pool', choices=('thread', 'process'), default=settings.TASK_POOL,
+                            help="Run tasks in threads, or in processes for CPU-bound work")
+        parser.add_argument('--poll-interval', type=float, default=settings.TASK_POLL_INTERVAL,
+                            help="Seconds between polls when the queue is empty")
+        parser.add_argument('--burst', action='store_true',
+                            help="Exit once no tasks are due instead of waiting for more")
+
+    def handle(self, *args, **options):
+        worker = Worker(
+            concurrency=options['concurrency'],
+            processes=options['pool'] == 'process',
+            poll_interval=options['poll_interval'],
+        )
+        # Finish the running tasks before exiting
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: worker.stop())
+
+        self.stdout.write(f"Worker {worker.name}: {worker.concurrency} {options['pool']}(s)")
+        worker.run(burst=options['burst'])
+        self.stdout.write(self.style.SUCCESS(f"Worker {worker.name} stopped"))
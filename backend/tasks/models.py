@@ -0,0 +1,46 @@
+from django.db import models
+from django.utils import timezone
+
+
+class Task(models.Model):
+    """Deferred function call, run by ``manage.py run_workers``"""
+    STATUS = (
+        ('QUEUED', 'Queued'),
+        ('RUNNING', 'Running'),
+        ('DONE', 'Done'),
+        ('FAILED', 'Failed'),
+    )
+
+    # Dotted path of a function registered with tasks.queue.task
+    name = models.CharField(max_length=200)
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    # At most one queued task per key
+    dedupe_key = models.CharField(max_length=200, null=True, blank=True)
+
+    status = models.CharField(max_length=20, choices=STATUS, default='QUEUED')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Workers polling for due tasks
+            models.Index(fields=['run_at'], condition=models.Q(status='QUEUED'), name='task_queued_run_at_idx'),
+            # Recovering tasks from workers that died mid-run
+            models.Index(fields=['locked_at'], condition=models.Q(status='RUNNING'), name='task_running_locked_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dedupe_key'], condition=models.Q(status='QUEUED'), name='task_queued_dedupe_key',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
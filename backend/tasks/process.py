@@ -0,0 +1,11 @@
+"""Process pool entry points; importable before Django is set up"""
+import django
+
+
+def init():
+    django.setup()
+
+
+def execute(pk):
+    from .worker import execute_in_pool
+    execute_in_pool(pk)
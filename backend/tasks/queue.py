@@ -0,0 +1,100 @@
+"""
+Database-backed task queue.
+
+Register a function with ``@task`` in an app's ``tasks.py`` and call
+``function.delay(*args, **kwargs)`` from a request handler: the ``Task`` row
+is inserted once the surrounding transaction commits (pass ``using=`` for a
+transaction on another database, such as a shard), so the handler
+returns without waiting for the work and a rolled-back request enqueues
+nothing. ``manage.py run_workers`` runs queued tasks, retrying failures with
+exponential backoff (see ``tasks.worker``).
+
+Arguments are stored as JSON, so pass ids rather than model instances.
+Tasks may run more than once (a worker can die after the work but before
+marking it done) and should be idempotent.
+
+``@task(dedupe=True)`` keeps at most one queued task per function and
+arguments; ``@task(every=timedelta(...))`` re-queues the function that long
+after each run.
+"""
+import datetime
+import hashlib
+import json
+from functools import partial, update_wrapper
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import Task
+
+registry = {}
+
+
+def enqueue(name, args=(), kwargs=None, dedupe_key=None, run_at=None, max_attempts=None):
+    """
+    Insert a task now. With a ``dedupe_key`` that is already queued, return
+    the queued task instead of adding another.
+    """
+    fields = {
+        'name': name,
+        'args': list(args),
+        'kwargs': kwargs or {},
+        'dedupe_key': dedupe_key,
+        'run_at': run_at or timezone.now(),
+        'max_attempts': max_attempts or settings.TASK_MAX_ATTEMPTS,
+    }
+    if dedupe_key is None:
+        return Task.objects.create(**fields)
+    try:
+        with transaction.atomic():
+            return Task.objects.create(**fields)
+    except IntegrityError:
+        return Task.objects.filter(dedupe_key=dedupe_key, status='QUEUED').first()
+
+
+class TaskFunction:
+    def __init__(self, func, max_attempts=None, every=None, dedupe=False):
+        update_wrapper(self, func)
+        self.func = func
+        self.name = f"{func.__module__}.{func.__qualname__}"
+        self.max_attempts = max_attempts
+        self.every = every
+        self.dedupe = dedupe
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def dedupe_key(self, args, kwargs):
+        if self.every:
+            return f"periodic:{self.name}"
+        if not self.dedupe:
+            return None
+        payload = json.dumps([args, kwargs], sort_keys=True, default=str)
+        return f"{self.name}:{hashlib.md5(payload.encode(), usedforsecurity=False).hexdigest()}"
+
+    def enqueue(self, args=(), kwargs=None, countdown=0, run_at=None):
+        """Insert the task now, to run ``countdown`` seconds from now or at ``run_at``"""
+        if run_at is None:
+            run_at = timezone.now() + datetime.timedelta(seconds=countdown)
+        return enqueue(
+            self.name, args, kwargs, dedupe_key=self.dedupe_key(list(args), kwargs or {}),
+            run_at=run_at, max_attempts=self.max_attempts,
+        )
+
+    def delay(self, *args, using=None, **kwargs):
+        """
+        Enqueue when the current transaction on database ``using`` (default)
+        commits, or at once outside one
+        """
+        transaction.on_commit(partial(self.enqueue, args, kwargs), using=using)
+
+
+def task(func=None, *, max_attempts=None, every=None, dedupe=False):
+    """Register ``func`` as a task; see the module docstring for the options"""
+    def register(func):
+        function = TaskFunction(func, max_attempts=max_attempts, every=every, dedupe=dedupe)
+        registry[function.name] = function
+        return function
+
+    return register(func) if func is not None else register
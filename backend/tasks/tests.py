@@ -0,0 +1,128 @@
+from concurrent.futures import Executor, Future
+from datetime import timedelta
+
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from .models import Task
+from .queue import task
+from .worker import Worker, execute
+
+calls = []
+
+
+@task(dedupe=True)
+def record(value):
+    calls.append(value)
+
+
+@task(max_attempts=2)
+def explode():
+    raise RuntimeError("boom")
+
+
+@task(every=timedelta(minutes=5))
+def tick():
+    calls.append('tick')
+
+
+@override_settings(TASK_RETRY_BACKOFF=30, TASK_RETRY_BACKOFF_MAX=3600, TASK_LOCK_TIMEOUT=60)
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+        self.worker = Worker(concurrency=4, name='test-worker')
+
+    def run_due(self):
+        for pk in self.worker.claim(10):
+            execute(pk)
+
+    def test_delay_waits_for_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            record.delay(1)
+            self.assertFalse(Task.objects.exists())
+        self.assertEqual(Task.objects.get().args, [1])
+
+    def test_dedupe(self):
+        first = record.enqueue([1])
+        self.assertEqual(record.enqueue([1]), first)
+        record.enqueue([2])
+        self.assertEqual(Task.objects.filter(status='QUEUED').count(), 2)
+
+        # Once the first has run, the same call may be queued again
+        self.run_due()
+        self.assertNotEqual(record.enqueue([1]), first)
+
+    def test_runs_due_tasks_only(self):
+        record.enqueue([1])
+        later = record.enqueue([2], countdown=60)
+        self.run_due()
+
+        self.assertEqual(calls, [1])
+        done = Task.objects.get(status='DONE')
+        self.assertEqual(done.attempts, 1)
+        self.assertIsNotNone(done.finished_at)
+        self.assertEqual(Task.objects.get(pk=later.pk).status, 'QUEUED')
+
+    def test_retries_with_backoff_then_fails(self):
+        pk = explode.enqueue().pk
+        with self.assertLogs('tasks.worker', 'ERROR'):
+            self.run_due()
+        retry = Task.objects.get(pk=pk)
+        self.assertEqual((retry.status, retry.attempts), ('QUEUED', 1))
+        self.assertIn("RuntimeError: boom", retry.last_error)
+        self.assertAlmostEqual((retry.run_at - timezone.now()).total_seconds(), 30, delta=5)
+
+        Task.objects.filter(pk=pk).update(run_at=timezone.now())
+        with self.assertLogs('tasks.worker', 'ERROR'):
+            self.run_due()
+        failed = Task.objects.get(pk=pk)
+        self.assertEqual((failed.status, failed.attempts), ('FAILED', 2))
+
+    def test_claim_is_exclusive(self):
+        record.enqueue([1])
+        self.assertEqual(len(self.worker.claim(10)), 1)
+        self.assertEqual(Worker(name='other').claim(10), [])
+
+    def test_recovers_tasks_of_lost_workers(self):
+        pk = record.enqueue([1]).pk
+        self.worker.claim(10)
+        Task.objects.filter(pk=pk).update(locked_at=timezone.now() - timedelta(minutes=5))
+
+        self.worker.recover_expired()
+        task = Task.objects.get(pk=pk)
+        self.assertEqual(task.status, 'QUEUED')
+        self.assertIn("test-worker", task.last_error)
+
+    def test_periodic_task_requeues_itself(self):
+        self.worker.schedule_periodic()
+        self.worker.schedule_periodic()
+        self.assertEqual(Task.objects.filter(name=tick.name).count(), 1)
+
+        self.run_due()
+        self.assertEqual(calls, ['tick'])
+        upcoming = Task.objects.get(name=tick.name, status='QUEUED')
+        self.assertGreater(upcoming.run_at, timezone.now() + timedelta(minutes=4))
+
+
+class InlineExecutor(Executor):
+    # SQLite's shared in-memory test database can't take writes from pool threads reliably
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+class WorkerRunTests(TransactionTestCase):
+    def test_burst_runs_queue(self):
+        calls.clear()
+        for value in range(5):
+            record.enqueue([value])
+        worker = Worker(concurrency=2, poll_interval=0.01)
+        worker.executor = InlineExecutor
+        worker.run(burst=True)
+
+        self.assertCountEqual(calls, [0, 1, 2, 3, 4, 'tick'])
+        self.assertFalse(Task.objects.filter(status__in=['RUNNING', 'FAILED']).exists())
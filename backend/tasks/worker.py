@@ -0,0 +1,191 @@
+"""
+Task worker.
+
+A ``Worker`` polls the ``Task`` table and runs due tasks in a thread or
+process pool of ``concurrency`` slots, claiming only as many as it has free
+slots so nothing it holds sits waiting behind a long task. Claims are a
+conditional UPDATE (or ``SELECT ... FOR UPDATE SKIP LOCKED`` where the
+database supports it), so any number of workers can share one queue.
+
+A failed task is queued again after ``TASK_RETRY_BACKOFF * 2**(attempts - 1)``
+seconds, capped at ``TASK_RETRY_BACKOFF_MAX``, until ``max_attempts`` is
+reached and it is marked FAILED. A task still RUNNING after
+``TASK_LOCK_TIMEOUT`` seconds is assumed lost with its worker and counts as
+a failed attempt.
+"""
+import datetime
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import traceback
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from paymall.routers import replica_reads
+from . import process
+from .models import Task
+from .queue import registry
+
+logger = logging.getLogger(__name__)
+
+
+def retry_delay(attempts):
+    """Seconds to wait before the next attempt after ``attempts`` failures"""
+    return min(settings.TASK_RETRY_BACKOFF * 2 ** (attempts - 1), settings.TASK_RETRY_BACKOFF_MAX)
+
+
+def _finish(task, status, **fields):
+    """Move a RUNNING task this worker still holds to ``status``"""
+    now = timezone.now()
+    if status != 'QUEUED':
+        fields['finished_at'] = now
+    function = registry.get(task.name)
+    try:
+        with transaction.atomic():
+            updated = Task.objects.filter(pk=task.pk, status='RUNNING', locked_by=task.locked_by).update(
+                status=status, locked_at=None, **fields,
+            )
+            if updated and status != 'QUEUED' and function is not None and function.every:
+                function.enqueue(task.args, task.kwargs, run_at=now + function.every)
+    except IntegrityError:
+        # Requeuing collided with an identical task queued meanwhile, which will do the work
+        Task.objects.filter(pk=task.pk, status='RUNNING').update(
+            status='DONE', locked_at=None, finished_at=now, last_error=fields.get('last_error', ''),
+        )
+
+
+def fail(task, error):
+    if task.attempts >= task.max_attempts:
+        logger.error("Task %s #%s failed after %s attempts", task.name, task.pk, task.attempts)
+        _finish(task, 'FAILED', last_error=error)
+    else:
+        run_at = timezone.now() + datetime.timedelta(seconds=retry_delay(task.attempts))
+        _finish(task, 'QUEUED', last_error=error, run_at=run_at)
+
+
+def execute(pk):
+    """Run a claimed task and record the outcome"""
+    task = Task.objects.get(pk=pk)
+    function = registry.get(task.name)
+    try:
+        if function is None:
+            raise LookupError(f"No task registered as {task.name!r}")
+        # Like a request: replica reads until the task writes, and no pin left for the next one
+        with replica_reads():
+            function.func(*task.args, **task.kwargs)
+    except Exception:
+        logger.exception("Task %s #%s raised", task.name, task.pk)
+        fail(task, traceback.format_exc())
+    else:
+        _finish(task, 'DONE', last_error='')
+
+
+def execute_in_pool(pk):
+    # Pool threads/processes keep a connection each, like request threads
+    close_old_connections()
+    try:
+        execute(pk)
+    finally:
+        close_old_connections()
+
+
+class Worker:
+    def __init__(self, concurrency=None, processes=False, poll_interval=None, name=None):
+        self.concurrency = concurrency or settings.TASK_WORKERS
+        self.processes = processes
+        self.poll_interval = settings.TASK_POLL_INTERVAL if poll_interval is None else poll_interval
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.stopping = threading.Event()
+        self._purged_at = None
+
+    def stop(self):
+        """Stop claiming tasks; run() returns once the running ones finish"""
+        self.stopping.set()
+
+    def claim(self, limit):
+        """Mark up to ``limit`` due tasks as ours; returns their ids"""
+        now = timezone.now()
+        due = Task.objects.filter(status='QUEUED', run_at__lte=now).order_by('run_at')
+        claim = {'status': 'RUNNING', 'locked_by': self.name, 'locked_at': now, 'attempts': F('attempts') + 1}
+
+        if connection.features.has_select_for_update_skip_locked:
+            with transaction.atomic():
+                pks = list(due.select_for_update(skip_locked=True).values_list('pk', flat=True)[:limit])
+                Task.objects.filter(pk__in=pks).update(**claim)
+            return pks
+
+        # Optimistic: whichever worker's UPDATE matches the QUEUED row first wins it
+        pks = []
+        for pk in due.values_list('pk', flat=True)[:limit * 2]:
+            if len(pks) == limit:
+                break
+            if Task.objects.filter(pk=pk, status='QUEUED').update(**claim):
+                pks.append(pk)
+        return pks
+
+    def recover_expired(self):
+        cutoff = timezone.now() - datetime.timedelta(seconds=settings.TASK_LOCK_TIMEOUT)
+        for task in Task.objects.filter(status='RUNNING', locked_at__lt=cutoff):
+            logger.warning("Task %s #%s held by %s timed out", task.name, task.pk, task.locked_by)
+            fail(task, f"Lock held by {task.locked_by} expired")
+
+    def schedule_periodic(self):
+        """Queue every periodic task not queued already"""
+        for function in registry.values():
+            if function.every:
+                function.enqueue()
+
+    def purge_finished(self):
+        now = timezone.now()
+        if self._purged_at and (now - self._purged_at).total_seconds() < 60:
+            return
+        self._purged_at = now
+        cutoff = now - datetime.timedelta(seconds=settings.TASK_KEEP_DONE)
+        Task.objects.filter(status='DONE', finished_at__lt=cutoff).delete()
+
+    def executor(self):
+        if self.processes:
+            # Spawned, not forked, so children never share the parent's database connections
+            return ProcessPoolExecutor(
+                self.concurrency, mp_context=multiprocessing.get_context('spawn'), initializer=process.init,
+            )
+        return ThreadPoolExecutor(self.concurrency, thread_name_prefix='paymall-task')
+
+    def submit(self, pool, pk):
+        return pool.submit(process.execute if self.processes else execute_in_pool, pk)
+
+    def run(self, burst=False):
+        """Run tasks until stop(); with ``burst``, until none are due"""
+        self.schedule_periodic()
+        running = set()
+        with self.executor() as pool:
+            while not self.stopping.is_set():
+                for future in [future for future in running if future.done()]:
+                    running.discard(future)
+                    if future.exception():
+                        logger.error("Task bookkeeping failed", exc_info=future.exception())
+
+                try:
+                    self.recover_expired()
+                    self.purge_finished()
+                    claimed = self.claim(self.concurrency - len(running)) if len(running) < self.concurrency else []
+                except DatabaseError:
+                    # e.g. a locked SQLite database; tasks we hold are recovered by the lock timeout
+                    logger.exception("Polling the task queue failed")
+                    claimed = []
+                running.update(self.submit(pool, pk) for pk in claimed)
+
+                if burst and not running:
+                    break
+                if not claimed:
+                    if running:
+                        wait(running, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                    else:
+                        self.stopping.wait(self.poll_interval)